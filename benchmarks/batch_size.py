@@ -0,0 +1,264 @@
+'''
+Batch size and volume size finder for a training config: searches the largest batch size (and optionally the largest
+cubic volume, in multiples of division_factor) which fits into a memory budget with real training steps, and writes
+a suggested config with the result.
+
+    python -m benchmarks.batch_size -c configs/3D/all_maps_config_unet_pct_multi_att_dsv.json --cuda
+    python -m benchmarks.batch_size -c configs/3D/all_maps_config_unet_pct_multi_att_dsv.json --search_size --budget 16000
+
+Every trial runs a few forward/backward/optimizer steps of the network in a fresh process and measures the peak
+memory (allocated memory on GPU, resident memory above the memory of the process after imports on CPU) and the
+throughput. 2.5D networks are trained on all slabs of the subjects of a batch, their trials run batch size x slabs
+network inputs. Batch sizes and volume sizes are doubled
+until a trial fails or exceeds the budget, and the boundary is then bisected. Among the batch sizes which fit, the
+largest one whose throughput is within a tolerance of the best throughput is suggested.
+'''
+
+import os
+import json
+import time
+from types import SimpleNamespace
+import torch
+
+from benchmarks.utils import get_peak_rss, run_isolated
+from benchmarks.networks import get_input_shape
+from benchmarks.memory import get_config_settings
+from models.networks import get_network
+from models.networks_other import synchronize
+from models.utils import get_optimizer
+from utils.utils import json_file_to_pyobj
+
+
+def run_trial(name, tensor_dim, input_shape, network_kwargs, optimizer_kwargs, n_steps=3, n_warmup=1,
+              use_cuda=False):
+    '''
+    Run training steps of a network on random data
+    :param optimizer_kwargs: dict of optim, lr_rate and l2_reg_weight, see models.utils.get_optimizer
+    :return: dict of the peak memory (MB) and the throughput (network inputs/s)
+    '''
+    torch.manual_seed(0)
+    device = 'cuda' if use_cuda else 'cpu'
+    # memory of the interpreter and the imported libraries
+    baseline_rss = get_peak_rss()
+    if use_cuda:
+        if hasattr(torch.cuda, 'reset_peak_memory_stats'):
+            torch.cuda.reset_peak_memory_stats()
+        else:
+            torch.cuda.reset_max_memory_allocated()
+    net = get_network(name, tensor_dim=tensor_dim, **network_kwargs).to(device)
+    net.train()
+    optimizer = get_optimizer(SimpleNamespace(**optimizer_kwargs), net.parameters())
+    x = torch.randn(*input_shape, device=device)
+
+    def step():
+        optimizer.zero_grad()
+        output = net(x)
+        loss = sum(o.mean() for o in output) if isinstance(output, tuple) else output.mean()
+        loss.backward()
+        optimizer.step()
+
+    for _ in range(n_warmup):
+        step()
+    synchronize(x)
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        step()
+    synchronize(x)
+    elapsed = time.perf_counter() - start
+
+    if use_cuda:
+        peak = torch.cuda.max_memory_allocated() / 1024 ** 2
+    else:
+        peak = get_peak_rss() - baseline_rss
+    return {'input_shape': list(input_shape), 'peak_mb': peak,
+            'samples_per_s': n_steps * input_shape[0] / max(elapsed, 1e-12)}
+
+
+class TrialRunner(object):
+    """
+    Runs (and caches) isolated trials of a network for batch sizes and volume sizes
+    """
+
+    def __init__(self, name, tensor_dim, network_kwargs, optimizer_kwargs, budget, n_steps=3, n_warmup=1,
+                 use_cuda=False):
+        self.name = name
+        self.tensor_dim = tensor_dim
+        self.network_kwargs = network_kwargs
+        self.optimizer_kwargs = optimizer_kwargs
+        self.budget = budget
+        self.n_steps = n_steps
+        self.n_warmup = n_warmup
+        self.use_cuda = use_cuda
+        self.trials = {}
+
+    def run(self, size, batch_size):
+        '''
+        :return: dict of the trial, 'fits' is False if the trial failed (eg. out of memory) or exceeded the budget
+        '''
+        key = (tuple(size), batch_size)
+        if key in self.trials:
+            return self.trials[key]
+        # the 2.5D training scripts train on all slabs of the subjects of a batch at once
+        input_nz = self.network_kwargs.get('input_nz', 5)
+        n_slabs = get_n_slabs(self.name, size, input_nz)
+        input_shape = get_input_shape(self.name, self.tensor_dim, size, batch_size * n_slabs,
+                                      self.network_kwargs['in_channels'], input_nz)
+        result, error = run_isolated(run_trial, self.name, self.tensor_dim, input_shape, self.network_kwargs,
+                                     self.optimizer_kwargs, n_steps=self.n_steps, n_warmup=self.n_warmup,
+                                     use_cuda=self.use_cuda)
+        trial = {'size': list(size), 'batch_size': batch_size, 'network_batch_size': batch_size * n_slabs}
+        if error is not None:
+            trial.update({'fits': False, 'error': error})
+            print('size {0} batch size {1}: failed ({2})'.format('x'.join(map(str, size)), batch_size, error))
+        else:
+            # throughput in subjects
+            result['samples_per_s'] /= n_slabs
+            trial.update({**result, 'fits': result['peak_mb'] <= self.budget})
+            print('size {0} batch size {1}: peak {2:.0f} MB of {3:.0f} MB, {4:.2f} samples/s'.format(
+                'x'.join(map(str, size)), batch_size, result['peak_mb'], self.budget, result['samples_per_s']))
+        self.trials[key] = trial
+        return trial
+
+
+def get_n_slabs(name, size, input_nz):
+    '''
+    :return: number of 2.5D slabs of a volume (see to_slabs of the 2.5D dataset), 1 for other networks
+    '''
+    if '25D' not in name:
+        return 1
+    return size[2] - 2 * int(input_nz / 2)
+
+
+def search_largest(fits, start, maximum):
+    '''
+    Largest integer n in [start, maximum] with fits(n), doubling from start and then bisecting, assuming that fits
+    is monotonic
+    :return: n, None if fits(start) is False
+    '''
+    if not fits(start):
+        return None
+    low, high = start, None
+    while high is None and low < maximum:
+        candidate = min(2 * low, maximum)
+        if fits(candidate):
+            low = candidate
+        else:
+            high = candidate
+    while high is not None and high - low > 1:
+        candidate = (low + high) // 2
+        if fits(candidate):
+            low = candidate
+        else:
+            high = candidate
+    return low
+
+
+def get_scaled_size(size, multiple, division_factor, scaled_axes):
+    return [multiple * division_factor] * scaled_axes + list(size[scaled_axes:])
+
+
+def find_settings(runner, size, batch_size, search_size=False, division_factor=16, max_batch_size=64,
+                  max_size=256, tolerance=0.05):
+    '''
+    :param size: (x, y, z) volume size of the config
+    :param batch_size: batch size of the volume size search
+    :param search_size: search the largest cubic (square for 2D and 2.5D networks) volume first
+    :param tolerance: the suggested batch size is the largest one with a throughput within tolerance of the best
+    :return: dict of the suggested size and batch size and all trials
+    '''
+    scaled_axes = 2 if runner.tensor_dim == '2D' or '25D' in runner.name else 3
+    if search_size:
+        multiple = search_largest(
+            lambda m: runner.run(get_scaled_size(size, m, division_factor, scaled_axes), batch_size)['fits'],
+            1, max(1, max_size // division_factor))
+        if multiple is None:
+            raise Exception('The smallest volume size {0} does not fit into {1:.0f} MB with batch size {2}'.format(
+                get_scaled_size(size, 1, division_factor, scaled_axes), runner.budget, batch_size))
+        size = get_scaled_size(size, multiple, division_factor, scaled_axes)
+
+    largest_batch_size = search_largest(lambda n: runner.run(size, n)['fits'], 1, max_batch_size)
+    if largest_batch_size is None:
+        raise Exception('Batch size 1 at size {0} does not fit into {1:.0f} MB'.format(size, runner.budget))
+    fitting = [trial for trial in runner.trials.values()
+               if trial['fits'] and trial['size'] == list(size) and trial['batch_size'] <= largest_batch_size]
+    best = max(trial['samples_per_s'] for trial in fitting)
+    suggested = max((trial for trial in fitting if trial['samples_per_s'] >= (1 - tolerance) * best),
+                    key=lambda trial: trial['batch_size'])
+    return {'size': list(size), 'batch_size': suggested['batch_size'], 'largest_batch_size': largest_batch_size,
+            'peak_mb': suggested['peak_mb'], 'samples_per_s': suggested['samples_per_s'],
+            'best_samples_per_s': best, 'trials': list(runner.trials.values())}
+
+
+def get_default_budget(use_cuda, headroom=0.1):
+    '''
+    :return: device memory (or physical memory on CPU) minus headroom (MB)
+    '''
+    if use_cuda:
+        total = torch.cuda.get_device_properties(0).total_memory
+    else:
+        total = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    return (1 - headroom) * total / 1024 ** 2
+
+
+def write_suggested_config(config_path, output_path, size, batch_size):
+    '''
+    Copy of a config with the suggested training.batchSize and augmentation scale_size
+    '''
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+    config['training']['batchSize'] = batch_size
+    augmentation = config['augmentation'][config['training']['arch_type']]
+    augmentation['scale_size'] = list(size) + augmentation['scale_size'][len(size):]
+    with open(output_path, 'w') as output_file:
+        json.dump(config, output_file, indent=2)
+
+
+def main(arguments):
+    json_opts = json_file_to_pyobj(arguments.config)
+    name, tensor_dim, size, batch_size, network_kwargs, division_factor = get_config_settings(json_opts)
+    model_opts = json_opts.model
+    optimizer_kwargs = {'optim': model_opts.optim if hasattr(model_opts, 'optim') else 'sgd',
+                        'lr_rate': model_opts.lr_rate, 'l2_reg_weight': model_opts.l2_reg_weight}
+    budget = arguments.budget if arguments.budget is not None else get_default_budget(arguments.cuda,
+                                                                                      arguments.headroom)
+
+    runner = TrialRunner(name, tensor_dim, network_kwargs, optimizer_kwargs, budget, n_steps=arguments.steps,
+                         n_warmup=arguments.warmup, use_cuda=arguments.cuda)
+    result = find_settings(runner, size, batch_size, search_size=arguments.search_size,
+                           division_factor=division_factor, max_batch_size=arguments.max_batch_size,
+                           max_size=arguments.max_size, tolerance=arguments.tolerance)
+    print('Suggested: size {0}, batch size {1} ({2:.2f} samples/s, peak {3:.0f} MB of {4:.0f} MB, '
+          'largest fitting batch size {5})'.format('x'.join(map(str, result['size'])), result['batch_size'],
+                                                   result['samples_per_s'], result['peak_mb'], budget,
+                                                   result['largest_batch_size']))
+
+    output = arguments.output if arguments.output is not None else \
+        os.path.splitext(arguments.config)[0] + '_suggested.json'
+    write_suggested_config(arguments.config, output, result['size'], result['batch_size'])
+    print('Suggested config written to {0}'.format(output))
+    if arguments.report is not None:
+        with open(arguments.report, 'w') as report_file:
+            json.dump({'config': arguments.config, 'network': name, 'tensor_dim': tensor_dim, 'budget_mb': budget,
+                       **result}, report_file, indent=2)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Largest batch size (and volume size) of a config which fits into a memory budget')
+
+    parser.add_argument('-c', '--config',       help='training config file', required=True)
+    parser.add_argument('-o', '--output',       help='suggested config file (default: <config>_suggested.json)', default=None)
+    parser.add_argument('--report',             help='json file to write all trials to', default=None)
+    parser.add_argument('--budget',             help='memory budget (MB), default: device (or physical) memory minus headroom', type=float, default=None)
+    parser.add_argument('--headroom',           help='fraction of the memory kept free if no budget is given', type=float, default=0.1)
+    parser.add_argument('--cuda',               help='run the trials on the GPU', action='store_true')
+    parser.add_argument('--search_size',        help='search the largest cubic volume (at the batch size of the config) first', action='store_true')
+    parser.add_argument('--max_size',           help='largest volume size of the search', type=int, default=256)
+    parser.add_argument('--max_batch_size',     help='largest batch size of the search', type=int, default=64)
+    parser.add_argument('--tolerance',          help='suggest the largest batch size with a throughput within this fraction of the best', type=float, default=0.05)
+    parser.add_argument('--steps',              help='timed training steps per trial', type=int, default=3)
+    parser.add_argument('--warmup',             help='warmup training steps per trial', type=int, default=1)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,168 @@
+'''
+Regression gate between benchmark results: compares the results of a new run with a stored baseline and exits with
+a non-zero status if a measurement got worse than its tolerance allows.
+
+    python -m benchmarks.compare -b baseline_1.json baseline_2.json -n new_1.json new_2.json
+
+Several files of the same benchmark are repeated runs. Every measurement is reduced to the median over the runs of
+the per-run medians, and the tolerance is widened to the spread of the baseline runs, so that noisy measurements
+need a larger change to fail.
+'''
+
+import sys
+import json
+import statistics
+
+
+# configuration fields identifying a result and measurements compared (lower is better), with default relative
+# tolerances, for every benchmark writing json results
+BENCHMARKS = {
+    'networks': {'keys': ['network', 'tensor_dim', 'size', 'batch_size', 'threads'],
+                 'metrics': {'forward.median_ms': 0.10, 'backward.median_ms': 0.10, 'peak_rss_mb': 0.05}},
+    'data_pipeline': {'keys': ['split', 'transform', 'preload', 'num_workers', 'batch_size'],
+                      'metrics': {'ms_per_sample': 0.15, 'io_ms': 0.15, 'augmentation_ms': 0.15, 'collate_ms': 0.20,
+                                  'peak_worker_rss_mb': 0.10}},
+}
+
+
+def get_value(result, metric):
+    value = result
+    for key in metric.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def get_key(result, keys):
+    return tuple(json.dumps(result.get(key)) for key in keys)
+
+
+def load_runs(filenames):
+    '''
+    :param filenames: result files of repeated runs of the same benchmark
+    :return: name of the benchmark, list of environments, dict key -> list of results (one per run)
+    '''
+    benchmark = None
+    environments = []
+    runs = {}
+    for filename in filenames:
+        with open(filename) as result_file:
+            results = json.load(result_file)
+        if 'benchmark' not in results or 'results' not in results:
+            raise Exception('{0} is not a result file of benchmarks.networks or benchmarks.data_pipeline'.format(filename))
+        name = results['benchmark']
+        if name not in BENCHMARKS:
+            raise NotImplementedError(f'{name} is not implemented, use one of {list(BENCHMARKS.keys())}')
+        if benchmark is not None and name != benchmark:
+            raise Exception('Results of different benchmarks can not be combined ({0} and {1})'.format(benchmark, name))
+        benchmark = name
+        environments.append(results.get('environment'))
+        for result in results['results']:
+            runs.setdefault(get_key(result, BENCHMARKS[name]['keys']), []).append(result)
+    return benchmark, environments, runs
+
+
+def reduce_runs(results, metric):
+    '''
+    :return: median of the per-run values and relative spread (max - min) / median, None if no run has the value
+    '''
+    values = [get_value(result, metric) for result in results if 'error' not in result]
+    values = [value for value in values if value is not None]
+    if not values:
+        return None, None
+    median = float(statistics.median(values))
+    spread = (max(values) - min(values)) / median if median > 0 and len(values) > 1 else 0.0
+    return median, spread
+
+
+def compare(baseline_files, new_files, tolerances=None, default_tolerance=None, noise_factor=2.0):
+    '''
+    :param tolerances: dict metric -> relative tolerance overriding the defaults of the benchmark
+    :param default_tolerance: relative tolerance of all metrics without an explicit tolerance
+    :param noise_factor: the tolerance of a metric is at least noise_factor times the relative spread of its baseline
+     runs
+    :return: list of comparisons (dicts), True if no measurement regressed and at least one measurement was compared
+    '''
+    benchmark, baseline_environments, baseline_runs = load_runs(baseline_files)
+    new_benchmark, new_environments, new_runs = load_runs(new_files)
+    if benchmark != new_benchmark:
+        raise Exception('The baseline ({0}) and the new results ({1}) are of different benchmarks'.format(
+            benchmark, new_benchmark))
+    if baseline_environments[0] != new_environments[0]:
+        print('Warning: the baseline and the new results were measured on different environments')
+
+    keys = BENCHMARKS[benchmark]['keys']
+    metrics = BENCHMARKS[benchmark]['metrics']
+    tolerances = tolerances or {}
+
+    comparisons = []
+    passed = True
+    for key, baseline_results in baseline_runs.items():
+        config = dict(zip(keys, (json.loads(value) for value in key)))
+        new_results = new_runs.get(key)
+        for metric, metric_tolerance in metrics.items():
+            baseline, spread = reduce_runs(baseline_results, metric)
+            if baseline is None:
+                continue
+            tolerance = tolerances.get(metric, metric_tolerance if default_tolerance is None else default_tolerance)
+            tolerance = max(tolerance, noise_factor * spread)
+            new, _ = reduce_runs(new_results, metric) if new_results is not None else (None, None)
+            if new_results is None:
+                status, ratio = 'missing', None
+            elif new is None or any('error' in result for result in new_results):
+                # a configuration which ran in the baseline fails in (one of) the new runs
+                status, ratio = 'failed', None
+            else:
+                ratio = new / baseline if baseline > 0 else 1.0
+                status = 'regression' if ratio > 1 + tolerance else 'improvement' if ratio < 1 - tolerance else 'pass'
+            passed = passed and status in ['pass', 'improvement']
+            comparisons.append({**config, 'metric': metric, 'baseline': baseline, 'new': new, 'ratio': ratio,
+                                'tolerance': tolerance, 'status': status})
+    if not comparisons:
+        # the baseline has no measurement of the benchmark, nothing was checked
+        print('No measurement of the baseline could be compared')
+        passed = False
+    return comparisons, passed
+
+
+def print_report(comparisons, passed):
+    for comparison in comparisons:
+        config = ' '.join(str(value) for key, value in comparison.items()
+                          if key not in ['metric', 'baseline', 'new', 'ratio', 'tolerance', 'status'])
+        ratio = '{0:6.3f}'.format(comparison['ratio']) if comparison['ratio'] is not None else '     -'
+        new = '{0:10.2f}'.format(comparison['new']) if comparison['new'] is not None else '         -'
+        print('{0:<11} {1:<60} {2:<20} {3:10.2f} -> {4} ratio {5} (tolerance {6:.0%})'.format(
+            comparison['status'].upper(), config, comparison['metric'], comparison['baseline'], new, ratio,
+            comparison['tolerance']))
+    n_failed = sum(comparison['status'] not in ['pass', 'improvement'] for comparison in comparisons)
+    print('{0}: {1} of {2} comparisons failed'.format('PASS' if passed else 'FAIL', n_failed, len(comparisons)))
+
+
+def parse_tolerances(tolerances):
+    '''
+    :param tolerances: list of metric=tolerance
+    '''
+    return {metric: float(tolerance) for metric, tolerance in (item.split('=') for item in tolerances or [])}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare benchmark results with a baseline, fails on regressions')
+
+    parser.add_argument('-b', '--baseline',    help='result files of the baseline (repeated runs)', nargs='+', required=True)
+    parser.add_argument('-n', '--new',         help='result files to check (repeated runs)', nargs='+', required=True)
+    parser.add_argument('-t', '--tolerance',   help='relative tolerance of all metrics (default: per metric)', type=float, default=None)
+    parser.add_argument('-m', '--metric_tolerance', help='relative tolerance of a metric, eg. forward.median_ms=0.2', nargs='+', default=None)
+    parser.add_argument('--noise_factor',      help='minimum tolerance in multiples of the relative spread of the baseline runs', type=float, default=2.0)
+    parser.add_argument('-o', '--output',      help='json file to write the comparisons to', default=None)
+    args = parser.parse_args()
+
+    comparisons, passed = compare(args.baseline, args.new, tolerances=parse_tolerances(args.metric_tolerance),
+                                  default_tolerance=args.tolerance, noise_factor=args.noise_factor)
+    print_report(comparisons, passed)
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump({'passed': passed, 'comparisons': comparisons}, output_file, indent=2)
+    sys.exit(0 if passed else 1)
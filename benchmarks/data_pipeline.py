@@ -0,0 +1,205 @@
+'''
+Throughput of the data pipeline of a training config without a model: the dataset and transforms are built as in
+the training scripts and a DataLoader is iterated for every number of workers, with and without preloading.
+
+    python -m benchmarks.data_pipeline -c configs/3D/all_maps_config_unet_pct_multi_att_dsv.json -w 0 4 8 16
+
+Reported are samples/s and MB/s after the first batch, the time to the first batch, the time per sample spent
+loading (I/O), augmenting (transforms, and slab extraction of the 2.5D dataset) and collating, and the peak resident
+memory of every worker. If augmentation dominates and the throughput scales with the number of workers, add cores;
+if I/O dominates or the throughput saturates early, fix the pipeline.
+'''
+
+import json
+import time
+import multiprocessing
+from torch.utils.data import DataLoader
+from torch.utils.data.dataloader import default_collate
+
+from benchmarks.utils import get_peak_rss, get_current_rss, get_environment
+from dataio.loaders import get_dataset, get_dataset_path
+from dataio.loaders.utils import worker_init_fn
+from dataio.transformation import Transformations
+from dataio.transformation.transforms import PROFILED_TRANSFORMS
+from dataio.transformation.profiler import TransformProfiler, get_worker_id
+from utils.utils import json_file_to_pyobj
+
+
+class _TimedDataset(object):
+    """
+    Records the time spent in load_sample and in the whole __getitem__ of a dataset, and the largest resident memory of
+    every worker after a sample, in shared memory inherited by the (forked) workers
+    """
+
+    def __init__(self, dataset, profiler, max_workers=64):
+        self.dataset = dataset
+        self.profiler = profiler
+        self.max_workers = max_workers
+        self.rss = multiprocessing.RawArray('d', max_workers + 1)
+        load_sample = dataset.load_sample
+
+        def timed_load_sample(index):
+            start = time.perf_counter()
+            sample = load_sample(index)
+            profiler.record('io', time.perf_counter() - start)
+            return sample
+        dataset.load_sample = timed_load_sample
+
+    def __getitem__(self, index):
+        start = time.perf_counter()
+        item = self.dataset[index]
+        self.profiler.record('sample', time.perf_counter() - start)
+        worker_id = get_worker_id()
+        # the peak resident memory of a forked worker includes the peak of the main process before the fork
+        row = 0 if worker_id is None else worker_id % self.max_workers + 1
+        self.rss[row] = max(self.rss[row], get_current_rss())
+        return item
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def get_worker_rss(self):
+        return {('main' if row == 0 else 'worker_{}'.format(row - 1)): rss for row, rss in enumerate(self.rss) if rss > 0}
+
+
+class _TimedCollate(object):
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __call__(self, batch):
+        start = time.perf_counter()
+        batch = default_collate(batch)
+        self.profiler.record('collate', time.perf_counter() - start)
+        return batch
+
+
+def build_dataset(json_opts, split, transform, preload_data, seed=42):
+    '''
+    Dataset of a split as built by the training scripts
+    :param transform: 'train', 'valid' or None
+    :return: dataset, transform profiler (None without transform)
+    '''
+    train_opts = json_opts.training
+    arch_type = train_opts.arch_type
+    trans_obj = Transformations(arch_type)
+    trans_obj.initialise(json_opts.augmentation, json_opts.model.output_nc, verbose=False)
+    # time every transform
+    trans_obj.profilers = {split: TransformProfiler(PROFILED_TRANSFORMS) for split in ['train', 'valid']}
+    ds_transform = trans_obj.get_transformation()
+
+    split_opts = json_opts.data_split
+    dataset_kwargs = {'input_nz': json_opts.model.input_nz} if arch_type == 'gsd_pCT_25D' else {}
+    dataset = get_dataset(arch_type)(get_dataset_path(arch_type, json_opts.data_path), split=split,
+                                     transform=ds_transform[transform] if transform is not None else None,
+                                     preload_data=preload_data, train_size=split_opts.train_size,
+                                     test_size=split_opts.test_size, valid_size=split_opts.validation_size,
+                                     split_seed=split_opts.seed, channels=json_opts.data_opts.channels,
+                                     augmentation_seed=seed, **dataset_kwargs)
+    dataset.set_epoch(0)
+    return dataset, ds_transform['profilers'][transform] if transform is not None else None
+
+
+def benchmark_loader(dataset, profiler, transform_profiler, num_workers, batch_size, n_batches):
+    '''
+    Iterate n_batches batches of a DataLoader over the timed dataset
+    :return: dict of results
+    '''
+    profiler.reset()
+    if transform_profiler is not None:
+        transform_profiler.reset()
+    dataset.rss[:] = [0] * len(dataset.rss)
+    loader = DataLoader(dataset=dataset, num_workers=num_workers, batch_size=batch_size, shuffle=True,
+                        collate_fn=_TimedCollate(profiler), worker_init_fn=worker_init_fn)
+    n_batches = max(2, min(n_batches, len(loader)))
+
+    start = time.perf_counter()
+    iterator = iter(loader)
+    next(iterator)
+    first_batch = time.perf_counter() - start
+
+    # steady state, after the workers started
+    n_samples, n_bytes = 0, 0
+    start = time.perf_counter()
+    for _ in range(n_batches - 1):
+        try:
+            input, target, index = next(iterator)
+        except StopIteration:
+            break
+        n_samples += len(index)
+        n_bytes += input.numel() * input.element_size() + target.numel() * target.element_size()
+    elapsed = time.perf_counter() - start
+    # shut the workers down
+    del iterator
+
+    stats = profiler.get_stats()
+    io, sample, collate = [stats.get(name, {'time': 0.0, 'calls': 0}) for name in ['io', 'sample', 'collate']]
+    worker_rss = dataset.get_worker_rss()
+    result = {'samples_per_s': n_samples / max(elapsed, 1e-12), 'mb_per_s': n_bytes / 1024 ** 2 / max(elapsed, 1e-12),
+              'ms_per_sample': 1000 * elapsed / max(n_samples, 1), 'first_batch_s': first_batch,
+              'n_batches': n_batches,
+              # busy time per sample of one worker, summed over the pipeline stages
+              'io_ms': 1000 * io['time'] / max(io['calls'], 1),
+              'augmentation_ms': 1000 * (sample['time'] - io['time']) / max(sample['calls'], 1),
+              'collate_ms': 1000 * collate['time'] / max(collate['calls'], 1) / batch_size,
+              'worker_rss_mb': worker_rss,
+              'peak_worker_rss_mb': max(worker_rss.values()) if worker_rss else 0.0,
+              'main_rss_mb': get_peak_rss()}
+    if transform_profiler is not None:
+        result['transforms_ms'] = {name: stat['mean_ms'] for name, stat in transform_profiler.get_stats().items()}
+    return result
+
+
+def main(arguments):
+    json_opts = json_file_to_pyobj(arguments.config)
+    batch_size = arguments.batch_size if arguments.batch_size is not None else json_opts.training.batchSize
+    transforms = [None if transform == 'none' else transform for transform in arguments.transforms]
+
+    results = []
+    for preload_data in arguments.preload:
+        for transform in transforms:
+            start = time.perf_counter()
+            dataset, transform_profiler = build_dataset(json_opts, arguments.split, transform, preload_data,
+                                                        seed=arguments.seed)
+            build_time = time.perf_counter() - start
+            profiler = TransformProfiler(['io', 'sample', 'collate'])
+            timed_dataset = _TimedDataset(dataset, profiler)
+            for num_workers in arguments.workers:
+                config = {'split': arguments.split, 'transform': transform or 'none', 'preload': preload_data,
+                          'num_workers': num_workers, 'batch_size': batch_size}
+                result = benchmark_loader(timed_dataset, profiler, transform_profiler, num_workers, batch_size,
+                                          arguments.batches)
+                print('preload {0!s:<5} transform {1:<5} workers {2:<3} {3:8.2f} samples/s {4:9.1f} MB/s '
+                      'io {5:8.1f} ms augmentation {6:8.1f} ms collate {7:6.1f} ms per sample, '
+                      'first batch {8:6.1f} s, peak worker rss {9:7.0f} MB'.format(
+                    preload_data, transform or 'none', num_workers, result['samples_per_s'], result['mb_per_s'],
+                    result['io_ms'], result['augmentation_ms'], result['collate_ms'], result['first_batch_s'],
+                    result['peak_worker_rss_mb']))
+                results.append({**config, 'build_s': build_time, **result})
+
+    settings = {'config': arguments.config, 'arch_type': json_opts.training.arch_type, 'batches': arguments.batches,
+                'seed': arguments.seed}
+    with open(arguments.output, 'w') as output_file:
+        json.dump({'benchmark': 'data_pipeline', 'environment': get_environment(), 'settings': settings,
+                   'results': results}, output_file, indent=2)
+    print('Results written to {0}'.format(arguments.output))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Throughput of the data loading and augmentation pipeline of a config')
+
+    parser.add_argument('-c', '--config',     help='training config file', required=True)
+    parser.add_argument('-o', '--output',     help='output json file', default='benchmark_data_pipeline.json')
+    parser.add_argument('-w', '--workers',    help='numbers of data loader workers', nargs='+', type=int, default=[0, 2, 4, 8, 16])
+    parser.add_argument('--split',            help='split to load', choices=['train', 'validation', 'test'], default='train')
+    parser.add_argument('--transforms',       help='transforms to benchmark', nargs='+', choices=['train', 'valid', 'none'], default=['train'])
+    parser.add_argument('--preload',          help='preloading settings to benchmark', nargs='+', type=lambda s: s.lower() == 'true',
+                        default=[False, True])
+    parser.add_argument('-b', '--batch_size', help='batch size (default: training.batchSize)', type=int, default=None)
+    parser.add_argument('-n', '--batches',    help='batches per setting (at most one epoch)', type=int, default=50)
+    parser.add_argument('-s', '--seed',       help='augmentation seed', type=int, default=42)
+    args = parser.parse_args()
+
+    main(args)
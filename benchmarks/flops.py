@@ -0,0 +1,258 @@
+'''
+Hardware independent compute cost of a network: FLOPs and multiply-accumulates (MACs) of a forward pass, per module
+and in total, for a given input size.
+
+    python -m benchmarks.flops -n unet_pct_multi_att_dsv -s 96x96x96
+    python -m benchmarks.flops -n unet_pct_multi_att_dsv unet_grid_gating -s 96x96x96 --depth 2 -o flops.json
+
+Convolutions, transposed convolutions, normalisations, pooling and linear layers are counted by forward hooks.
+Functional operations (interpolation of Upsample modules and of the attention gates, matmuls of the non-local
+blocks, softmax, sigmoid, relu) are counted by wrapping the functions during the pass, and the elementwise sums and
+products of the grid attention and non-local blocks from their shapes. Every count is attributed to the innermost
+running module. A MAC counts as two FLOPs, other elementwise operations as one FLOP per output element.
+'''
+
+import json
+import contextlib
+from collections import OrderedDict
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from benchmarks.networks import get_input_shape, parse_size
+from models.networks import get_network, get_available_networks
+from models.networks_other import get_n_parameters
+from models.layers.grid_attention_layer import _GridAttentionBlockND, _GridAttentionBlockND_TORR
+from models.layers.nonlocal_layer import _NonLocalBlockND
+
+
+def numel(tensor):
+    return int(tensor.numel()) if torch.is_tensor(tensor) else 0
+
+
+def _conv_cost(module, inputs, output):
+    kernel = int(np.prod(module.kernel_size))
+    if isinstance(module, (nn.ConvTranspose1d, nn.ConvTranspose2d, nn.ConvTranspose3d)):
+        macs = numel(inputs[0]) * module.out_channels // module.groups * kernel
+    else:
+        macs = numel(output) * module.in_channels // module.groups * kernel
+    return macs, 2 * macs + (numel(output) if module.bias is not None else 0)
+
+
+def _norm_cost(module, inputs, output):
+    # normalise and scale/shift: one MAC per element, plus the statistics
+    return numel(output), 2 * numel(output) + (2 * numel(inputs[0]) if module.training else 0)
+
+
+def _pool_cost(module, inputs, output):
+    kernel = module.kernel_size if isinstance(module.kernel_size, tuple) else (module.kernel_size,)
+    return 0, numel(output) * int(np.prod(kernel))
+
+
+def _linear_cost(module, inputs, output):
+    macs = numel(output) * module.in_features
+    return macs, 2 * macs
+
+
+MODULE_COSTS = [
+    ((nn.Conv1d, nn.Conv2d, nn.Conv3d, nn.ConvTranspose1d, nn.ConvTranspose2d, nn.ConvTranspose3d), _conv_cost),
+    ((nn.BatchNorm1d, nn.BatchNorm2d, nn.BatchNorm3d, nn.InstanceNorm1d, nn.InstanceNorm2d, nn.InstanceNorm3d),
+     _norm_cost),
+    ((nn.MaxPool1d, nn.MaxPool2d, nn.MaxPool3d, nn.AvgPool1d, nn.AvgPool2d, nn.AvgPool3d), _pool_cost),
+    ((nn.Linear,), _linear_cost),
+]
+
+
+def _grid_attention_cost(module, inputs, output):
+    # theta_x + phi_g at the resolution of theta, and the attention coefficients times x
+    x = inputs[0]
+    theta_numel = numel(x) // x.shape[1] * module.inter_channels // int(np.prod(module.sub_sample_factor))
+    return 0, theta_numel + numel(x)
+
+
+def _nonlocal_cost(module, inputs, output):
+    # residual connection z = W_y + x
+    return 0, numel(inputs[0])
+
+
+BLOCK_COSTS = [
+    ((_GridAttentionBlockND, _GridAttentionBlockND_TORR), _grid_attention_cost),
+    ((_NonLocalBlockND,), _nonlocal_cost),
+]
+
+
+class FlopCounter(object):
+    """
+    Counts the FLOPs and MACs of a forward pass per module
+    """
+
+    def __init__(self, net):
+        self.net = net
+        self.names = {module: name for name, module in net.named_modules()}
+        self.stack = []
+        self.counts = OrderedDict()
+        self.handles = []
+        # functions called by counted functions (F.sigmoid -> torch.sigmoid) are not counted twice
+        self.in_function = False
+
+    def add(self, macs, flops, module=None):
+        name = self.names[module] if module is not None else (self.stack[-1] if self.stack else '')
+        macs_, flops_ = self.counts.get(name, (0, 0))
+        self.counts[name] = (macs_ + int(macs), flops_ + int(flops))
+
+    def pre_hook(self, module, inputs):
+        self.stack.append(self.names[module])
+
+    def get_hook(self, cost):
+        def hook(module, inputs, output):
+            if cost is not None:
+                self.add(*cost(module, inputs, output), module=module)
+            self.stack.pop()
+        return hook
+
+    def get_cost(self, module):
+        for types, cost in MODULE_COSTS + BLOCK_COSTS:
+            if isinstance(module, types):
+                return cost
+        return None
+
+    def wrap(self, function, cost):
+        def counted(*args, **kwargs):
+            if self.in_function:
+                return function(*args, **kwargs)
+            self.in_function = True
+            try:
+                output = function(*args, **kwargs)
+            finally:
+                self.in_function = False
+            self.add(*cost(args, kwargs, output))
+            return output
+        return counted
+
+    @contextlib.contextmanager
+    def patch_functions(self):
+        def interpolation_cost(args, kwargs, output):
+            mode = kwargs.get('mode', args[3] if len(args) > 3 else 'nearest')
+            # linear interpolation weighs 2^d neighbours
+            macs = 0 if mode == 'nearest' else numel(output) * 2 ** (output.dim() - 2)
+            return macs, 2 * macs
+
+        def matmul_cost(args, kwargs, output):
+            macs = numel(output) * args[0].shape[-1]
+            return macs, 2 * macs
+
+        def elementwise_cost(flops_per_element):
+            return lambda args, kwargs, output: (0, flops_per_element * numel(output))
+
+        patches = [(F, 'interpolate', interpolation_cost), (torch, 'matmul', matmul_cost), (torch, 'bmm', matmul_cost),
+                   (F, 'softmax', elementwise_cost(3)), (F, 'sigmoid', elementwise_cost(1)),
+                   (torch, 'sigmoid', elementwise_cost(1)), (F, 'relu', elementwise_cost(1)),
+                   (F, 'softplus', elementwise_cost(1))]
+        originals = [(owner, attribute, getattr(owner, attribute)) for owner, attribute, _ in patches]
+        try:
+            for owner, attribute, cost in patches:
+                setattr(owner, attribute, self.wrap(getattr(owner, attribute), cost))
+            yield
+        finally:
+            for owner, attribute, function in originals:
+                setattr(owner, attribute, function)
+
+    def count(self, x):
+        '''
+        :return: OrderedDict module name -> (MACs, FLOPs) of the module itself (without its children)
+        '''
+        for module in self.net.modules():
+            self.handles.append(module.register_forward_pre_hook(self.pre_hook))
+            self.handles.append(module.register_forward_hook(self.get_hook(self.get_cost(module))))
+        try:
+            with torch.no_grad(), self.patch_functions():
+                self.net(x)
+        finally:
+            for handle in self.handles:
+                handle.remove()
+            self.handles = []
+        return self.counts
+
+
+def get_layer_counts(counts, depth=1):
+    '''
+    :param counts: counts of every module (without children)
+    :param depth: depth of the module names to report, the counts of deeper modules are added to their ancestor
+    :return: OrderedDict module name -> (MACs, FLOPs) including children
+    '''
+    layers = OrderedDict()
+    for name, (macs, flops) in counts.items():
+        layer = '.'.join(name.split('.')[:depth]) if name else '(network)'
+        macs_, flops_ = layers.get(layer, (0, 0))
+        layers[layer] = (macs_ + macs, flops_ + flops)
+    return layers
+
+
+def count_flops(name, tensor_dim, input_shape, network_kwargs, depth=1):
+    '''
+    :return: dict of total MACs and FLOPs and the counts per module up to depth
+    '''
+    net = get_network(name, tensor_dim=tensor_dim, **network_kwargs)
+    net.eval()
+    counts = FlopCounter(net).count(torch.zeros(*input_shape))
+    layers = get_layer_counts(counts, depth)
+    return {'input_shape': list(input_shape), 'n_parameters': get_n_parameters(net),
+            'macs': sum(macs for macs, _ in counts.values()), 'flops': sum(flops for _, flops in counts.values()),
+            'layers': [{'name': layer, 'macs': macs, 'flops': flops} for layer, (macs, flops) in layers.items()]}
+
+
+def print_report(name, tensor_dim, result):
+    print('{0} {1} input {2}: {3:.2f} GFLOPs, {4:.2f} GMACs, {5} parameters'.format(
+        name, tensor_dim, result['input_shape'], result['flops'] / 1e9, result['macs'] / 1e9, result['n_parameters']))
+    for layer in result['layers']:
+        print('  {0:<40} {1:10.3f} GFLOPs {2:10.3f} GMACs {3:5.1f} %'.format(
+            layer['name'], layer['flops'] / 1e9, layer['macs'] / 1e9, 100 * layer['flops'] / max(result['flops'], 1)))
+
+
+def main(arguments):
+    networks = [(name, tensor_dim) for name, tensor_dim in get_available_networks()
+                if (not arguments.networks or name in arguments.networks)
+                and (not arguments.tensor_dims or tensor_dim in arguments.tensor_dims)]
+    size = parse_size(arguments.size)
+    network_kwargs = {'n_classes': arguments.n_classes, 'in_channels': arguments.in_channels,
+                      'feature_scale': arguments.feature_scale, 'input_nz': arguments.input_nz}
+
+    results = []
+    for name, tensor_dim in networks:
+        input_shape = get_input_shape(name, tensor_dim, size, arguments.batch_size, arguments.in_channels,
+                                      arguments.input_nz)
+        try:
+            result = count_flops(name, tensor_dim, input_shape, network_kwargs, depth=arguments.depth)
+        except Exception as error:
+            print('{0} {1} input {2} failed: {3}'.format(name, tensor_dim, list(input_shape), error))
+            results.append({'network': name, 'tensor_dim': tensor_dim, 'error': str(error)})
+            continue
+        print_report(name, tensor_dim, result)
+        results.append({'network': name, 'tensor_dim': tensor_dim, **result})
+
+    if arguments.output is not None:
+        with open(arguments.output, 'w') as output_file:
+            json.dump({'benchmark': 'flops', 'settings': {'size': size, 'batch_size': arguments.batch_size,
+                                                          **network_kwargs},
+                       'results': results}, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='FLOPs and MACs of the forward pass of networks')
+
+    parser.add_argument('-n', '--networks',     help='networks to count (default: all)', nargs='+', default=None)
+    parser.add_argument('--tensor_dims',        help='tensor dimensions to count (default: all)', nargs='+', default=None)
+    parser.add_argument('-s', '--size',         help='volume size XxYxZ, Z is dropped for 2D and replaced by input_nz for 2.5D networks', default='96x96x96')
+    parser.add_argument('-b', '--batch_size',   help='batch size', type=int, default=1)
+    parser.add_argument('--in_channels',        help='input channels', type=int, default=4)
+    parser.add_argument('--n_classes',          help='output channels', type=int, default=2)
+    parser.add_argument('--feature_scale',      help='feature scale of the networks', type=int, default=4)
+    parser.add_argument('--input_nz',           help='z-slab size of the 2.5D networks', type=int, default=5)
+    parser.add_argument('--depth',              help='depth of the modules in the report', type=int, default=1)
+    parser.add_argument('-o', '--output',       help='json file to write the counts to', default=None)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,264 @@
+'''
+Peak memory of a forward/backward pass and activation footprint per layer, for a network and an input size, and
+prediction of the largest batch and volume which fit into a memory budget.
+
+    python -m benchmarks.memory -n unet_pct_multi_att_dsv -s 96x96x96 -b 2 --budget 16000
+    python -m benchmarks.memory -c configs/3D/all_maps_config_unet_pct_multi_att_dsv.json --budget 16000
+
+Every measurement runs in a fresh process. On CPU the peak is the increase of the peak resident memory during the
+pass, on GPU the peak allocated memory. Memory is modelled as fixed + per voxel * batch size * voxels, fitted on
+passes with batch size 1 and 2.
+'''
+
+import json
+import torch
+
+from benchmarks.utils import get_peak_rss, run_isolated
+from benchmarks.networks import get_input_shape, parse_size
+from models.networks import get_network
+from models.networks_other import get_n_parameters
+from utils.utils import json_file_to_pyobj
+
+
+def get_tensor_bytes(output):
+    if torch.is_tensor(output):
+        return output.numel() * output.element_size()
+    if isinstance(output, (tuple, list)):
+        return sum(get_tensor_bytes(o) for o in output)
+    if isinstance(output, dict):
+        return sum(get_tensor_bytes(o) for o in output.values())
+    return 0
+
+
+def get_tensor_shape(output):
+    if torch.is_tensor(output):
+        return list(output.shape)
+    if isinstance(output, (tuple, list)):
+        return [get_tensor_shape(o) for o in output]
+    return None
+
+
+class ActivationRecorder(object):
+    """
+    Records the size of the output of every module with forward hooks
+    """
+
+    def __init__(self, net):
+        self.records = []
+        self.handles = []
+        for name, module in net.named_modules():
+            if name:
+                self.handles.append(module.register_forward_hook(self.get_hook(name, module)))
+
+    def get_hook(self, name, module):
+        is_leaf = len(list(module.children())) == 0
+
+        def hook(module, inputs, output):
+            self.records.append({'name': name, 'type': module.__class__.__name__, 'leaf': is_leaf,
+                                 'shape': get_tensor_shape(output), 'mb': get_tensor_bytes(output) / 1024 ** 2})
+        return hook
+
+    def remove(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+
+def measure_memory(name, tensor_dim, input_shape, network_kwargs, use_cuda=False):
+    '''
+    Run one forward/backward pass under memory tracking
+    :return: dict of peak memory (MB), parameter memory (MB) and the activation record of every module
+    '''
+    torch.manual_seed(0)
+    device = 'cuda' if use_cuda else 'cpu'
+    net = get_network(name, tensor_dim=tensor_dim, **network_kwargs).to(device)
+    net.train()
+    x = torch.randn(*input_shape, device=device)
+    recorder = ActivationRecorder(net)
+
+    if use_cuda:
+        torch.cuda.synchronize()
+        if hasattr(torch.cuda, 'reset_peak_memory_stats'):
+            torch.cuda.reset_peak_memory_stats()
+        else:
+            torch.cuda.reset_max_memory_allocated()
+        baseline = torch.cuda.memory_allocated() / 1024 ** 2
+    else:
+        baseline = get_peak_rss()
+    output = net(x)
+    output = sum(o.sum() for o in output) if isinstance(output, tuple) else output.sum()
+    output.backward()
+    if use_cuda:
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() / 1024 ** 2 - baseline
+    else:
+        peak = get_peak_rss() - baseline
+    recorder.remove()
+
+    n_parameters = get_n_parameters(net)
+    return {'input_shape': list(input_shape), 'peak_mb': peak, 'n_parameters': n_parameters,
+            'parameters_mb': 4 * n_parameters / 1024 ** 2,
+            'activations_mb': sum(record['mb'] for record in recorder.records if record['leaf']),
+            'layers': recorder.records}
+
+
+def get_layer_table(layers, depth=1):
+    '''
+    :param depth: depth of the module names to report (1: direct children of the network)
+    :return: list of the records of modules up to depth, in execution order
+    '''
+    return [record for record in layers if record['name'].count('.') < depth]
+
+
+def get_dominant_layers(layers, depth=1, top=5):
+    return sorted(get_layer_table(layers, depth), key=lambda record: record['mb'], reverse=True)[:top]
+
+
+def fit_memory_model(peak_1, peak_2, n_voxels):
+    '''
+    :param peak_1: peak memory of a pass with batch size 1 (MB)
+    :param peak_2: peak memory of a pass with batch size 2 (MB)
+    :param n_voxels: number of voxels of a sample
+    :return: fixed memory (MB), memory per voxel of a sample (MB)
+    '''
+    per_sample = max(peak_2 - peak_1, 1e-6)
+    return max(peak_1 - per_sample, 0.0), per_sample / n_voxels
+
+
+def predict_max_batch_size(budget, fixed, per_voxel, n_voxels):
+    return int((budget - fixed) // (per_voxel * n_voxels))
+
+
+def predict_max_size(budget, fixed, per_voxel, size, batch_size, scaled_axes=3, division_factor=16):
+    '''
+    Largest volume with the aspect ratio of size which fits into the budget
+    :param scaled_axes: number of leading axes which are scaled (2 for 2D and 2.5D networks)
+    :param division_factor: every scaled axis is rounded down to a multiple of it
+    :return: size, None if not even the smallest volume fits
+    '''
+    max_voxels = (budget - fixed) / (per_voxel * batch_size)
+    scaled_voxels = 1
+    for axis in size[:scaled_axes]:
+        scaled_voxels *= axis
+    n_voxels = scaled_voxels * (1 if len(size) <= scaled_axes else size[scaled_axes])
+    if max_voxels <= 0:
+        return None
+    factor = (max_voxels / n_voxels) ** (1 / scaled_axes)
+    max_size = [int(axis * factor // division_factor * division_factor) for axis in size[:scaled_axes]] + \
+               list(size[scaled_axes:])
+    return max_size if min(max_size[:scaled_axes]) > 0 else None
+
+
+def estimate_memory(name, tensor_dim, size, batch_size, network_kwargs, budget=None, use_cuda=False,
+                    division_factor=16):
+    '''
+    Measure the passes with batch size 1, 2 (and batch_size) and predict what fits into the budget
+    :param size: (x, y, z) volume size, see benchmarks.networks.get_input_shape
+    :param budget: memory budget (MB)
+    :return: dict of results
+    '''
+    in_channels, input_nz = network_kwargs['in_channels'], network_kwargs.get('input_nz', 5)
+    measurements = {}
+    for n in sorted({1, 2, batch_size}):
+        input_shape = get_input_shape(name, tensor_dim, size, n, in_channels, input_nz)
+        result, error = run_isolated(measure_memory, name, tensor_dim, input_shape, network_kwargs, use_cuda=use_cuda)
+        if error is not None:
+            raise Exception('Memory measurement of {0} with input {1} failed: {2}'.format(name, input_shape, error))
+        measurements[n] = result
+
+    sample_shape = get_input_shape(name, tensor_dim, size, 1, in_channels, input_nz)[2:]
+    n_voxels = 1
+    for axis in sample_shape:
+        n_voxels *= axis
+    fixed, per_voxel = fit_memory_model(measurements[1]['peak_mb'], measurements[2]['peak_mb'], n_voxels)
+    result = {**measurements[batch_size], 'batch_size': batch_size, 'size': list(size),
+              'fixed_mb': fixed, 'per_sample_mb': per_voxel * n_voxels,
+              'predicted_peak_mb': fixed + per_voxel * n_voxels * batch_size}
+    if budget is not None:
+        scaled_axes = 2 if tensor_dim == '2D' or '25D' in name else 3
+        result['budget_mb'] = budget
+        result['max_batch_size'] = predict_max_batch_size(budget, fixed, per_voxel, n_voxels)
+        result['max_size'] = predict_max_size(budget, fixed, per_voxel, list(sample_shape), batch_size,
+                                              scaled_axes=scaled_axes, division_factor=division_factor)
+    return result
+
+
+def get_config_settings(json_opts):
+    '''
+    Network, input size, batch size and network arguments of a training config
+    '''
+    model_opts = json_opts.model
+    arch_type = json_opts.training.arch_type
+    network_kwargs = {'n_classes': model_opts.output_nc, 'in_channels': model_opts.input_nc,
+                      'feature_scale': model_opts.feature_scale}
+    if hasattr(model_opts, 'input_nz'):
+        network_kwargs['input_nz'] = model_opts.input_nz
+    if hasattr(model_opts, 'prior_information_channels'):
+        network_kwargs['prior_information_channels'] = model_opts.prior_information_channels
+    size = list(getattr(json_opts.augmentation, arch_type).scale_size[:3])
+    division_factor = model_opts.division_factor if hasattr(model_opts, 'division_factor') else 16
+    return model_opts.model_type, model_opts.tensor_dim, size, json_opts.training.batchSize, network_kwargs, \
+        division_factor
+
+
+def print_report(result, depth=1, top=5):
+    print('{0:<50} {1:>24} {2:>10}'.format('layer', 'output shape', 'MB'))
+    dominant = [record['name'] for record in get_dominant_layers(result['layers'], depth, top)]
+    for record in get_layer_table(result['layers'], depth):
+        shape = 'x'.join(str(axis) for axis in record['shape'][1:]) if record['shape'] and \
+            isinstance(record['shape'][0], int) else 'multiple'
+        print('{0:<50} {1:>24} {2:10.1f} {3}'.format(
+            '  ' * record['name'].count('.') + record['name'] + ' (' + record['type'] + ')', shape, record['mb'],
+            '<- dominant' if record['name'] in dominant else ''))
+    print('input {0}: peak {1:.0f} MB (parameters {2:.0f} MB, module outputs {3:.0f} MB), '
+          'fixed {4:.0f} MB + {5:.0f} MB per sample'.format(
+        result['input_shape'], result['peak_mb'], result['parameters_mb'], result['activations_mb'],
+        result['fixed_mb'], result['per_sample_mb']))
+    if 'budget_mb' in result:
+        print('budget {0:.0f} MB: largest batch size {1} at size {2}, largest size {3} at batch size {4}'.format(
+            result['budget_mb'], result['max_batch_size'], result['size'], result['max_size'], result['batch_size']))
+
+
+def main(arguments):
+    if arguments.config is not None:
+        name, tensor_dim, size, batch_size, network_kwargs, division_factor = \
+            get_config_settings(json_file_to_pyobj(arguments.config))
+    else:
+        name, tensor_dim, size, batch_size, division_factor = arguments.network, arguments.tensor_dim, \
+            parse_size(arguments.size), arguments.batch_size, arguments.division_factor
+        network_kwargs = {'n_classes': arguments.n_classes, 'in_channels': arguments.in_channels,
+                          'feature_scale': arguments.feature_scale, 'input_nz': arguments.input_nz}
+
+    result = estimate_memory(name, tensor_dim, size, batch_size, network_kwargs, budget=arguments.budget,
+                             use_cuda=arguments.cuda, division_factor=division_factor)
+    result['dominant_layers'] = [record['name'] for record in get_dominant_layers(result['layers'], arguments.depth,
+                                                                                  arguments.top)]
+    print_report(result, arguments.depth, arguments.top)
+    if arguments.output is not None:
+        with open(arguments.output, 'w') as output_file:
+            json.dump({'network': name, 'tensor_dim': tensor_dim, **result}, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Peak memory and activation footprint of a network')
+
+    parser.add_argument('-c', '--config',       help='training config file, sets the network, size and batch size', default=None)
+    parser.add_argument('-n', '--network',      help='network', default='unet_pct_multi_att_dsv')
+    parser.add_argument('--tensor_dim',         help='tensor dimension of the network', default='3D')
+    parser.add_argument('-s', '--size',         help='volume size XxYxZ', default='96x96x96')
+    parser.add_argument('-b', '--batch_size',   help='batch size', type=int, default=1)
+    parser.add_argument('--in_channels',        help='input channels', type=int, default=4)
+    parser.add_argument('--n_classes',          help='output channels', type=int, default=2)
+    parser.add_argument('--feature_scale',      help='feature scale of the network', type=int, default=4)
+    parser.add_argument('--input_nz',           help='z-slab size of the 2.5D networks', type=int, default=5)
+    parser.add_argument('--division_factor',    help='volume sizes are multiples of it', type=int, default=16)
+    parser.add_argument('--budget',             help='memory budget (MB) to predict the largest batch and volume for', type=float, default=None)
+    parser.add_argument('--cuda',               help='measure on the GPU', action='store_true')
+    parser.add_argument('--depth',              help='depth of the modules in the activation table', type=int, default=1)
+    parser.add_argument('--top',                help='number of dominant layers to flag', type=int, default=5)
+    parser.add_argument('-o', '--output',       help='json file to write the report to', default=None)
+    args = parser.parse_args()
+
+    main(args)
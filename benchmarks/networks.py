@@ -0,0 +1,138 @@
+'''
+CPU benchmark of the forward and backward pass of every network get_network can build, over a matrix of input
+sizes, batch sizes and thread counts. Every configuration runs in a fresh process.
+
+    python -m benchmarks.networks -o benchmark_networks.json
+    python -m benchmarks.networks -n unet_pct_multi_att_dsv unet -s 96x96x32 -b 1 2 -t 1 8
+'''
+
+import json
+import time
+import torch
+
+from benchmarks.utils import get_peak_rss, get_environment, get_time_stats, run_isolated
+from models.networks import get_network, get_available_networks
+from models.networks_other import get_n_parameters, get_fp_bp_times
+
+
+def get_input_shape(name, tensor_dim, size, batch_size, in_channels, input_nz):
+    '''
+    :param size: (x, y, z) volume size, z is dropped for 2D networks and replaced by input_nz for 2.5D networks
+    :return: shape of the network input
+    '''
+    if tensor_dim == '2D':
+        return (batch_size, in_channels) + tuple(size[:2])
+    if '25D' in name:
+        return (batch_size, in_channels) + tuple(size[:2]) + (input_nz,)
+    return (batch_size, in_channels) + tuple(size)
+
+
+def benchmark_network(name, tensor_dim, size, batch_size, n_threads, n_trials=20, n_warmup=3, in_channels=4,
+                      n_classes=2, feature_scale=4, input_nz=5):
+    '''
+    Forward and backward times, peak memory, number of parameters and FLOPs of a network on the CPU
+    :return: dict of results
+    '''
+    from benchmarks.flops import FlopCounter
+    torch.set_num_threads(n_threads)
+    torch.manual_seed(0)
+    net = get_network(name, n_classes=n_classes, in_channels=in_channels, input_nz=input_nz,
+                      feature_scale=feature_scale, tensor_dim=tensor_dim)
+    net.train()
+    input_shape = get_input_shape(name, tensor_dim, size, batch_size, in_channels, input_nz)
+    x = torch.randn(*input_shape)
+    model_rss = get_peak_rss()
+
+    t_forward, t_backward = get_fp_bp_times(net, x, None, n_trial=n_trials, n_dry_runs=n_warmup, verbose=False)
+    forward, backward = get_time_stats(t_forward), get_time_stats(t_backward)
+    counts = FlopCounter(net).count(x).values()
+    return {'input_shape': list(input_shape), 'n_parameters': get_n_parameters(net),
+            'gflops': sum(flops for _, flops in counts) / 1e9, 'gmacs': sum(macs for macs, _ in counts) / 1e9,
+            'forward': forward, 'backward': backward,
+            'forward_per_sample_ms': forward['median_ms'] / batch_size,
+            'model_rss_mb': model_rss, 'peak_rss_mb': get_peak_rss()}
+
+
+def parse_size(size):
+    return [int(s) for s in size.split('x')]
+
+
+def run_benchmarks(networks, sizes, batch_sizes, threads, n_trials, n_warmup, in_channels, n_classes,
+                   feature_scale, input_nz):
+    '''
+    :return: list of results, one per configuration (failed configurations carry an error message)
+    '''
+    results = []
+    for name, tensor_dim in networks:
+        for size in sizes:
+            for batch_size in batch_sizes:
+                for n_threads in threads:
+                    config = {'network': name, 'tensor_dim': tensor_dim, 'size': size, 'batch_size': batch_size,
+                              'threads': n_threads}
+                    start = time.time()
+                    result, error = run_isolated(benchmark_network, name, tensor_dim, size, batch_size, n_threads,
+                                                 n_trials=n_trials, n_warmup=n_warmup, in_channels=in_channels,
+                                                 n_classes=n_classes, feature_scale=feature_scale,
+                                                 input_nz=input_nz)
+                    if error is not None:
+                        print('{0:<45} {1:<14} bs {2:<3} threads {3:<3} failed: {4}'.format(
+                            name + ' ' + tensor_dim, 'x'.join(map(str, size)), batch_size, n_threads, error))
+                        results.append({**config, 'error': error})
+                        continue
+                    print('{0:<45} {1:<14} bs {2:<3} threads {3:<3} fp {4:9.1f} ms (p95 {5:9.1f}) '
+                          'bp {6:9.1f} ms (p95 {7:9.1f}) peak rss {8:8.0f} MB ({9:.0f} s)'.format(
+                        name + ' ' + tensor_dim, 'x'.join(map(str, size)), batch_size, n_threads,
+                        result['forward']['median_ms'], result['forward']['p95_ms'],
+                        result['backward']['median_ms'], result['backward']['p95_ms'], result['peak_rss_mb'],
+                        time.time() - start))
+                    results.append({**config, **result})
+    return results
+
+
+def main(arguments):
+    networks = get_available_networks()
+    if arguments.networks:
+        unknown = set(arguments.networks) - set(name for name, _ in networks)
+        if unknown:
+            raise NotImplementedError(f'{sorted(unknown)} not available, use one of '
+                                      f'{sorted(set(name for name, _ in networks))}')
+        networks = [(name, tensor_dim) for name, tensor_dim in networks if name in arguments.networks]
+    if arguments.tensor_dims:
+        networks = [(name, tensor_dim) for name, tensor_dim in networks if tensor_dim in arguments.tensor_dims]
+    sizes = [parse_size(size) for size in arguments.sizes]
+
+    settings = {'n_trials': arguments.trials, 'n_warmup': arguments.warmup, 'in_channels': arguments.in_channels,
+                'n_classes': arguments.n_classes, 'feature_scale': arguments.feature_scale,
+                'input_nz': arguments.input_nz}
+    results = run_benchmarks(networks, sizes, arguments.batch_sizes, arguments.threads, arguments.trials,
+                             arguments.warmup, arguments.in_channels, arguments.n_classes, arguments.feature_scale,
+                             arguments.input_nz)
+
+    with open(arguments.output, 'w') as output_file:
+        json.dump({'benchmark': 'networks', 'environment': get_environment(), 'settings': settings, 'results': results}, output_file, indent=2)
+    print('Results written to {0}'.format(arguments.output))
+
+
+if __name__ == '__main__':
+    import argparse
+    import multiprocessing
+
+    parser = argparse.ArgumentParser(description='CPU forward/backward benchmark of all networks')
+
+    parser.add_argument('-o', '--output',      help='output json file', default='benchmark_networks.json')
+    parser.add_argument('-n', '--networks',    help='networks to benchmark (default: all)', nargs='+', default=None)
+    parser.add_argument('--tensor_dims',       help='tensor dimensions to benchmark (default: all)', nargs='+', default=None)
+    parser.add_argument('-s', '--sizes',       help='volume sizes XxYxZ, Z is dropped for 2D and replaced by input_nz for 2.5D networks',
+                        nargs='+', default=['64x64x32', '96x96x96'])
+    parser.add_argument('-b', '--batch_sizes', help='batch sizes', nargs='+', type=int, default=[1, 2])
+    parser.add_argument('-t', '--threads',     help='numbers of intra-op threads', nargs='+', type=int,
+                        default=sorted({1, multiprocessing.cpu_count()}))
+    parser.add_argument('--trials',            help='timed forward/backward passes per configuration', type=int, default=20)
+    parser.add_argument('--warmup',            help='untimed passes before the trials', type=int, default=3)
+    parser.add_argument('--in_channels',       help='input channels', type=int, default=4)
+    parser.add_argument('--n_classes',         help='output channels', type=int, default=2)
+    parser.add_argument('--feature_scale',     help='feature scale of the networks', type=int, default=4)
+    parser.add_argument('--input_nz',          help='z-slab size of the 2.5D networks', type=int, default=5)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,82 @@
+import sys
+import queue
+import resource
+import platform
+import multiprocessing
+import numpy as np
+import torch
+
+
+def get_peak_rss():
+    '''
+    :return: peak resident set size of the current process (MB)
+    '''
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak_rss / 1024 ** 2 if sys.platform == 'darwin' else peak_rss / 1024
+
+
+def get_current_rss():
+    '''
+    :return: current resident set size of the current process (MB), the peak resident set size where /proc is not
+     available. Unlike the peak, it does not include the high-water mark inherited by forked processes.
+    '''
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+    except OSError:
+        return get_peak_rss()
+    return resident_pages * resource.getpagesize() / 1024 ** 2
+
+
+def get_environment():
+    '''
+    :return: dict describing the hardware and software a benchmark ran on
+    '''
+    return {'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': multiprocessing.cpu_count(),
+            'python': platform.python_version(), 'torch': torch.__version__, 'numpy': np.__version__,
+            'mkldnn': torch.backends.mkldnn.is_available()}
+
+
+def get_time_stats(times):
+    '''
+    :param times: durations (s)
+    :return: dict of the median, 95th percentile, mean and minimum (ms)
+    '''
+    times = 1000 * np.asarray(times)
+    return {'median_ms': float(np.median(times)), 'p95_ms': float(np.percentile(times, 95)),
+            'mean_ms': float(np.mean(times)), 'min_ms': float(np.min(times))}
+
+
+def _isolated_worker(function, args, kwargs, results):
+    try:
+        results.put(('result', function(*args, **kwargs)))
+    except Exception as error:
+        results.put(('error', '{0}: {1}'.format(error.__class__.__name__, error)))
+
+
+def run_isolated(function, *args, **kwargs):
+    '''
+    Run a function in a fresh (spawned) process, so that its peak memory, thread settings and crashes do not leak
+    into other measurements
+    :param function: picklable (module level) function
+    :return: (result, None) or (None, error message)
+    '''
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_isolated_worker, args=(function, args, kwargs, results))
+    process.start()
+    while True:
+        try:
+            status, value = results.get(timeout=10)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                # the result may have been written just before the process exited
+                try:
+                    status, value = results.get(timeout=1)
+                except queue.Empty:
+                    status, value = 'error', 'process exited with code {0}'.format(process.exitcode)
+                break
+    process.join()
+    return (value, None) if status == 'result' else (None, value)
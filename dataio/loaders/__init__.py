@@ -1,6 +1,8 @@
 from dataio.loaders.geneva_stroke_dataset_pCT import GenevaStrokeDataset_pCT
 from dataio.loaders.geneva_stroke_dataset_25D_pCT import GenevaStrokeDataset_25D_pCT
 from dataio.loaders.isles2018_training_dataset import Isles2018TrainingDataset
+from dataio.loaders.cached_dataset import CachedDataset
+from dataio.loaders.augmentation_store import AugmentationReplayDataset
 
 def get_dataset(name):
     """get_dataset
@@ -0,0 +1,145 @@
+import os
+import json
+import numpy as np
+import torch
+import torch.utils.data as data
+from tqdm import tqdm
+from .cached_dataset import CachedDataset, get_transform_signature
+from .utils import get_sample_seed, worker_init_fn
+
+
+class _AugmentationStoreWriterDataset(data.Dataset):
+    '''
+    Applies the store transform with a recorded seed to every sample of one augmented epoch
+    '''
+    def __init__(self, dataset, transform, seeds):
+        self.dataset = dataset
+        self.transform = transform
+        self.seeds = seeds
+
+    def __getitem__(self, index):
+        input, target = self.dataset.load_sample(index)
+        transformer = self.transform(seed=int(self.seeds[index]))
+        input, target = transformer(input, target)
+        return input, target, index
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+def write_augmentation_store(store_dir, dataset, transform, n_epochs, seed=42, num_workers=16, augmentation_params=None):
+    '''
+    Pre-generate n_epochs augmented epochs of a dataset into a memory-mapped augmentation store
+    :param store_dir: output directory
+    :param dataset: (training) dataset, has to provide load_sample(index)
+    :param transform: store transform factory (ie. the expensive part of the training augmentation)
+    :param n_epochs: number of augmented epochs K
+    :param seed: seed of the run, stored epoch k is identical to epoch k of an online run with augmentation_seed=seed
+    :param num_workers: number of workers used for augmentation
+    :param augmentation_params: dictionary of augmentation parameters recorded alongside the sampled seeds
+    '''
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    # the meta data marks a complete store: an interrupted regeneration leaves a store without it, which is rejected
+    meta_path = os.path.join(store_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    # the augmentation of every sample is fully defined by its seed
+    seeds = np.array([[get_sample_seed(seed, epoch, index) for index in range(len(dataset))]
+                      for epoch in range(n_epochs)], dtype=np.int64)
+    np.save(os.path.join(store_dir, 'seeds.npy'), seeds)
+
+    inputs, targets = None, None
+    for epoch in range(n_epochs):
+        writer_dataset = _AugmentationStoreWriterDataset(dataset, transform, seeds[epoch])
+        loader = data.DataLoader(dataset=writer_dataset, num_workers=num_workers, batch_size=1, shuffle=False,
+                                 worker_init_fn=worker_init_fn)
+        for input, target, index in tqdm(loader, total=len(loader), desc='Augmented epoch {0}/{1}'.format(epoch + 1, n_epochs)):
+            input, target, index = input[0].numpy(), target[0].numpy(), int(index[0])
+            if inputs is None:
+                inputs = np.lib.format.open_memmap(os.path.join(store_dir, 'inputs.npy'), mode='w+', dtype=input.dtype,
+                                                   shape=(n_epochs, len(dataset)) + input.shape)
+                targets = np.lib.format.open_memmap(os.path.join(store_dir, 'targets.npy'), mode='w+', dtype=target.dtype,
+                                                    shape=(n_epochs, len(dataset)) + target.shape)
+            inputs[epoch, index] = input
+            targets[epoch, index] = target
+        inputs.flush()
+        targets.flush()
+
+    transform_signature = get_transform_signature(transform)
+    meta = {
+        'n_epochs': n_epochs,
+        'seed': seed,
+        'ids': [str(id) for id in dataset.ids],
+        'cache_key': CachedDataset.get_cache_key(dataset, transform_signature),
+        'transform': transform_signature,
+        'augmentation_params': augmentation_params
+    }
+    with open(meta_path + '.tmp', 'w') as outfile:
+        json.dump(meta, outfile, indent=4, default=str)
+    os.replace(meta_path + '.tmp', meta_path)
+    print('Augmentation store with {0} epochs written to {1}'.format(n_epochs, store_dir))
+
+
+class AugmentationReplayDataset(data.Dataset):
+    def __init__(self, store_dir, dataset, transform=None, store_transform=None):
+        '''
+        Replays pre-generated augmented epochs from an augmentation store
+        :param store_dir: directory written by write_augmentation_store
+        :param dataset: dataset the store was generated from (used for ids and 2.5D slabs)
+        :param transform: optional cheap online augmentation applied on top of the stored samples
+        :param store_transform: store transform factory of the current augmentation config, the store is rejected if
+         it was generated with another config
+        '''
+        super(AugmentationReplayDataset, self).__init__()
+        if not os.path.exists(os.path.join(store_dir, 'meta.json')):
+            raise Exception('Augmentation store {0} is incomplete (no meta.json), generate it again'.format(store_dir))
+        with open(os.path.join(store_dir, 'meta.json')) as file:
+            self.meta = json.load(file)
+        if self.meta['ids'] != [str(id) for id in dataset.ids]:
+            raise Exception('Augmentation store {0} was generated for another dataset split'.format(store_dir))
+        if store_transform is not None:
+            transform_signature = get_transform_signature(store_transform)
+            if self.meta['transform'] != transform_signature:
+                raise Exception('Augmentation store {0} was generated with another augmentation config ({1}, current '
+                                '{2}), generate it again'.format(store_dir, self.meta['transform'], transform_signature))
+            if self.meta['cache_key'] != CachedDataset.get_cache_key(dataset, transform_signature):
+                raise Exception('Augmentation store {0} was generated for another dataset file, split or channels, '
+                                'generate it again'.format(store_dir))
+
+        self.dataset = dataset
+        self.transform = transform
+        self.n_epochs = self.meta['n_epochs']
+        self.inputs = np.load(os.path.join(store_dir, 'inputs.npy'), mmap_mode='r')
+        self.targets = np.load(os.path.join(store_dir, 'targets.npy'), mmap_mode='r')
+        self.epoch = 0
+        print('Replaying {0} augmented epochs from {1}'.format(self.n_epochs, store_dir))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def get_ids(self, indices):
+        return self.dataset.get_ids(indices)
+
+    @property
+    def ids(self):
+        return self.dataset.ids
+
+    def __getitem__(self, index):
+        store_epoch = self.epoch % self.n_epochs
+        input = torch.from_numpy(np.array(self.inputs[store_epoch, index]))
+        target = torch.from_numpy(np.array(self.targets[store_epoch, index]))
+
+        if self.transform:
+            transformer = self.transform(seed=get_sample_seed(self.dataset.augmentation_seed, self.epoch, index))
+            input, target = transformer(input, target)
+
+        # 2.5D datasets split the transformed volume into slabs
+        if hasattr(self.dataset, 'to_slabs'):
+            input, target = self.dataset.to_slabs(input, target)
+
+        return input, target, index
+
+    def __len__(self):
+        return len(self.dataset)
@@ -0,0 +1,126 @@
+import os
+import json
+import hashlib
+import numpy as np
+import torch
+import torch.utils.data as data
+from tqdm import tqdm
+from .utils import worker_init_fn
+
+
+class CachedDataset(data.Dataset):
+    def __init__(self, dataset, cache_mode='ram', cache_dir=None, transform_signature=None, num_workers=0):
+        '''
+        Materialises the final (transformed) tensors of a dataset with a deterministic transform once,
+        so that later epochs only stream them from RAM or from a memory-mapped file.
+        The cache is invalidated whenever the dataset file, the split, the channels or the transform config change.
+        :param dataset: dataset to cache (its transform must be deterministic, ie. validation/test transforms)
+        :param cache_mode: 'ram' to keep the tensors in memory or 'memmap' to store them in cache_dir
+        :param cache_dir: directory for the memory-mapped files (only used with 'memmap')
+        :param transform_signature: string identifying the transform config, derived from the transform if None
+        :param num_workers: number of workers used for the single materialisation pass
+        '''
+        super(CachedDataset, self).__init__()
+        if cache_mode not in ['ram', 'memmap']:
+            raise NotImplementedError(f'{cache_mode} is not implemented, use one of [\'ram\', \'memmap\']')
+        if cache_mode == 'memmap' and cache_dir is None:
+            raise Exception('A cache directory is required for memory-mapped caching')
+
+        self.dataset = dataset
+        self.cache_mode = cache_mode
+        self.cache_dir = cache_dir
+        if transform_signature is None:
+            transform_signature = get_transform_signature(dataset.transform)
+        self.cache_key = self.get_cache_key(dataset, transform_signature)
+
+        if self.cache_mode == 'memmap':
+            self.inputs, self.targets = self.load_or_write_memmap(num_workers)
+        else:
+            self.inputs, self.targets = self.materialise(num_workers)
+
+    @staticmethod
+    def get_cache_key(dataset, transform_signature):
+        description = {
+            'dataset': dataset.__class__.__name__,
+            'dataset_path': str(dataset.dataset_path),
+            'split_indices': [int(index) for index in dataset.split_indices],
+            'channels': [int(channel) for channel in dataset.channels],
+            'input_nz': getattr(dataset, 'input_nz', None),
+            'transform': transform_signature
+        }
+        return hashlib.md5(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def iterate_dataset(self, num_workers):
+        loader = data.DataLoader(dataset=self.dataset, num_workers=num_workers, batch_size=1, shuffle=False,
+                                 worker_init_fn=worker_init_fn)
+        for input, target, index in tqdm(loader, total=len(loader), desc='Caching {0}'.format(self.cache_key[:8])):
+            yield int(index[0]), input[0], target[0]
+
+    def materialise(self, num_workers):
+        inputs, targets = [None] * len(self.dataset), [None] * len(self.dataset)
+        for index, input, target in self.iterate_dataset(num_workers):
+            inputs[index] = input.clone()
+            targets[index] = target.clone()
+        return inputs, targets
+
+    def load_or_write_memmap(self, num_workers):
+        inputs_path = os.path.join(self.cache_dir, '{0}_inputs.npy'.format(self.cache_key))
+        targets_path = os.path.join(self.cache_dir, '{0}_targets.npy'.format(self.cache_key))
+        complete_flag = os.path.join(self.cache_dir, '{0}.complete'.format(self.cache_key))
+
+        if not os.path.exists(complete_flag):
+            print('Writing memory-mapped cache {0} ...'.format(self.cache_key))
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp_inputs_path = inputs_path + '.tmp'
+            tmp_targets_path = targets_path + '.tmp'
+            inputs, targets = None, None
+            for index, input, target in self.iterate_dataset(num_workers):
+                if inputs is None:
+                    # all samples share the shape defined by the padding of the transform
+                    inputs = np.lib.format.open_memmap(tmp_inputs_path, mode='w+', dtype=input.numpy().dtype,
+                                                       shape=(len(self.dataset),) + tuple(input.shape))
+                    targets = np.lib.format.open_memmap(tmp_targets_path, mode='w+', dtype=target.numpy().dtype,
+                                                        shape=(len(self.dataset),) + tuple(target.shape))
+                inputs[index] = input.numpy()
+                targets[index] = target.numpy()
+            inputs.flush()
+            targets.flush()
+            del inputs, targets
+            os.replace(tmp_inputs_path, inputs_path)
+            os.replace(tmp_targets_path, targets_path)
+            open(complete_flag, 'w').close()
+        else:
+            print('Using memory-mapped cache {0}'.format(self.cache_key))
+
+        return np.load(inputs_path, mmap_mode='r'), np.load(targets_path, mmap_mode='r')
+
+    def get_ids(self, indices):
+        return self.dataset.get_ids(indices)
+
+    @property
+    def ids(self):
+        return self.dataset.ids
+
+    def __getitem__(self, index):
+        if self.cache_mode == 'memmap':
+            # copy out of the read-only memory map
+            return torch.from_numpy(np.array(self.inputs[index])), torch.from_numpy(np.array(self.targets[index])), index
+        return self.inputs[index], self.targets[index], index
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+def get_transform_signature(transform):
+    '''
+    Identify a transform by its name and the augmentation parameters of the Transformations object it is bound to
+    :param transform: transform factory as returned by get_dataset_transformation
+    :return: string signature
+    '''
+    if transform is None:
+        return 'None'
+    transformations = getattr(transform, '__self__', None)
+    if transformations is not None and hasattr(transformations, 'get_signature'):
+        return '{0}:{1}'.format(transform.__name__, transformations.get_signature())
+    return repr(transform)
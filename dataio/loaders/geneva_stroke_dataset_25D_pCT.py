@@ -1,15 +1,14 @@
 import torch.utils.data as data
 import torch
 import numpy as np
-import datetime
 from sklearn.model_selection import train_test_split
-from .utils import validate_images
+from .utils import validate_images, get_sample_seed
 
 
 class GenevaStrokeDataset_25D_pCT(data.Dataset):
     def __init__(self, dataset_path, split, transform=None, preload_data=False,
                  split_seed=42, train_size=0.7, test_size=0.15, valid_size=0.15, input_nz=5,
-                 channels=[0, 1, 2, 3]):
+                 channels=[0, 1, 2, 3], augmentation_seed=0):
         '''
         Loader for the Geneva Stroke Dateset (perfusion CT) in 2.5D.
         2.5D is defined as an input of several slices resulting in the prediction of the central slice along z.
@@ -24,6 +23,7 @@ class GenevaStrokeDataset_25D_pCT(data.Dataset):
         :param valid_size:
         :param input_nz: number of slices along Z
         :param channels: list of channels to use [0 - Tmax, 1 - CBF, 2 - MTT, 3 - CBV]
+        :param augmentation_seed: seed of the run, augmentations are derived from (augmentation_seed, epoch, index)
         '''
         super(GenevaStrokeDataset_25D_pCT, self).__init__()
         # TODO make dataset split
@@ -58,6 +58,8 @@ class GenevaStrokeDataset_25D_pCT(data.Dataset):
 
         # data augmentation
         self.transform = transform
+        self.augmentation_seed = augmentation_seed
+        self.epoch = 0
 
         # data load into the ram memory
         self.preload_data = preload_data
@@ -87,15 +89,15 @@ class GenevaStrokeDataset_25D_pCT(data.Dataset):
     def get_ids(self, indices):
         return [self.ids[index] for index in indices]
 
-    def __getitem__(self, index):
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def load_sample(self, index):
         '''
-        Return sample at index
+        Load the untransformed sample at index
         :param index: int
-        :return: sample (x, y, z, c)
+        :return: input, target (x, y, z, c)
         '''
-        # update the seed to avoid workers sample the same augmentation parameters
-        np.random.seed(datetime.datetime.now().second + datetime.datetime.now().microsecond)
-
         # load the images
         if not self.preload_data:
             # select only from data available for this split
@@ -127,14 +129,33 @@ class GenevaStrokeDataset_25D_pCT(data.Dataset):
         # handle exceptions
         validate_images(input, target)
 
+        return input, target
+
+    def __getitem__(self, index):
+        '''
+        Return sample at index
+        :param index: int
+        :return: sample (x, y, z, c)
+        '''
+        input, target = self.load_sample(index)
+
         # apply transformations
         if self.transform:
-            # transformer has to be initialised here to randomize seed
-            transformer = self.transform()
+            # the augmentation of a sample only depends on the seed of the run, the epoch and the index
+            transformer = self.transform(seed=get_sample_seed(self.augmentation_seed, self.epoch, index))
             input, target = transformer(input, target)
 
+        input_25D, target_25D = self.to_slabs(input, target)
 
-        # Transform into 2.5D datapoints
+        return input_25D, target_25D, index
+
+    def to_slabs(self, input, target):
+        '''
+        Transform a transformed volume into 2.5D datapoints
+        :param input: tensor (c, x, y, z)
+        :param target: tensor (c, x, y, z)
+        :return: input slabs (n_slabs, c, x, y, input_nz), central target slices (n_slabs, c, x, y, 1)
+        '''
         half_slab_width = int(self.input_nz / 2)
         range_covered_by_slices = range(half_slab_width, target.shape[3] - half_slab_width)
         input_25D = None
@@ -149,7 +170,7 @@ class GenevaStrokeDataset_25D_pCT(data.Dataset):
                 input_25D = torch.cat((input_25D, input_slab), dim=0)
                 target_25D = torch.cat((target_25D, center_target_slice), dim=0)
 
-        return input_25D, target_25D, index
+        return input_25D, target_25D
 
     def __len__(self):
         return len(self.ids)
\ No newline at end of file
@@ -1,14 +1,13 @@
 import torch.utils.data as data
 import numpy as np
-import datetime
 from sklearn.model_selection import train_test_split
-from .utils import validate_images
+from .utils import validate_images, get_sample_seed
 
 
 class Isles2018TrainingDataset(data.Dataset):
     def __init__(self, dataset_path, split, transform=None, preload_data=False,
                  split_seed=42, train_size=0.7, test_size=0.15, valid_size=0.15,
-                 channels=[0, 1, 2, 3]):
+                 channels=[0, 1, 2, 3], augmentation_seed=0):
         '''
         Loader for the ISLES 2018 Training Dateset (perfusion CT)
         :param dataset_path: path to dataset file
@@ -20,6 +19,7 @@ class Isles2018TrainingDataset(data.Dataset):
         :param test_size:
         :param valid_size:
         :param channels: list of channels to use [0 - Tmax, 1 - CBF, 2 - MTT, 3 - CBV]
+        :param augmentation_seed: seed of the run, augmentations are derived from (augmentation_seed, epoch, index)
         '''
         super(Isles2018TrainingDataset, self).__init__()
         # TODO make dataset split
@@ -53,6 +53,8 @@ class Isles2018TrainingDataset(data.Dataset):
 
         # data augmentation
         self.transform = transform
+        self.augmentation_seed = augmentation_seed
+        self.epoch = 0
 
         # data load into the ram memory
         self.preload_data = preload_data
@@ -77,15 +79,15 @@ class Isles2018TrainingDataset(data.Dataset):
     def get_ids(self, indices):
         return [self.ids[index] for index in indices]
 
-    def __getitem__(self, index):
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def load_sample(self, index):
         '''
-        Return sample at index
+        Load the untransformed sample at index
         :param index: int
-        :return: sample (x, y, z, c)
+        :return: input, target (x, y, z, c)
         '''
-        # update the seed to avoid workers sample the same augmentation parameters
-        np.random.seed(datetime.datetime.now().second + datetime.datetime.now().microsecond)
-
         # load the images
         if not self.preload_data:
             # select only from data available for this split
@@ -113,10 +115,20 @@ class Isles2018TrainingDataset(data.Dataset):
         # handle exceptions
         validate_images(input, target)
 
+        return input, target
+
+    def __getitem__(self, index):
+        '''
+        Return sample at index
+        :param index: int
+        :return: sample (x, y, z, c)
+        '''
+        input, target = self.load_sample(index)
+
         # apply transformations
         if self.transform:
-            # transformer has to be initialised here to randomize seed
-            transformer = self.transform()
+            # the augmentation of a sample only depends on the seed of the run, the epoch and the index
+            transformer = self.transform(seed=get_sample_seed(self.augmentation_seed, self.epoch, index))
             input, target = transformer(input, target)
 
         return input, target, index
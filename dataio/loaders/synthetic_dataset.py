@@ -0,0 +1,159 @@
+import os
+import zipfile
+import numpy as np
+from scipy.ndimage import zoom, binary_erosion
+from tqdm import tqdm
+
+
+# perfusion maps in the integer units of the stored maps: value in normal tissue, in hypoperfused tissue (lesion)
+# and in the infarct core
+MAP_VALUES = {'Tmax': (20, 90, 120), 'CBF': (50, 25, 8), 'MTT': (40, 80, 100), 'CBV': (40, 35, 12),
+              'NCCT': (35, 33, 27)}
+PRIOR_TYPES = [None, 'core', 'one_hot_core']
+
+
+def smooth_field(rng, shape, scale):
+    '''
+    Smooth random field with unit standard deviation
+    :param scale: correlation length in voxels
+    '''
+    low_shape = [max(2, int(np.ceil(size / scale))) for size in shape]
+    field = zoom(rng.standard_normal(low_shape), [size / low for size, low in zip(shape, low_shape)], order=3)
+    field = field[tuple(slice(0, size) for size in shape)]
+    return field / max(field.std(), 1e-6)
+
+
+def get_coordinates(shape):
+    return np.meshgrid(*[np.linspace(-1, 1, size) for size in shape], indexing='ij')
+
+
+def generate_brain_mask(rng, shape):
+    '''
+    Ellipsoid with an irregular, smooth surface
+    '''
+    x, y, z = get_coordinates(shape)
+    radii = np.array([0.75, 0.85, 0.8]) * rng.uniform(0.92, 1.05, size=3)
+    radius = np.sqrt((x / radii[0]) ** 2 + (y / radii[1]) ** 2 + (z / radii[2]) ** 2)
+    surface = 1 + 0.06 * smooth_field(rng, shape, scale=max(shape) / 4)
+    return (radius < surface).astype(np.uint8)
+
+
+def generate_lesion(rng, mask, volume_fraction):
+    '''
+    Blob lesion in one hemisphere, irregular border, with an infarct core at its center
+    :param volume_fraction: volume of the lesion as fraction of the brain volume
+    :return: lesion, core (binary), severity of the hypoperfusion in [0, 1]
+    '''
+    shape = mask.shape
+    inner = binary_erosion(mask, iterations=max(1, min(shape) // 16))
+    candidates = np.argwhere(inner if inner.any() else mask)
+    # stroke lesions are lateral: keep centers away from the midline
+    lateral = candidates[np.abs(candidates[:, 0] - shape[0] / 2) > shape[0] / 10]
+    candidates = lateral if len(lateral) else candidates
+    center = candidates[rng.randint(len(candidates))]
+
+    radius = (3 * volume_fraction * mask.sum() / (4 * np.pi)) ** (1 / 3)
+    grid = np.meshgrid(*[np.arange(size) for size in shape], indexing='ij')
+    distance = np.sqrt(sum((axis - c) ** 2 for axis, c in zip(grid, center))) / max(radius, 1)
+    distance = distance + 0.3 * smooth_field(rng, shape, scale=max(radius / 2, 2))
+
+    lesion = ((distance < 1) & (mask > 0)).astype(np.uint8)
+    core = ((distance < 0.55) & (mask > 0)).astype(np.uint8)
+    severity = np.clip(1.6 - distance, 0, 1) * mask
+    return lesion, core, severity
+
+
+def generate_subject(rng, shape, channel_names, prior_type=None, lesion_volume=0.03, lesion_volume_sd=0.8,
+                     empty_fraction=0.0):
+    '''
+    :param shape: (x, y, z) volume shape
+    :param channel_names: maps to generate (see MAP_VALUES, other names give generic smooth maps)
+    :param prior_type: None, 'core' (binary core channel) or 'one_hot_core' (background and core channels)
+    :param lesion_volume: median lesion volume as fraction of the brain volume (log-normal)
+    :param lesion_volume_sd: standard deviation of the log lesion volume
+    :param empty_fraction: probability of a subject without lesion
+    :return: input (x, y, z, c) int16, brain mask (x, y, z) uint8, lesion (x, y, z) uint8
+    '''
+    mask = generate_brain_mask(rng, shape)
+    if rng.uniform() < empty_fraction:
+        lesion, core, severity = np.zeros(shape, np.uint8), np.zeros(shape, np.uint8), np.zeros(shape)
+    else:
+        volume_fraction = min(0.3, lesion_volume * np.exp(lesion_volume_sd * rng.standard_normal()))
+        lesion, core, severity = generate_lesion(rng, mask, volume_fraction)
+
+    channels = []
+    texture = smooth_field(rng, shape, scale=max(shape) / 16)
+    for name in channel_names:
+        normal, hypoperfused, infarct = MAP_VALUES.get(name, (50, 50, 50))
+        value = normal + (hypoperfused - normal) * severity + (infarct - hypoperfused) * core
+        value = value * (1 + 0.1 * texture + 0.05 * rng.standard_normal(shape))
+        channels.append(np.clip(value, 0, None) * mask)
+    if prior_type == 'core':
+        channels.append(core)
+    elif prior_type == 'one_hot_core':
+        channels += [(1 - core) * mask, core]
+    inputs = np.stack(channels, axis=-1).round().astype(np.int16)
+    return inputs, mask, lesion
+
+
+def _write_npz(path, arrays):
+    '''
+    Zip .npy files into an uncompressed npz archive without loading them
+    :param arrays: dict key -> path of the .npy file
+    '''
+    with zipfile.ZipFile(path, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for key, array_path in arrays.items():
+            archive.write(array_path, arcname=key + '.npy')
+
+
+def write_synthetic_dataset(path, n_subjects, shape=(96, 96, 48), n_channels=4, prior_type=None, lesion_volume=0.03,
+                            lesion_volume_sd=0.8, empty_fraction=0.0, seed=42):
+    '''
+    Write a synthetic perfusion CT dataset in the layout of the Geneva Stroke Dataset loaders (ct_inputs, brain_masks,
+    ct_lesion_GT, ids and params). Subjects are generated one by one into memory-mapped arrays, so the size of the
+    dataset is only limited by the disk.
+    :param path: output .npz file
+    :param n_subjects: number of subjects
+    :param shape: (x, y, z) volume shape
+    :param n_channels: number of perfusion map channels (Tmax, CBF, MTT, CBV, NCCT, then generic maps)
+    :param prior_type: prior information channels appended after the maps, None, 'core' or 'one_hot_core'
+    :param lesion_volume: median lesion volume as fraction of the brain volume (log-normal)
+    :param lesion_volume_sd: standard deviation of the log lesion volume
+    :param empty_fraction: fraction of subjects without lesion
+    :param seed: every subject is generated from (seed, index)
+    '''
+    if prior_type not in PRIOR_TYPES:
+        raise NotImplementedError(f'{prior_type} is not implemented, use one of {PRIOR_TYPES}')
+    names = list(MAP_VALUES.keys())
+    channel_names = [names[c] if c < len(names) else 'channel_{}'.format(c) for c in range(n_channels)]
+    prior_names = {None: [], 'core': ['core'], 'one_hot_core': ['background', 'core']}[prior_type]
+    n_prior_channels = len(prior_names)
+    shape = tuple(shape)
+
+    tmp_dir = path + '.tmp'
+    if not os.path.exists(tmp_dir):
+        os.makedirs(tmp_dir)
+    arrays = {key: os.path.join(tmp_dir, key + '.npy') for key in ['ct_inputs', 'brain_masks', 'ct_lesion_GT', 'ids',
+                                                                    'params']}
+    inputs = np.lib.format.open_memmap(arrays['ct_inputs'], mode='w+', dtype=np.int16,
+                                       shape=(n_subjects,) + shape + (n_channels + n_prior_channels,))
+    masks = np.lib.format.open_memmap(arrays['brain_masks'], mode='w+', dtype=np.uint8, shape=(n_subjects,) + shape)
+    labels = np.lib.format.open_memmap(arrays['ct_lesion_GT'], mode='w+', dtype=np.uint8, shape=(n_subjects,) + shape)
+    for index in tqdm(range(n_subjects), desc='Synthetic subjects'):
+        rng = np.random.RandomState(np.random.SeedSequence([seed, index]).generate_state(1)[0])
+        inputs[index], masks[index], labels[index] = generate_subject(
+            rng, shape, channel_names, prior_type=prior_type, lesion_volume=lesion_volume,
+            lesion_volume_sd=lesion_volume_sd, empty_fraction=empty_fraction)
+    del inputs, masks, labels
+
+    ids = np.array(['synthetic_{:05d}'.format(index) for index in range(n_subjects)])
+    params = {'ct_sequences': channel_names + prior_names, 'synthetic': True, 'seed': seed, 'shape': list(shape), 'prior_type': prior_type,
+              'lesion_volume': lesion_volume, 'lesion_volume_sd': lesion_volume_sd, 'empty_fraction': empty_fraction}
+    np.save(arrays['ids'], ids)
+    np.save(arrays['params'], np.array(params, dtype=object), allow_pickle=True)
+
+    _write_npz(path, arrays)
+    for array_path in arrays.values():
+        os.remove(array_path)
+    os.rmdir(tmp_dir)
+    print('Synthetic dataset of {0} subjects written to {1}'.format(n_subjects, path))
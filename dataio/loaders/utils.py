@@ -1,3 +1,8 @@
+import numpy as np
+import torch
+import torch.utils.data as data
+
+
 def validate_images(image, label=None):
     if label is not None:
         if image.shape[:-1] != label.shape[:-1]:
@@ -7,4 +12,51 @@ def validate_images(image, label=None):
 
     if image.max() < 1e-6:
         print('Error: blank image, image.max = {0}'.format(image.max()))
-        raise (Exception('blank image exception'))
\ No newline at end of file
+        raise (Exception('blank image exception'))
+
+
+def get_sample_seed(base_seed, epoch, index):
+    '''
+    Seed of the augmentation of a sample. It only depends on the run seed, the epoch and the sample index
+    (not on the worker loading the sample), so that augmented samples can be regenerated deterministically.
+    :param base_seed: seed of the run
+    :param epoch: current epoch
+    :param index: index of the sample in the dataset
+    :return: int seed
+    '''
+    return int(np.random.SeedSequence([int(base_seed), int(epoch), int(index)]).generate_state(1)[0])
+
+
+def worker_init_fn(worker_id):
+    '''
+    Give every DataLoader worker its own numpy stream, derived from the torch seed DataLoader assigns to the worker
+    (instead of inheriting the same numpy state from the main process)
+    :param worker_id: id of the worker
+    '''
+    np.random.seed(torch.initial_seed() % 2 ** 32)
+
+
+class SubjectSubset(data.Subset):
+    """
+    Fixed subset of the subjects of a dataset, items keep the index of the subject in the full dataset
+    """
+
+    def get_ids(self, indices):
+        return self.dataset.get_ids(indices)
+
+    @property
+    def ids(self):
+        return self.dataset.get_ids(self.indices)
+
+
+def get_subject_subsample(dataset, n_subjects, seed):
+    '''
+    :param dataset: dataset to subsample
+    :param n_subjects: number of subjects to keep
+    :param seed: seed of the (fixed) random choice of subjects
+    :return: SubjectSubset of n_subjects subjects, or the dataset itself if it is not larger
+    '''
+    if n_subjects >= len(dataset):
+        return dataset
+    indices = np.random.RandomState(seed).choice(len(dataset), n_subjects, replace=False)
+    return SubjectSubset(dataset, sorted(indices.tolist()))
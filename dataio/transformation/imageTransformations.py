@@ -4,8 +4,10 @@ import scipy.ndimage
 from scipy.ndimage.filters import gaussian_filter
 from scipy.ndimage.interpolation import map_coordinates
 import collections
+import random
 from PIL import Image
 import numbers
+import torch
 from typing import Optional, Tuple, Union
 from torch.nn.functional import pad
 from torchio.transforms import RandomAffine, RandomFlip, RandomNoise, RandomElasticDeformation
@@ -480,8 +482,10 @@ class TorchIOTransformer(object):
         self.max_output_channels = max_output_channels
         self.prudent = prudent
         self.verbose = verbose
+        self.rejected = False  # True if the last call returned the untransformed inputs
 
     def __call__(self, *inputs):
+        self.rejected = False
         if isinstance(inputs, collections.Sequence) or isinstance(inputs, np.ndarray):
             outputs = []
             for idx, _input in enumerate(inputs):
@@ -500,6 +504,7 @@ class TorchIOTransformer(object):
                                   f'for {transformer} and number of voxels in initial mask: {_input.sum()}')
                         if self.prudent:
                             if self.verbose: print('Returning non transformed input.')
+                            self.rejected = True
                             # Avoid loss of classes by transformation
                             # (either due to extreme transformation or very little voxels of a certain class present)
                             return inputs  # return bot all inputs untransformed
@@ -601,6 +606,95 @@ class RandomNoiseTransform(TorchIOTransformer):
         super().__init__(get_transformer=get_torchio_transformer, max_output_channels=max_output_channels, prudent=prudent)
 
 
+def scale_control_points(num_control_points, roi_shape, shape, spline_order=3):
+    """
+    Number of elastic control points giving a crop of roi_shape the control point spacing of the whole volume
+    (torchio spaces the grid by the image size over num_control_points - spline_order)
+    :return: tuple of control points along each dimension
+    """
+    if isinstance(num_control_points, int):
+        num_control_points = (num_control_points,) * 3
+    # at least 5 points, so that points remain movable inside the locked borders
+    return tuple(max(int(round((n - spline_order) * roi_size / size)) + spline_order, min(n, 5))
+                 for n, roi_size, size in zip(num_control_points, roi_shape, shape))
+
+
+class RoiRestrictedTransform(object):
+    """
+    Applies the given transforms only to the bounding box of the non-zero voxels (ie. the brain) of the inputs,
+    enlarged by a margin, and pastes the result back into the padded canvas.
+    Resampling cost thus scales with the size of the brain instead of the size of the padded volume.
+    The bounding box is centred on the canvas, so that rotations and scaling about the centre of the crop are the ones
+    about the centre of the canvas.
+    :arg get_transforms: function (roi_shape, shape) -> list of transforms applied to the cropped inputs (x, y, z, c),
+     eg. to scale the elastic control points to the crop (see scale_control_points)
+    :arg margin_ratio: margin relative to the extent of the bounding box (ie. for rotations and scaling)
+    :arg margin: additional margin in voxels (ie. for translations and elastic displacements)
+    """
+
+    def __init__(self, get_transforms, margin_ratio=0.0, margin=0):
+        self.get_transforms = get_transforms
+        self.margin_ratio = margin_ratio
+        self.margin = margin
+
+    def get_bounding_box(self, inputs):
+        spatial_shape = inputs[0].shape[:3]
+        foreground = None
+        for _input in inputs:
+            _foreground = (_input != 0).reshape(*spatial_shape, -1).any(dim=-1)
+            foreground = _foreground if foreground is None else foreground | _foreground
+        coordinates = foreground.nonzero()
+        if coordinates.size(0) == 0:
+            return tuple(slice(0, size) for size in spatial_shape)
+
+        bounding_box = []
+        for axis, size in enumerate(spatial_shape):
+            lower, upper = int(coordinates[:, axis].min()), int(coordinates[:, axis].max()) + 1
+            # symmetric about the centre of the canvas
+            lower = min(lower, size - upper)
+            margin = int(np.ceil((size - 2 * lower) * self.margin_ratio / 2)) + self.margin
+            lower = max(lower - margin, 0)
+            bounding_box.append(slice(lower, size - lower))
+        return tuple(bounding_box)
+
+    def __call__(self, *inputs):
+        roi = self.get_bounding_box(inputs)
+        outputs = [_input[roi].contiguous() for _input in inputs]
+        for t in self.get_transforms(outputs[0].shape[:3], inputs[0].shape[:3]):
+            outputs = t(*outputs)
+            if not isinstance(outputs, collections.Sequence):
+                outputs = [outputs]
+
+        pasted_outputs = []
+        for _input, _output in zip(inputs, outputs):
+            canvas = torch.zeros_like(_input)
+            canvas[roi] = _output.type_as(canvas)
+            pasted_outputs.append(canvas)
+
+        return pasted_outputs if len(pasted_outputs) > 1 else pasted_outputs[0]
+
+
+class PythonSeededTransform(object):
+    """
+    Runs a transform drawing from python's random module (ie. torchsample transforms) with a given seed.
+    The global random state is restored afterwards.
+    """
+
+    def __init__(self, transform, seed=None):
+        self.transform = transform
+        self.seed = seed
+
+    def __call__(self, *inputs):
+        if self.seed is None:
+            return self.transform(*inputs)
+        state = random.getstate()
+        random.seed(self.seed)
+        try:
+            return self.transform(*inputs)
+        finally:
+            random.setstate(state)
+
+
 class StandardizeImage(object):
     """
     Normalises given volume to zero mean and unit standard deviation.
@@ -0,0 +1,117 @@
+import time
+import multiprocessing
+from collections import OrderedDict
+import numpy as np
+try:
+    from torch.utils.data import get_worker_info
+except ImportError:
+    # torch < 1.2
+    get_worker_info = None
+
+
+def get_worker_id():
+    '''
+    :return: id of the current DataLoader worker, None in the main process
+    '''
+    if get_worker_info is None:
+        # DataLoader workers are the only processes started by the main process
+        identity = multiprocessing.current_process()._identity
+        return identity[0] - 1 if identity else None
+    worker_info = get_worker_info()
+    return None if worker_info is None else worker_info.id
+
+
+class TransformProfiler(object):
+    """
+    Records wall time, number of calls and prudent rejections per transform and per DataLoader worker.
+    Statistics live in shared memory inherited by the (forked) workers, every worker only writes its own row,
+    so that they can be aggregated in the main process after every epoch.
+    """
+    FIELDS = ['time', 'calls', 'rejections']
+
+    def __init__(self, names, max_workers=64):
+        self.names = list(names) + ['other']
+        self.max_workers = max_workers
+        # row 0 is the main process, row i + 1 is worker i
+        self.stats = multiprocessing.RawArray('d', (max_workers + 1) * len(self.names) * len(self.FIELDS))
+        # time of the profiled transforms running inside each running profiled transform (per process)
+        self.nested_times = []
+
+    def _get_array(self):
+        return np.frombuffer(self.stats, dtype=np.float64).reshape(self.max_workers + 1, len(self.names), len(self.FIELDS))
+
+    def record(self, name, elapsed, rejected=False):
+        worker_id = get_worker_id()
+        row = 0 if worker_id is None else worker_id % self.max_workers + 1
+        column = self.names.index(name) if name in self.names else len(self.names) - 1
+        stats = self._get_array()
+        stats[row, column, 0] += elapsed
+        stats[row, column, 1] += 1
+        stats[row, column, 2] += int(rejected)
+
+    def get_stats(self):
+        '''
+        Aggregate statistics over all workers
+        :return: OrderedDict transform name -> dict of time (s), calls, rejections and mean time per call (ms)
+        '''
+        totals = self._get_array().sum(axis=0)
+        stats = OrderedDict()
+        for name, (elapsed, calls, rejections) in zip(self.names, totals):
+            if calls == 0:
+                continue
+            stats[name] = {'time': elapsed, 'calls': int(calls), 'rejections': int(rejections),
+                           'mean_ms': 1000 * elapsed / calls}
+        return stats
+
+    def get_worker_times(self):
+        '''
+        :return: OrderedDict worker name -> total time spent in transforms (s)
+        '''
+        per_worker = self._get_array()[:, :, 0].sum(axis=1)
+        return OrderedDict([('main' if row == 0 else 'worker_{}'.format(row - 1), elapsed)
+                            for row, elapsed in enumerate(per_worker) if elapsed > 0])
+
+    def get_summary(self, epoch=None, split=None):
+        stats = self.get_stats()
+        total_time = sum(stat['time'] for stat in stats.values())
+        title = 'transform timings' if split is None else '{0} transform timings'.format(split)
+        message = '(epoch: {0}) {1}\n'.format(epoch, title) if epoch is not None else title + '\n'
+        for name, stat in stats.items():
+            message += '  {0:<24} {1:9.2f} s {2:5.1f} % {3:8d} calls {4:9.2f} ms/call {5:6d} prudent rejections\n'.format(
+                name, stat['time'], 100 * stat['time'] / max(total_time, 1e-12), stat['calls'], stat['mean_ms'],
+                stat['rejections'])
+        message += '  ' + ' '.join('{0}: {1:.2f} s'.format(worker, elapsed)
+                                   for worker, elapsed in self.get_worker_times().items())
+        return message
+
+    def reset(self):
+        self._get_array()[:] = 0
+
+
+class ProfiledTransform(object):
+    """
+    Times a transform and reports it to a TransformProfiler. Profiled transforms running inside the transform (eg. in
+    RoiRestrictedTransform) are reported on their own and their time is subtracted, so that every call is counted once.
+    """
+
+    def __init__(self, transform, profiler, name=None):
+        self.transform = transform
+        self.profiler = profiler
+        self.name = transform.__class__.__name__ if name is None else name
+
+    def __call__(self, *inputs):
+        nested_times = self.profiler.nested_times
+        nested_times.append(0.0)
+        start = time.perf_counter()
+        try:
+            outputs = self.transform(*inputs)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = nested_times.pop()
+            if nested_times:
+                nested_times[-1] += elapsed
+        self.profiler.record(self.name, elapsed - nested, rejected=getattr(self.transform, 'rejected', False))
+        return outputs
+
+    def __repr__(self):
+        return 'Profiled' + repr(self.transform)
@@ -1,8 +1,16 @@
+import hashlib
 import numpy as np
 import torchsample.transforms as ts
-from .imageTransformations import RandomElasticTransform, RandomAffineTransform, RandomNoiseTransform, RandomFlipTransform, StandardizeImage
+from .imageTransformations import RandomElasticTransform, RandomAffineTransform, RandomNoiseTransform, RandomFlipTransform, \
+    StandardizeImage, RoiRestrictedTransform, PythonSeededTransform, scale_control_points
+from .profiler import TransformProfiler, ProfiledTransform
 from pprint import pprint
 
+# Transforms reported individually by the transform profiler
+PROFILED_TRANSFORMS = ['ToTensor', 'Pad', 'TypeCast', 'ChannelsFirst', 'ChannelsLast', 'RandomFlip',
+                       'RandomFlipTransform', 'RandomElasticTransform', 'RandomAffineTransform',
+                       'RoiRestrictedTransform', 'PythonSeededTransform', 'StandardizeImage', 'RandomNoiseTransform']
+
 
 class Transformations:
 
@@ -40,13 +48,30 @@ class Transformations:
         self.random_elastic_prob = 0.0
         self.random_noise_prob = 0.0
 
+        # Restrict elastic and affine resampling to the brain bounding box (plus margin) instead of the padded volume
+        self.roi_augmentation = False
+        self.roi_margin = 2  # additional margin in voxels
+
         self.prudent = True
 
+        # Opt-in timing of every transform (see TransformProfiler), one profiler per split
+        self.profilers = None
+
     def print(self):
         print('\n\n############# Augmentation Parameters #############')
         pprint(vars(self))
         print('###################################################\n\n')
 
+    def get_signature(self):
+        '''
+        Hash of the augmentation parameters, used to invalidate caches of transformed data
+        :return: hex digest
+        '''
+        # verbosity does not change the transformed data
+        params = {key: value for key, value in vars(self).items()
+                  if isinstance(value, (int, float, str, bool, list, tuple, type(None))) and key != 'verbose'}
+        return hashlib.md5(repr(sorted(params.items())).encode()).hexdigest()
+
     def initialise(self, opts, max_output_channels=10, verbose=True):
         t_opts = getattr(opts, self.name)
         self.max_output_channels = max_output_channels
@@ -71,77 +96,164 @@ class Transformations:
         if hasattr(t_opts, 'random_elastic_prob'):  self.random_elastic_prob =  t_opts.random_elastic_prob
         if hasattr(t_opts, 'random_noise_prob'):    self.random_noise_prob =    t_opts.random_noise_prob
 
+        if hasattr(t_opts, 'roi_augmentation'):     self.roi_augmentation =     t_opts.roi_augmentation
+        if hasattr(t_opts, 'roi_margin'):           self.roi_margin =           t_opts.roi_margin
+
         # Define carefullness of transformation (True: do not allow loss of classes due to augmentation / False)
         if hasattr(t_opts, 'prudent'):              self.prudent =              t_opts.prudent
 
+        if hasattr(t_opts, 'profile') and t_opts.profile:
+            self.profilers = {split: TransformProfiler(PROFILED_TRANSFORMS) for split in ['train', 'valid']}
+
     def get_transformation(self):
         '''
         Get transformations for this dataset
         :return:
         '''
-        return {
-            'gsd_pCT': {'train': self.gsd_pCT_train_transform, 'valid': self.gsd_pCT_valid_transform},
-            'gsd_pCT_25D': {'train': self.gsd_pCT_train_transform, 'valid': self.gsd_pCT_valid_transform},
-            'isles2018': {'train': self.isles2018_train_transform, 'valid': self.isles2018_valid_transform}
+        transformations = {
+            'gsd_pCT': {'train': self.gsd_pCT_train_transform, 'valid': self.gsd_pCT_valid_transform,
+                        'store': self.gsd_pCT_store_transform, 'replay': self.gsd_pCT_replay_transform},
+            'gsd_pCT_25D': {'train': self.gsd_pCT_train_transform, 'valid': self.gsd_pCT_valid_transform,
+                            'store': self.gsd_pCT_store_transform, 'replay': self.gsd_pCT_replay_transform},
+            'isles2018': {'train': self.isles2018_train_transform, 'valid': self.isles2018_valid_transform,
+                          'store': self.isles2018_train_transform, 'replay': None}
         }[self.name]
+        # training transforms (train, store and replay) and validation transforms are timed separately
+        transformations['profilers'] = self.profilers
+
+        return transformations
+
+    def profile(self, transforms, split='train'):
+        '''
+        Wrap transforms for timing if profiling is enabled
+        :param transforms: list of transforms
+        :param split: 'train' or 'valid', every split reports to its own profiler
+        :return: list of transforms
+        '''
+        if self.profilers is None:
+            return transforms
+        profiler = self.profilers[split]
+        return [t if isinstance(t, ProfiledTransform) else ProfiledTransform(t, profiler) for t in transforms]
+
+    def get_resampling_transforms(self, seed):
+        '''
+        Elastic and affine resampling, optionally restricted to the brain bounding box
+        :param seed: seed for torchio
+        :return: list of transforms
+        '''
+        def get_transforms(num_control_points):
+            return self.profile([
+                RandomElasticTransform(max_displacement=self.max_deform,
+                                       num_control_points=num_control_points,
+                                       image_interpolation='bspline',
+                                       seed=seed, p=self.random_elastic_prob,
+                                       max_output_channels=self.max_output_channels, verbose=self.verbose, prudent=self.prudent),
+                RandomAffineTransform(scales=self.scale_val, degrees=self.rotate_val, translation=self.shift_val,
+                                      isotropic=True, default_pad_value=0,
+                                      image_interpolation='bspline', seed=seed, p=self.random_affine_prob,
+                                      max_output_channels=self.max_output_channels, verbose=self.verbose, prudent=self.prudent)
+            ])
+        if not self.roi_augmentation:
+            return get_transforms(self.elastic_control_points)
+
+        # the bounding box has to hold the brain after maximal rotation and scaling,
+        # as well as maximal translation and elastic displacement
+        max_rotation = min(np.deg2rad(np.max(np.abs(self.rotate_val))), np.pi / 4)
+        margin_ratio = max(np.max(self.scale_val) * (np.cos(max_rotation) + np.sin(max_rotation)) - 1, 0)
+        margin = int(np.ceil(np.max(np.abs(self.shift_val)) + np.max(self.max_deform))) + self.roi_margin
+        # the elastic control points keep the spacing they have on the whole volume
+        return [RoiRestrictedTransform(
+            lambda roi_shape, shape: get_transforms(scale_control_points(self.elastic_control_points, roi_shape, shape)),
+            margin_ratio=margin_ratio, margin=margin)]
 
     def gsd_pCT_train_transform(self, seed=None):
         if seed is None:
             seed = np.random.randint(0, 9999)  # seed must be an integer for torch
 
-        train_transform = ts.Compose([
+        train_transform = ts.Compose(self.profile([
             ts.ToTensor(),
             ts.Pad(size=self.scale_size),
             ts.TypeCast(['float', 'float']),
             RandomFlipTransform(axes=self.flip_axis, flip_probability=self.flip_prob_per_axis, p=self.random_flip_prob,
                                 seed=seed, max_output_channels=self.max_output_channels, prudent=self.prudent),
-            RandomElasticTransform(max_displacement=self.max_deform,
-                                   num_control_points=self.elastic_control_points,
-                                   image_interpolation='bspline',
-                                   seed=seed, p=self.random_elastic_prob,
-                                   max_output_channels=self.max_output_channels, verbose=self.verbose, prudent=self.prudent),
-            RandomAffineTransform(scales=self.scale_val, degrees=self.rotate_val, translation=self.shift_val,
-                                  isotropic=True, default_pad_value=0,
-                                  image_interpolation='bspline', seed=seed, p=self.random_affine_prob,
-                                  max_output_channels=self.max_output_channels, verbose=self.verbose, prudent=self.prudent),
+            *self.get_resampling_transforms(seed),
             StandardizeImage(norm_flag=[True, True, True, False]),
             RandomNoiseTransform(mean=self.noise_mean, std=self.noise_std, seed=seed, p=self.random_noise_prob,
                                  max_output_channels=self.max_output_channels, prudent=self.prudent),
             # Todo eventually add random crop augmentation (fork torchsample and fix the Random Crop bug)
             ts.ChannelsFirst(),
             ts.TypeCast(['float', 'float'])
-        ])
+        ]))
 
         return train_transform
 
+    def gsd_pCT_store_transform(self, seed=None):
+        '''
+        Expensive part of the training augmentation (elastic and affine resampling), pre-generated offline
+        into an augmentation store. Flips and noise are left to gsd_pCT_replay_transform.
+        '''
+        if seed is None:
+            seed = np.random.randint(0, 9999)  # seed must be an integer for torch
+
+        store_transform = ts.Compose(self.profile([
+            ts.ToTensor(),
+            ts.Pad(size=self.scale_size),
+            ts.TypeCast(['float', 'float']),
+            *self.get_resampling_transforms(seed),
+            StandardizeImage(norm_flag=[True, True, True, False]),
+            ts.ChannelsFirst(),
+            ts.TypeCast(['float', 'float'])
+        ]))
+
+        return store_transform
+
+    def gsd_pCT_replay_transform(self, seed=None):
+        '''
+        Cheap online augmentation (flip and noise) applied to samples replayed from an augmentation store
+        '''
+        if seed is None:
+            seed = np.random.randint(0, 9999)  # seed must be an integer for torch
+
+        replay_transform = ts.Compose(self.profile([
+            ts.ChannelsLast(),
+            RandomFlipTransform(axes=self.flip_axis, flip_probability=self.flip_prob_per_axis, p=self.random_flip_prob,
+                                seed=seed, max_output_channels=self.max_output_channels, prudent=self.prudent),
+            RandomNoiseTransform(mean=self.noise_mean, std=self.noise_std, seed=seed, p=self.random_noise_prob,
+                                 max_output_channels=self.max_output_channels, prudent=self.prudent),
+            ts.ChannelsFirst(),
+            ts.TypeCast(['float', 'float'])
+        ]))
+
+        return replay_transform
+
     def gsd_pCT_valid_transform(self, seed=None):
-        valid_transform = ts.Compose([
+        valid_transform = ts.Compose(self.profile([
             ts.ToTensor(),
             ts.Pad(size=self.scale_size),
             ts.TypeCast(['float', 'float']),
             StandardizeImage(norm_flag=[True, True, True, False]),
             ts.ChannelsFirst(),
             ts.TypeCast(['float', 'float'])
-        ])
+        ], split='valid'))
 
         return valid_transform
 
     def isles2018_train_transform(self, seed=None):
-        train_transform = ts.Compose([
+        train_transform = ts.Compose(self.profile([
             ts.ToTensor(),
             ts.Pad(size=self.scale_size),
             ts.TypeCast(['float', 'float']),
-            ts.RandomFlip(h=True, v=True, p=self.random_flip_prob),
+            PythonSeededTransform(ts.RandomFlip(h=True, v=True, p=self.random_flip_prob), seed=seed),
             ts.ChannelsFirst(),
             ts.TypeCast(['float', 'long'])
-        ])
+        ]))
         return train_transform
 
     def isles2018_valid_transform(self, seed=None):
-        valid_transform = ts.Compose([
+        valid_transform = ts.Compose(self.profile([
             ts.ToTensor(),
             ts.Pad(size=self.scale_size),
             ts.ChannelsFirst(),
             ts.TypeCast(['float', 'long'])
-        ])
+        ], split='valid'))
         return valid_transform
\ No newline at end of file
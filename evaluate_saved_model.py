@@ -8,13 +8,15 @@ from tqdm import tqdm
 from dataio.loaders import get_dataset, get_dataset_path
 from dataio.transformation import get_dataset_transformation
 from models import get_model
+from models.inference import load_scripted_model
 from utils.error_logger import StatLogger
 from utils.metrics import dice_score, distance_metric, precision_and_recall, single_class_dice_score, \
     intersection_over_union, specificity
 from utils.utils import json_file_to_pyobj, mkdir
 
 
-def evaluate_saved_model(model_config, split='validation', model_path=None, data_path=None, save_directory=None, save_nii=False, save_npz=False):
+def evaluate_saved_model(model_config, split='validation', model_path=None, data_path=None, save_directory=None, save_nii=False, save_npz=False,
+                         scripted_model_path=None):
     # Load options
     json_opts = json_file_to_pyobj(model_config)
     train_opts = json_opts.training
@@ -26,8 +28,11 @@ def evaluate_saved_model(model_config, split='validation', model_path=None, data
 
     model_opts = model_opts._replace(gpu_ids=[])
 
-    # Setup the NN Model
-    model = get_model(model_opts)
+    # Setup the NN Model, or the network exported with export_model.py (softmax and argmax are part of its graph)
+    if scripted_model_path is not None:
+        model = load_scripted_model(scripted_model_path)
+    else:
+        model = get_model(model_opts)
     if save_directory is None:
         save_directory = os.path.join(os.path.dirname(model_config), split + '_evaluation')
     mkdir(save_directory)
@@ -64,15 +69,19 @@ def evaluate_saved_model(model_config, split='validation', model_path=None, data
 
     # test
     for iteration, data in tqdm(enumerate(data_loader, 1)):
-        model.set_input(data[0], data[1])
-        model.test()
+        if scripted_model_path is not None:
+            _, pred_seg = model(data[0])
+        else:
+            model.set_input(data[0], data[1])
+            model.test()
+            pred_seg = model.pred_seg
 
         input_arr = np.squeeze(data[0].cpu().numpy()).astype(np.float32)
         prior_arr = np.squeeze(data[0].cpu().numpy())[5].astype(np.int16)
         prior_arr[prior_arr > 0] = 1
         label_arr = np.squeeze(data[1].cpu().numpy()).astype(np.int16)
         ids = dataset.get_ids(data[2])
-        output_arr = np.squeeze(model.pred_seg.cpu().byte().numpy()).astype(np.int16)
+        output_arr = np.squeeze(pred_seg.cpu().byte().numpy()).astype(np.int16)
 
         # If there is a label image - compute statistics
         dice_vals = dice_score(label_arr, output_arr, n_class=int(2))
@@ -0,0 +1,53 @@
+import os
+import torch
+
+from benchmarks.networks import get_input_shape
+from models import get_model, get_inference_opts
+from models.export import export_network, time_module
+from utils.utils import json_file_to_pyobj
+
+
+def export(arguments):
+    json_opts = json_file_to_pyobj(arguments.config)
+    model_opts = get_inference_opts(json_opts.model, arguments.model_path)
+    model = get_model(model_opts)
+
+    arch_type = json_opts.training.arch_type
+    size = getattr(json_opts.augmentation, arch_type).scale_size[:3]
+    example_input = torch.randn(*get_input_shape(model_opts.model_type, model_opts.tensor_dim, size,
+                                                 arguments.batch_size, model_opts.input_nc, model_opts.input_nz))
+
+    output = arguments.output if arguments.output is not None else \
+        os.path.splitext(arguments.model_path)[0] + '_scripted.pt'
+    metadata = {'model_type': model_opts.model_type, 'tensor_dim': model_opts.tensor_dim,
+                'input_nc': model_opts.input_nc, 'output_nc': model_opts.output_nc,
+                'channels': list(json_opts.data_opts.channels)}
+    compiled, metadata = export_network(model.net, example_input, output, metadata=metadata, method=arguments.method,
+                                        threshold=arguments.threshold, fold_batchnorm=not arguments.no_fold)
+    print('Exported {0} ({1}, input {2}, {3} batch normalisations folded) to {4}, max probability difference '
+          '{5:.2e}'.format(model_opts.model_type, arguments.method, metadata['input_shape'],
+                           metadata['folded_batchnorms'], output, metadata['max_probability_difference']))
+
+    if arguments.trials > 0:
+        eager = time_module(model.net, example_input, arguments.trials)
+        scripted = time_module(compiled, example_input, arguments.trials)
+        print('Median inference time: eager {0:.1f} ms (network only), exported {1:.1f} ms (with post-processing)'.format(
+            eager, scripted))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export a trained segmentation network to a self-contained TorchScript file')
+
+    parser.add_argument('-c', '--config',       help='training config file', required=True)
+    parser.add_argument('-m', '--model_path',   help='saved network weights (.pth)', required=True)
+    parser.add_argument('-o', '--output',       help='exported file (default: <model_path>_scripted.pt)', default=None)
+    parser.add_argument('--method',             help='trace (fixed input shape, all networks) or script', choices=['trace', 'script'], default='trace')
+    parser.add_argument('--no_fold',            help='do not fold the batch normalisations into the convolutions', action='store_true')
+    parser.add_argument('--threshold',          help='threshold of single channel outputs', type=float, default=0.5)
+    parser.add_argument('-b', '--batch_size',   help='batch size of the traced input', type=int, default=1)
+    parser.add_argument('--trials',             help='timed inferences of the eager and exported network (0 to skip)', type=int, default=5)
+    args = parser.parse_args()
+
+    export(args)
@@ -0,0 +1,59 @@
+from dataio.loaders import get_dataset, get_dataset_path
+from dataio.loaders.augmentation_store import write_augmentation_store
+from dataio.transformation import Transformations
+from utils.utils import json_file_to_pyobj
+
+
+def generate(arguments):
+
+    # Load options
+    json_opts = json_file_to_pyobj(arguments.config)
+    train_opts = json_opts.training
+
+    # Architecture type
+    arch_type = train_opts.arch_type
+
+    # Setup Dataset and Augmentation
+    ds_class = get_dataset(arch_type)
+    ds_path = get_dataset_path(arch_type, json_opts.data_path)
+    trans_obj = Transformations(arch_type)
+    trans_obj.initialise(json_opts.augmentation, json_opts.model.output_nc, verbose=False)
+    trans_obj.print()
+    ds_transform = trans_obj.get_transformation()
+
+    # Setup channels
+    channels = json_opts.data_opts.channels
+    if len(channels) != json_opts.model.input_nc \
+            or len(channels) != getattr(json_opts.augmentation, arch_type).scale_size[-1]:
+        raise Exception('Number of data channels must match number of model channels, and patch and scale size dimensions')
+
+    split_opts = json_opts.data_split
+    dataset_kwargs = {'input_nz': json_opts.model.input_nz} if arch_type == 'gsd_pCT_25D' else {}
+    train_dataset = ds_class(ds_path, split='train', transform=None, preload_data=train_opts.preloadData,
+                             train_size=split_opts.train_size, test_size=split_opts.test_size,
+                             valid_size=split_opts.validation_size, split_seed=split_opts.seed, channels=channels,
+                             **dataset_kwargs)
+
+    # with the seed of the training run, stored epoch k reproduces the elastic and affine augmentation of online epoch k
+    seed = arguments.seed
+    if seed is None:
+        seed = train_opts.seed if hasattr(train_opts, 'seed') else 42
+
+    write_augmentation_store(arguments.output, train_dataset, ds_transform['store'], arguments.epochs,
+                             seed=seed, num_workers=arguments.workers,
+                             augmentation_params=vars(trans_obj))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Pre-generate augmented training epochs into an augmentation store')
+
+    parser.add_argument('-c', '--config',  help='training config file', required=True)
+    parser.add_argument('-o', '--output',  help='output directory of the augmentation store', required=True)
+    parser.add_argument('-k', '--epochs',  help='number of augmented epochs', type=int, default=10)
+    parser.add_argument('-s', '--seed',    help='seed of the run (default: training.seed of the config)', type=int, default=None)
+    parser.add_argument('-w', '--workers', help='number of augmentation workers', type=int, default=16)
+    args = parser.parse_args()
+
+    generate(args)
@@ -0,0 +1,27 @@
+from dataio.loaders.synthetic_dataset import write_synthetic_dataset
+
+
+def generate(arguments):
+    write_synthetic_dataset(arguments.output, arguments.subjects, shape=arguments.shape, n_channels=arguments.channels,
+                            prior_type=arguments.prior, lesion_volume=arguments.lesion_volume,
+                            lesion_volume_sd=arguments.lesion_volume_sd, empty_fraction=arguments.empty_fraction,
+                            seed=arguments.seed)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic perfusion CT dataset in the layout of the Geneva Stroke Dataset')
+
+    parser.add_argument('-o', '--output',       help='output .npz file', required=True)
+    parser.add_argument('-n', '--subjects',     help='number of subjects', type=int, default=100)
+    parser.add_argument('--shape',              help='volume shape x y z', nargs=3, type=int, default=[96, 96, 48])
+    parser.add_argument('--channels',           help='number of perfusion map channels (Tmax, CBF, MTT, CBV, NCCT, then generic maps)', type=int, default=4)
+    parser.add_argument('--prior',              help='prior information channels appended after the maps', choices=['core', 'one_hot_core'], default=None)
+    parser.add_argument('--lesion_volume',      help='median lesion volume as fraction of the brain volume', type=float, default=0.03)
+    parser.add_argument('--lesion_volume_sd',   help='standard deviation of the log lesion volume', type=float, default=0.8)
+    parser.add_argument('--empty_fraction',     help='fraction of subjects without lesion', type=float, default=0.0)
+    parser.add_argument('-s', '--seed',         help='seed, every subject is generated from (seed, index)', type=int, default=42)
+    args = parser.parse_args()
+
+    generate(args)
@@ -23,6 +23,8 @@ class ModelOpts:
         self.criterion = 'cross_entropy'
         self.loss_class_idx = [1]
         self.type = 'seg'
+        self.precision = 'fp32'  # 'fp32', 'bf16' or 'fp16'
+        self.checkpointing = False  # True or list of levels (1: full resolution, 5: center)
 
         # Attention
         self.nonlocal_mode = 'concatenation'
@@ -56,6 +58,8 @@ class ModelOpts:
         if hasattr(opts, 'tensor_dim'):    self.tensor_dim = opts.tensor_dim
         if hasattr(opts, 'input_nz'):      self.input_nz = opts.input_nz
         if hasattr(opts, 'conv_bloc_type'):    self.conv_bloc_type = opts.conv_bloc_type
+        if hasattr(opts, 'precision'):     self.precision = opts.precision
+        if hasattr(opts, 'checkpointing'): self.checkpointing = opts.checkpointing
 
         if hasattr(opts, 'path_pre_trained_model'): self.path_pre_trained_model = opts.path_pre_trained_model
         if hasattr(opts, 'criterion'):              self.criterion = opts.criterion
@@ -70,12 +74,32 @@ class ModelOpts:
         # Classifier
         if hasattr(opts, 'aggregation_mode'): self.aggregation_mode = opts.aggregation_mode
 
+
+def get_inference_opts(json_opts, model_path):
+    '''
+    Options to load saved weights for inference on the CPU, the config does not need to contain the inference fields
+    :param json_opts: model section of a config
+    :param model_path: saved network weights (.pth)
+    '''
+    model_opts = ModelOpts()
+    model_opts.initialise(json_opts)
+    model_opts.isTrain = False
+    model_opts.gpu_ids = []
+    model_opts.path_pre_trained_model = model_path
+    return model_opts
+
 def get_model(json_opts):
+    '''
+    :param json_opts: model section of a config, or ModelOpts (eg. with options set on top of a config)
+    '''
 
     # Neural Network Model Initialisation
     model = None
-    model_opts = ModelOpts()
-    model_opts.initialise(json_opts)
+    if isinstance(json_opts, ModelOpts):
+        model_opts = json_opts
+    else:
+        model_opts = ModelOpts()
+        model_opts.initialise(json_opts)
 
     # Print the model type
     print('\nInitialising model {}'.format(model_opts.model_type))
@@ -1,6 +1,8 @@
 import os
+import contextlib
 import torch
 from utils.utils import mkdir
+from utils.checkpoint import AsyncCheckpointWriter, get_rng_state
 from .networks_other import get_n_parameters
 
 class BaseModel():
@@ -16,6 +18,13 @@ class BaseModel():
         self.which_epoch = int(0)
         self.path_pre_trained_model = None
         self.saved_model = None
+        self.n_optimizer_steps = 0
+        self.n_scheduled_optimizer_steps = 0
+        # optimizer steps of an epoch without gradient accumulation, None to schedule by epochs
+        self.steps_per_epoch = None
+        self.n_scheduled_epochs = 0
+        self.checkpoint_writer = None
+        self.timer = None
 
 
     def name(self):
@@ -36,6 +45,22 @@ class BaseModel():
     def set_scheduler(self, train_opt):
         pass
 
+    def set_steps_per_epoch(self, steps_per_epoch):
+        '''
+        Count epochs of the learning rate schedule and of early stopping in optimizer steps, so that gradient
+        accumulation does not change the number of updates between learning rate decays
+        :param steps_per_epoch: optimizer steps of an epoch without gradient accumulation (ie. batches per epoch)
+        '''
+        self.steps_per_epoch = steps_per_epoch
+
+    def get_step_epochs(self):
+        '''
+        :return: optimizer steps made so far in epochs without gradient accumulation, None if not set
+        '''
+        if self.steps_per_epoch is None:
+            return None
+        return self.n_optimizer_steps / self.steps_per_epoch
+
     def forward(self, split):
         pass
 
@@ -61,17 +86,84 @@ class BaseModel():
     def save(self, label):
         pass
 
+    def set_timer(self, timer):
+        '''
+        :param timer: StageTimer recording the stages of the training updates, None to disable timing
+        '''
+        self.timer = timer
+
+    def timed(self, stage):
+        if self.timer is None:
+            return contextlib.nullcontext()
+        return self.timer.stage(stage)
+
+    def get_checkpoint_writer(self):
+        if self.checkpoint_writer is None:
+            self.checkpoint_writer = AsyncCheckpointWriter()
+        return self.checkpoint_writer
+
+    def wait_for_checkpoints(self):
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.wait()
+
     # helper saving function that can be used by subclasses
+    # checkpoints are written by a background thread from a copy of the state
     def save_network(self, network, network_label, epoch_label, gpu_ids):
         print('Saving the model {0} at the end of epoch {1}'.format(network_label, epoch_label))
         save_filename = '{0:03d}_net_{1}.pth'.format(epoch_label, network_label)
         save_path = os.path.join(self.save_dir, save_filename)
-        torch.save(network.cpu().state_dict(), save_path)
-        if len(gpu_ids) and torch.cuda.is_available():
-            network.cuda(gpu_ids[0])
+        state_dict = network.state_dict() if isinstance(network, torch.nn.Module) else network
+        self.get_checkpoint_writer().save(state_dict, save_path)
 
     def delete_saved_network(self):
-        os.remove(os.path.join(self.save_dir, self.saved_model))
+        self.get_checkpoint_writer().delete(os.path.join(self.save_dir, self.saved_model))
+
+    def get_training_state_path(self):
+        return os.path.join(self.save_dir, 'training_state.pth')
+
+    def get_training_state(self, epoch):
+        '''
+        :param epoch: last completed epoch
+        :return: everything needed to resume training exactly after epoch
+        '''
+        return {'epoch': epoch,
+                'net': self.net.state_dict(),
+                'optimizers': [optimizer.state_dict() for optimizer in self.optimizers],
+                'schedulers': [scheduler.state_dict() for scheduler in self.schedulers],
+                'n_optimizer_steps': self.n_optimizer_steps,
+                'n_scheduled_optimizer_steps': self.n_scheduled_optimizer_steps,
+                'n_scheduled_epochs': self.n_scheduled_epochs,
+                'saved_model': self.saved_model,
+                'rng': get_rng_state()}
+
+    def save_training_state(self, epoch, **extra_state):
+        '''
+        Write the full training state to <save_dir>/training_state.pth, replacing the previous one
+        :param epoch: last completed epoch
+        :param extra_state: state of objects living outside of the model (eg. early stopper)
+        '''
+        state = self.get_training_state(epoch)
+        state.update(extra_state)
+        self.get_checkpoint_writer().save(state, self.get_training_state_path())
+
+    def load_training_state(self, state):
+        '''
+        Restore the network, optimizers, schedulers and step counters, schedulers have to be set beforehand.
+        The RNG state of the training state (see utils.checkpoint.set_rng_state) should be restored right before
+        the first resumed epoch.
+        :param state: training state as loaded by utils.checkpoint.load_checkpoint
+        '''
+        print('Resuming after epoch {0}'.format(state['epoch']))
+        self.net.load_state_dict(state['net'])
+        for optimizer, optimizer_state in zip(self.optimizers, state['optimizers']):
+            optimizer.load_state_dict(optimizer_state)
+        for scheduler, scheduler_state in zip(self.schedulers, state['schedulers']):
+            scheduler.load_state_dict(scheduler_state)
+        self.n_optimizer_steps = state['n_optimizer_steps']
+        self.n_scheduled_optimizer_steps = state['n_scheduled_optimizer_steps']
+        self.n_scheduled_epochs = state.get('n_scheduled_epochs', state['epoch'] + 1)
+        self.saved_model = state['saved_model']
+        self.which_epoch = state['epoch'] + 1
 
     def update_saved_model(self, network_label, epoch_label):
         self.saved_model = '{0:03d}_net_{1}.pth'.format(epoch_label, network_label)
@@ -92,11 +184,23 @@ class BaseModel():
 
     # update learning rate (called once every epoch)
     def update_learning_rate(self, metric=None, epoch=None):
+        # schedulers only advance after the optimizers made a step
+        if self.n_optimizer_steps == self.n_scheduled_optimizer_steps:
+            print('no optimizer step since the last learning rate update, skipping the schedulers')
+            return
+        self.n_scheduled_optimizer_steps = self.n_optimizer_steps
+        # epoch schedules advance once per steps_per_epoch optimizer steps if set, once per call otherwise
+        step_epochs = self.get_step_epochs()
+        n_epochs = max(int(step_epochs) - self.n_scheduled_epochs, 0) if step_epochs is not None else 1
+        self.n_scheduled_epochs += n_epochs
         for scheduler in self.schedulers:
             if isinstance(scheduler, torch.optim.lr_scheduler.ReduceLROnPlateau):
-                scheduler.step(metrics=metric)
+                # plateau schedulers only advance on epochs with a validation loss
+                if metric is not None:
+                    scheduler.step(metrics=metric)
             else:
-                scheduler.step()
+                for _ in range(n_epochs):
+                    scheduler.step()
             lr = self.optimizers[0].param_groups[0]['lr']
         print('current learning rate = %.7f' % lr)
 
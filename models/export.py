@@ -0,0 +1,105 @@
+'''
+Export of the segmentation networks to self-contained TorchScript files, see models.inference for the loader
+'''
+
+import json
+import time
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .fusion import optimize_for_inference, verify_optimized_network
+
+
+class SegmentationInference(nn.Module):
+    """
+    Network followed by the post-processing of FeedForwardSegmentation.forward('test'): softmax and argmax for
+    multi-class outputs, sigmoid and threshold for single channel outputs
+    """
+
+    def __init__(self, net, threshold=0.5):
+        super(SegmentationInference, self).__init__()
+        self.net = net
+        self.threshold = threshold
+
+    def forward(self, x):
+        prediction = self.net(x).float()
+        if prediction.shape[1] > 1:
+            probabilities = F.softmax(prediction, dim=1)
+            segmentation = probabilities.argmax(dim=1, keepdim=True).to(torch.uint8)
+        else:
+            probabilities = torch.sigmoid(prediction)
+            segmentation = (probabilities > self.threshold).to(torch.uint8)
+        return probabilities, segmentation
+
+
+def compile_network(net, example_input, method='trace', threshold=0.5):
+    '''
+    :param net: network, is put in eval mode
+    :param example_input: input of the trace, traced networks only accept inputs of its shape
+    :param method: 'trace' (all networks) or 'script' (networks without python-only constructs)
+    :return: compiled SegmentationInference module
+    '''
+    if method not in ['trace', 'script']:
+        raise NotImplementedError(f'{method} is not implemented, use one of [\'trace\', \'script\']')
+    net.eval()
+    module = SegmentationInference(net, threshold=threshold).eval()
+    with torch.no_grad():
+        if method == 'trace':
+            compiled = torch.jit.trace(module, example_input, check_trace=False)
+        else:
+            compiled = torch.jit.script(module)
+    # fold the parameters and attributes into the graph (PyTorch >= 1.8)
+    if hasattr(torch.jit, 'freeze'):
+        compiled = torch.jit.freeze(compiled)
+    return compiled
+
+
+def verify_compiled_network(net, compiled, example_input, threshold=0.5, tolerance=1e-4):
+    '''
+    Compare the outputs of the compiled module with the eager network and post-processing
+    :return: dict of the maximum probability difference and the fraction of differing voxels
+    '''
+    with torch.no_grad():
+        probabilities, segmentation = SegmentationInference(net, threshold=threshold).eval()(example_input)
+        compiled_probabilities, compiled_segmentation = compiled(example_input)
+    max_difference = float((probabilities - compiled_probabilities).abs().max())
+    mismatch = float((segmentation != compiled_segmentation).float().mean())
+    if max_difference > tolerance:
+        raise Exception('The compiled network deviates from the eager network by {0:.2e} (tolerance {1:.0e})'.format(
+            max_difference, tolerance))
+    return {'max_probability_difference': max_difference, 'segmentation_mismatch': mismatch}
+
+
+def time_module(module, example_input, n_trials=5):
+    '''
+    :return: median inference time (ms)
+    '''
+    times = []
+    with torch.no_grad():
+        module(example_input)
+        for _ in range(n_trials):
+            start = time.perf_counter()
+            module(example_input)
+            times.append(1000 * (time.perf_counter() - start))
+    return sorted(times)[len(times) // 2]
+
+
+def export_network(net, example_input, path, metadata=None, method='trace', threshold=0.5, fold_batchnorm=True):
+    '''
+    Compile a network with its post-processing and save it with metadata (shapes, classes, threshold), the file is
+    loaded with models.inference.load_scripted_model
+    :param fold_batchnorm: fold the batch normalisations into the convolutions first, see models.fusion
+    :return: compiled module, metadata
+    '''
+    n_folded = 0
+    if fold_batchnorm:
+        folded, n_folded = optimize_for_inference(net)
+        verify_optimized_network(net, folded, example_input)
+        net = folded
+    compiled = compile_network(net, example_input, method=method, threshold=threshold)
+    verification = verify_compiled_network(net, compiled, example_input, threshold=threshold)
+    metadata = {**(metadata or {}), 'method': method, 'threshold': threshold, 'folded_batchnorms': n_folded,
+                'input_shape': list(example_input.shape), 'fixed_input_shape': method == 'trace', **verification}
+    torch.jit.save(compiled, path, _extra_files={'metadata.json': json.dumps(metadata)})
+    return compiled, metadata
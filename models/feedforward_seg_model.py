@@ -1,4 +1,5 @@
 import os
+import contextlib
 from collections import OrderedDict
 from torch.autograd import Variable
 import utils.utils as util
@@ -21,6 +22,7 @@ class FeedForwardSegmentation(BaseModel):
 
 
         # define network input and output pars
+        self.ddp_net = None
         self.input = None
         self.target = None
         self.tensor_dim = opts.tensor_dim
@@ -30,9 +32,13 @@ class FeedForwardSegmentation(BaseModel):
                                in_channels=opts.input_nc, nonlocal_mode=opts.nonlocal_mode,
                                tensor_dim=opts.tensor_dim, feature_scale=opts.feature_scale,
                                attention_dsample=opts.attention_dsample,
-                               prior_information_channels=opts.prior_information_channels)
+                               prior_information_channels=opts.prior_information_channels,
+                               checkpointing=opts.checkpointing)
         if self.use_cuda: self.net = self.net.cuda()
 
+        # mixed precision
+        self.set_precision(opts.precision)
+
         # load the model if a path is specified or it is in inference mode
         if not self.isTrain or opts.continue_train:
             self.path_pre_trained_model = opts.path_pre_trained_model
@@ -57,12 +63,54 @@ class FeedForwardSegmentation(BaseModel):
                 print('Network is initialized')
                 print_network(self.net)
 
+    def set_precision(self, precision):
+        '''
+        Run the forward pass in autocast with a reduced precision, losses and metrics are always computed in float32
+        :param precision: 'fp32', 'bf16' (CPU and GPU) or 'fp16' (GPU only, falls back to bf16 on CPU)
+        '''
+        if precision not in ['fp32', 'bf16', 'fp16']:
+            raise NotImplementedError(f'{precision} is not implemented, use one of [\'fp32\', \'bf16\', \'fp16\']')
+        if precision != 'fp32' and not hasattr(torch, 'autocast'):
+            raise Exception(f'Mixed precision ({precision}) requires PyTorch >= 1.10')
+        if precision == 'fp16' and not self.use_cuda:
+            print('fp16 autocast is not available on CPU, using bf16 instead')
+            precision = 'bf16'
+
+        self.precision = precision
+        self.device_type = 'cuda' if self.use_cuda else 'cpu'
+        self.autocast_dtype = {'fp32': torch.float32, 'bf16': torch.bfloat16, 'fp16': torch.float16}[precision]
+        # float16 gradients underflow without loss scaling, bfloat16 has the exponent range of float32
+        self.scaler = torch.cuda.amp.GradScaler() if precision == 'fp16' and self.isTrain else None
+
+    def distribute(self):
+        '''
+        Wrap the network in DistributedDataParallel, gradients are averaged over all processes of the default process
+        group during backward. The unwrapped network stays available as self.net for evaluation and saving.
+        '''
+        device_ids = [torch.cuda.current_device()] if self.use_cuda else None
+        self.ddp_net = torch.nn.parallel.DistributedDataParallel(self.net, device_ids=device_ids)
+
+    def gradient_sync(self, enabled):
+        # skip the gradient all-reduce for micro-batches that are followed by more accumulation
+        if self.ddp_net is None or enabled:
+            return contextlib.nullcontext()
+        return self.ddp_net.no_sync()
+
+    def autocast(self):
+        if self.precision == 'fp32':
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device_type, dtype=self.autocast_dtype)
+
     def set_scheduler(self, train_opt):
         for optimizer in self.optimizers:
             self.schedulers.append(get_scheduler(optimizer, train_opt))
             print('Scheduler is added for optimiser {0}'.format(optimizer))
 
     def set_input(self, *inputs):
+        with self.timed('set_input'):
+            self._set_input(*inputs)
+
+    def _set_input(self, *inputs):
         # self.input.resize_(inputs[0].size()).copy_(inputs[0])
         for idx, _input in enumerate(inputs):
             # If it's a 5D array and 2D model then (B x C x H x W x Z) -> (BZ x C x H x W)
@@ -78,12 +126,19 @@ class FeedForwardSegmentation(BaseModel):
                 # assert self.input.size() == self.target.size()
 
     def forward(self, split):
+        # the network runs in autocast, its output is cast back so that softmax, losses and dice sums stay in float32
         if split == 'train':
-            self.prediction = self.net(Variable(self.input))
+            net = self.net if self.ddp_net is None else self.ddp_net
+            with self.timed('forward'):
+                with self.autocast():
+                    self.prediction = net(Variable(self.input))
+                self.prediction = self.prediction.float()
             self.pred_seg = None
         elif split == 'test':
             with torch.no_grad():
-                self.prediction = self.net(Variable(self.input))
+                with self.autocast():
+                    self.prediction = self.net(Variable(self.input))
+                self.prediction = self.prediction.float()
                 # Apply a softmax and return a segmentation map
                 if self.prediction.shape[1] > 1: # multiclass
                     self.logits = self.net.apply_argmax_softmax(self.prediction, dim=1)
@@ -92,9 +147,25 @@ class FeedForwardSegmentation(BaseModel):
                     self.logits = self.net.apply_argmax_softmax(self.prediction, dim=None)
                     self.pred_seg = (self.logits > 0.5).float()
 
-    def backward(self):
-        self.loss_S = self.criterion(self.prediction, self.target)
-        self.loss_S.backward()
+    def backward(self, loss_weight=1.0):
+        with self.timed('loss'):
+            self.loss_S = self.criterion(self.prediction, self.target)
+            # the reported loss stays unweighted, only the gradients of accumulated micro-batches are averaged
+            loss = self.loss_S * loss_weight if loss_weight != 1.0 else self.loss_S
+        with self.timed('backward'):
+            if self.scaler is not None:
+                self.scaler.scale(loss).backward()
+            else:
+                loss.backward()
+
+    def step_optimizer(self):
+        with self.timed('optimizer'):
+            if self.scaler is not None:
+                self.scaler.step(self.optimizer_S)
+                self.scaler.update()
+            else:
+                self.optimizer_S.step()
+        self.n_optimizer_steps += 1
 
     def optimize_parameters(self):
         self.net.train()
@@ -102,19 +173,31 @@ class FeedForwardSegmentation(BaseModel):
 
         self.optimizer_S.zero_grad()
         self.backward()
-        self.optimizer_S.step()
+        self.step_optimizer()
+
+    def optimize_parameters_accumulate_grd(self, iteration, n_iterations, accumulate_iters):
+        '''
+        Accumulate the gradients of accumulate_iters micro-batches and update the network parameters once
+        :param iteration: index of the micro-batch in the epoch, starting at 1
+        :param n_iterations: number of micro-batches in the epoch, the leftover micro-batches at the end of the epoch
+         form a smaller last group
+        :param accumulate_iters: number of micro-batches per optimizer step
+        '''
+        group_start = (iteration - 1) // accumulate_iters * accumulate_iters + 1
+        group_size = min(accumulate_iters, n_iterations - group_start + 1)
+
+        last_of_group = iteration == group_start + group_size - 1
 
-    # This function updates the network parameters every "accumulate_iters"
-    def optimize_parameters_accumulate_grd(self, iteration):
-        accumulate_iters = int(2)
-        if iteration == 0: self.optimizer_S.zero_grad()
+        if iteration == group_start:
+            with self.timed('optimizer'):
+                self.optimizer_S.zero_grad()
         self.net.train()
-        self.forward(split='train')
-        self.backward()
+        with self.gradient_sync(last_of_group):
+            self.forward(split='train')
+            self.backward(loss_weight=1.0 / group_size)
 
-        if iteration % accumulate_iters == 0:
-            self.optimizer_S.step()
-            self.optimizer_S.zero_grad()
+        if last_of_group:
+            self.step_optimizer()
 
     def test(self):
         self.net.eval()
@@ -145,8 +228,14 @@ class FeedForwardSegmentation(BaseModel):
         seg_img = util.tensor2im(self.pred_seg, 'lbl')
         return OrderedDict([('out_S', seg_img), ('inp_S', inp_img), ('target_S', target_img)])
 
-    def get_current_volumes(self):
-        def to_volume(a): return a.cpu().float().detach().numpy()
+    def get_current_volumes(self, batch_indices=None):
+        '''
+        :param batch_indices: samples of the batch to copy to the host, all samples if None
+        '''
+        def to_volume(a):
+            if batch_indices is not None:
+                a = a[batch_indices]
+            return a.detach().float().cpu().numpy()
         output = self.prediction if self.pred_seg is None else self.pred_seg
         return OrderedDict([('output', to_volume(output)),
                             ('input', to_volume(self.input)),
@@ -161,15 +250,29 @@ class FeedForwardSegmentation(BaseModel):
         if size is None:
             size = (1, 1, 160, 160, 96)
 
-        inp_array = Variable(torch.zeros(*size)).cuda()
-        out_array = Variable(torch.zeros(*size)).cuda()
+        device = 'cuda' if self.use_cuda else 'cpu'
+        inp_array = Variable(torch.zeros(*size, device=device))
+        out_array = Variable(torch.zeros(*size, device=device))
         fp, bp = benchmark_fp_bp_time(self.net, inp_array, out_array)
 
         bsize = size[0]
         return fp/float(bsize), bp/float(bsize)
 
-    def save(self, network_label, epoch_label):
-        self.save_network(self.net, network_label, epoch_label, self.gpu_ids)
+    def get_training_state(self, epoch):
+        state = BaseModel.get_training_state(self, epoch)
+        state['scaler'] = self.scaler.state_dict() if self.scaler is not None else None
+        return state
+
+    def load_training_state(self, state):
+        BaseModel.load_training_state(self, state)
+        if self.scaler is not None and state.get('scaler') is not None:
+            self.scaler.load_state_dict(state['scaler'])
+
+    def save(self, network_label, epoch_label, state_dict=None):
+        '''
+        :param state_dict: weights to save instead of the current ones (eg. a snapshot validated asynchronously)
+        '''
+        self.save_network(self.net if state_dict is None else state_dict, network_label, epoch_label, self.gpu_ids)
         if self.saved_model is not None:
             self.delete_saved_network()
         self.update_saved_model(network_label, epoch_label)
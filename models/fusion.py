@@ -0,0 +1,82 @@
+'''
+Folding of eval-mode batch normalisation into the preceding convolutions for inference
+'''
+
+import copy
+import torch
+import torch.nn as nn
+
+
+CONV_TYPES = (nn.Conv1d, nn.Conv2d, nn.Conv3d)
+TRANSPOSED_CONV_TYPES = (nn.ConvTranspose1d, nn.ConvTranspose2d, nn.ConvTranspose3d)
+BN_TYPES = (nn.BatchNorm1d, nn.BatchNorm2d, nn.BatchNorm3d)
+
+
+def fuse_conv_bn(conv, bn):
+    '''
+    Convolution computing conv followed by bn with the running statistics of bn
+    :return: new convolution (with bias)
+    '''
+    if conv.groups != 1 and isinstance(conv, TRANSPOSED_CONV_TYPES):
+        raise NotImplementedError('Folding batch normalisation into grouped transposed convolutions is not implemented')
+    fused = copy.deepcopy(conv)
+    with torch.no_grad():
+        scale = bn.weight / torch.sqrt(bn.running_var + bn.eps) if bn.affine else 1 / torch.sqrt(bn.running_var + bn.eps)
+        shift = bn.bias - bn.running_mean * scale if bn.affine else -bn.running_mean * scale
+        # output channels are the first weight dimension of convolutions, the second of transposed convolutions
+        axis = 1 if isinstance(conv, TRANSPOSED_CONV_TYPES) else 0
+        shape = [1] * conv.weight.dim()
+        shape[axis] = -1
+        fused.weight.copy_(conv.weight * scale.view(shape))
+        bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+        fused.bias = nn.Parameter(bias * scale + shift)
+    return fused
+
+
+def can_fold(conv, bn):
+    return isinstance(conv, CONV_TYPES + TRANSPOSED_CONV_TYPES) and isinstance(bn, BN_TYPES) \
+        and bn.track_running_stats and bn.running_mean is not None and conv.out_channels == bn.num_features \
+        and not (conv.groups != 1 and isinstance(conv, TRANSPOSED_CONV_TYPES))
+
+
+def optimize_for_inference(net, inplace=False):
+    '''
+    Fold every batch normalisation which directly follows a convolution in an nn.Sequential (the conv blocks, gating
+    signals, combine_gates and attention W projections of all networks) into the convolution, and replace it with an
+    identity. The folded network is only valid in eval mode.
+    :param inplace: modify net instead of a copy
+    :return: folded network (in eval mode), number of folded batch normalisations
+    '''
+    if not inplace:
+        net = copy.deepcopy(net)
+    net.eval()
+    n_folded = 0
+    for module in net.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        names = list(module._modules.keys())
+        for name, next_name in zip(names[:-1], names[1:]):
+            conv, bn = module._modules[name], module._modules[next_name]
+            if can_fold(conv, bn):
+                module._modules[name] = fuse_conv_bn(conv, bn)
+                module._modules[next_name] = nn.Identity()
+                n_folded += 1
+    return net, n_folded
+
+
+def verify_optimized_network(net, optimized, x, tolerance=1e-4):
+    '''
+    Compare the outputs of the folded network with the original network in eval mode
+    :return: maximum absolute difference relative to the maximum absolute output
+    '''
+    net.eval()
+    optimized.eval()
+    with torch.no_grad():
+        output, optimized_output = net(x), optimized(x)
+    if isinstance(output, tuple):
+        output, optimized_output = output[0], optimized_output[0]
+    difference = float((output - optimized_output).abs().max() / output.abs().max().clamp(min=1e-12))
+    if difference > tolerance:
+        raise Exception('The folded network deviates from the original network by {0:.2e} (tolerance {1:.0e})'.format(
+            difference, tolerance))
+    return difference
@@ -0,0 +1,35 @@
+'''
+Standalone loader of networks exported with models.export. Only torch is needed to run an exported network: the
+training code, the data pipeline (torchio, sklearn, cv2) and the network definitions are not imported.
+'''
+
+import json
+import torch
+
+
+class ScriptedSegmentation(object):
+    """
+    Exported network with the softmax/sigmoid and the argmax/threshold of FeedForwardSegmentation in its graph
+    """
+
+    def __init__(self, path, device='cpu'):
+        extra_files = {'metadata.json': ''}
+        self.device = torch.device(device)
+        self.module = torch.jit.load(path, map_location=self.device, _extra_files=extra_files)
+        self.module.eval()
+        self.metadata = json.loads(extra_files['metadata.json']) if extra_files['metadata.json'] else {}
+
+    def __call__(self, input):
+        '''
+        :param input: network input (B x C x ...), traced networks only accept the input shape of the export
+        :return: probabilities (B x n_classes x ...), segmentation (B x 1 x ...) with the class index of every voxel
+        '''
+        with torch.no_grad():
+            return self.module(input.to(self.device, torch.float32))
+
+    def predict(self, input):
+        return self.__call__(input)[1]
+
+
+def load_scripted_model(path, device='cpu'):
+    return ScriptedSegmentation(path, device=device)
@@ -12,8 +12,12 @@ from .unet_pCT_multi_att_dsv_with_2fconv_3D import *
 
 def get_network(name, n_classes, in_channels=3, input_nz=5, feature_scale=4, tensor_dim='3D',
                 nonlocal_mode='embedded_gaussian', attention_dsample=(2,2,2),
-                aggregation_mode='concat', prior_information_channels=None, conv_bloc_type=None, bayesian_skip_type='conv'):
+                aggregation_mode='concat', prior_information_channels=None, conv_bloc_type=None, bayesian_skip_type='conv',
+                checkpointing=False):
     model = _get_model_instance(name, tensor_dim)
+    if checkpointing and name not in ['unet_pct_multi_att_dsv', 'unet_pct_bayesian_multi_att_dsv',
+                                      'unet_pct_cascading_bayesian_multi_att_dsv']:
+        raise NotImplementedError(f'Activation checkpointing is not implemented for {name}')
 
     if name in ['unet']:
         model = model(n_classes=n_classes,
@@ -28,7 +32,16 @@ def get_network(name, n_classes, in_channels=3, input_nz=5, feature_scale=4, ten
                       is_deconv=False,
                       nonlocal_mode=nonlocal_mode,
                       feature_scale=feature_scale)
-    elif name in ['unet_grid_gating', 'unet_pct_multi_att_dsv', 'unet_pct_multi_att_dsv_with_2fconv']:
+    elif name in ['unet_pct_multi_att_dsv']:
+        model = model(n_classes=n_classes,
+                      is_batchnorm=True,
+                      in_channels=in_channels,
+                      nonlocal_mode=nonlocal_mode,
+                      feature_scale=feature_scale,
+                      attention_dsample=attention_dsample,
+                      checkpointing=checkpointing,
+                      is_deconv=False)
+    elif name in ['unet_grid_gating', 'unet_pct_multi_att_dsv_with_2fconv']:
         model = model(n_classes=n_classes,
                       is_batchnorm=True,
                       in_channels=in_channels,
@@ -49,6 +62,7 @@ def get_network(name, n_classes, in_channels=3, input_nz=5, feature_scale=4, ten
                       attention_dsample=attention_dsample,
                       conv_bloc_type=conv_bloc_type,
                       bayesian_skip_type=bayesian_skip_type,
+                      checkpointing=checkpointing,
                       is_deconv=False)
     elif name in ['unet_pct_multi_att_dsv_25D_convZ', 'unet_pct_multi_att_dsv_25D_poolZ']:
         model = model(n_classes=n_classes,
@@ -65,7 +79,18 @@ def get_network(name, n_classes, in_channels=3, input_nz=5, feature_scale=4, ten
     return model
 
 
+def get_available_networks():
+    '''
+    :return: list of (name, tensor_dim) of every network get_network can build
+    '''
+    return [(name, tensor_dim) for name, instances in _get_model_instances().items() for tensor_dim in instances]
+
+
 def _get_model_instance(name, tensor_dim):
+    return _get_model_instances()[name][tensor_dim]
+
+
+def _get_model_instances():
     return {
         'unet':{'2D': unet_2D, '3D': unet_3D},
         'unet_nonlocal':{'2D': unet_nonlocal_2D, '3D': unet_nonlocal_3D},
@@ -76,4 +101,4 @@ def _get_model_instance(name, tensor_dim):
         'unet_pct_bayesian_multi_att_dsv': {'3D': unet_pCT_bayesian_multi_att_dsv_3D},
         'unet_pct_cascading_bayesian_multi_att_dsv': {'3D': unet_pCT_cascading_bayesian_multi_att_dsv_3D},
         'unet_pct_multi_att_dsv_with_2fconv': {'3D': unet_pCT_multi_att_dsv_with_2fconv_3D}
-    }[name][tensor_dim]
+    }
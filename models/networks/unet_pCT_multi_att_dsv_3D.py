@@ -1,6 +1,6 @@
 import torch.nn as nn
 import torch
-from .utils import UnetConv3, UnetUp3_CT, UnetGridGatingSignal3, UnetDsv3
+from .utils import UnetConv3, UnetUp3_CT, UnetGridGatingSignal3, UnetDsv3, checkpoint_block, get_checkpoint_levels
 import torch.nn.functional as F
 from models.networks_other import init_weights
 from models.layers.grid_attention_layer import GridAttentionBlock3D
@@ -9,12 +9,14 @@ from models.layers.grid_attention_layer import GridAttentionBlock3D
 class unet_pCT_multi_att_dsv_3D(nn.Module):
 
     def __init__(self, feature_scale=4, n_classes=2, is_deconv=True, in_channels=4,
-                 nonlocal_mode='concatenation', attention_dsample=(2,2,2), is_batchnorm=True):
+                 nonlocal_mode='concatenation', attention_dsample=(2,2,2), is_batchnorm=True, checkpointing=False):
         super(unet_pCT_multi_att_dsv_3D, self).__init__()
         self.is_deconv = is_deconv
         self.in_channels = in_channels
         self.is_batchnorm = is_batchnorm
         self.feature_scale = feature_scale
+        # levels whose encoder, attention and decoder blocks recompute their activations during backward
+        self.checkpoint_levels = get_checkpoint_levels(checkpointing)
 
         filters = [64, 128, 256, 512, 1024]
         filters = [int(x / self.feature_scale) for x in filters]
@@ -67,31 +69,31 @@ class unet_pCT_multi_att_dsv_3D(nn.Module):
 
     def forward(self, inputs):
         # Feature Extraction
-        conv1 = self.conv1(inputs)
+        conv1 = checkpoint_block(self.conv1, inputs, enabled=1 in self.checkpoint_levels)
         maxpool1 = self.maxpool1(conv1)
 
-        conv2 = self.conv2(maxpool1)
+        conv2 = checkpoint_block(self.conv2, maxpool1, enabled=2 in self.checkpoint_levels)
         maxpool2 = self.maxpool2(conv2)
 
-        conv3 = self.conv3(maxpool2)
+        conv3 = checkpoint_block(self.conv3, maxpool2, enabled=3 in self.checkpoint_levels)
         maxpool3 = self.maxpool3(conv3)
 
-        conv4 = self.conv4(maxpool3)
+        conv4 = checkpoint_block(self.conv4, maxpool3, enabled=4 in self.checkpoint_levels)
         maxpool4 = self.maxpool4(conv4)
 
         # Gating Signal Generation
-        center = self.center(maxpool4)
+        center = checkpoint_block(self.center, maxpool4, enabled=5 in self.checkpoint_levels)
         gating = self.gating(center)
 
         # Attention Mechanism
         # Upscaling Part (Decoder)
-        g_conv4, att4 = self.attentionblock4(conv4, gating)
-        up4 = self.up_concat4(g_conv4, center)
-        g_conv3, att3 = self.attentionblock3(conv3, up4)
-        up3 = self.up_concat3(g_conv3, up4)
-        g_conv2, att2 = self.attentionblock2(conv2, up3)
-        up2 = self.up_concat2(g_conv2, up3)
-        up1 = self.up_concat1(conv1, up2)
+        g_conv4, att4 = checkpoint_block(self.attentionblock4, conv4, gating, enabled=4 in self.checkpoint_levels)
+        up4 = checkpoint_block(self.up_concat4, g_conv4, center, enabled=4 in self.checkpoint_levels)
+        g_conv3, att3 = checkpoint_block(self.attentionblock3, conv3, up4, enabled=3 in self.checkpoint_levels)
+        up3 = checkpoint_block(self.up_concat3, g_conv3, up4, enabled=3 in self.checkpoint_levels)
+        g_conv2, att2 = checkpoint_block(self.attentionblock2, conv2, up3, enabled=2 in self.checkpoint_levels)
+        up2 = checkpoint_block(self.up_concat2, g_conv2, up3, enabled=2 in self.checkpoint_levels)
+        up1 = checkpoint_block(self.up_concat1, conv1, up2, enabled=1 in self.checkpoint_levels)
 
         # Deep Supervision
         dsv4 = self.dsv4(up4)
@@ -1,6 +1,9 @@
+import inspect
+import contextlib
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 from models.networks_other import init_weights
 from .torch_patch import Upsample, UpsamplingBilinear2d
 
@@ -523,3 +526,72 @@ class UnetDsv3(nn.Module):
 
     def forward(self, input):
         return self.dsv(input)
+
+
+def get_checkpoint_levels(checkpointing, n_levels=5):
+    '''
+    :param checkpointing: True for all levels, a list of levels (1 is the full resolution level, n_levels the center)
+     or False/None to store every activation
+    :return: set of the levels whose blocks are checkpointed
+    '''
+    if checkpointing is None or checkpointing is False:
+        return set()
+    if checkpointing is True:
+        return set(range(1, n_levels + 1))
+    levels = set(int(level) for level in checkpointing)
+    if not levels.issubset(range(1, n_levels + 1)):
+        raise Exception(f'Checkpointing levels {sorted(levels)} must lie between 1 and {n_levels}')
+    return levels
+
+
+# non-reentrant checkpointing (PyTorch >= 1.11) also propagates gradients to the parameters of blocks whose inputs
+# do not require gradients
+_NON_REENTRANT_CHECKPOINT = 'use_reentrant' in inspect.signature(checkpoint).parameters
+
+
+@contextlib.contextmanager
+def frozen_batchnorm_statistics(block):
+    '''
+    Restore the running statistics (and num_batches_tracked) of the batch normalisations of a block on exit, so that
+    running the block again does not update them a second time
+    '''
+    buffers = [(module, {name: buffer.clone() for name, buffer in module.named_buffers(recurse=False)
+                         if buffer is not None})
+               for module in block.modules() if isinstance(module, nn.modules.batchnorm._BatchNorm)]
+    try:
+        yield
+    finally:
+        with torch.no_grad():
+            for module, saved in buffers:
+                for name, buffer in saved.items():
+                    getattr(module, name).copy_(buffer)
+
+
+def checkpoint_block(block, *inputs, enabled=True):
+    '''
+    Run a block without storing its intermediate activations for backward, they are recomputed during the backward
+    pass instead. Only the inputs of the block are kept. The recomputation does not update the running statistics of
+    the batch normalisations, which are updated once per step as without checkpointing.
+    :param block: module to run
+    :param inputs: inputs of the block
+    :param enabled: run the block normally if False
+    '''
+    if not enabled or not torch.is_grad_enabled():
+        return block(*inputs)
+
+    n_calls = []
+
+    def run(*block_inputs):
+        if n_calls:
+            # recomputation during backward
+            with frozen_batchnorm_statistics(block):
+                return block(*block_inputs)
+        n_calls.append(1)
+        return block(*block_inputs)
+
+    if _NON_REENTRANT_CHECKPOINT:
+        return checkpoint(run, *inputs, use_reentrant=False)
+    # the parameters of the block only receive gradients from reentrant checkpoints if an input requires them,
+    # which is not the case for the first block of the network
+    dummy = torch.ones(1, device=inputs[0].device, requires_grad=True)
+    return checkpoint(lambda _, *block_inputs: run(*block_inputs), dummy, *inputs)
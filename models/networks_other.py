@@ -198,13 +198,18 @@ def get_n_parameters(net):
     return num_params
 
 
+def synchronize(x):
+    if x.is_cuda:
+        torch.cuda.synchronize()
+
+
 def measure_fp_bp_time(model, x, y):
     # synchronize gpu time and measure fp
-    torch.cuda.synchronize()
-    t0 = time.time()
+    synchronize(x)
+    t0 = time.perf_counter()
     y_pred = model(x)
-    torch.cuda.synchronize()
-    elapsed_fp = time.time() - t0
+    synchronize(x)
+    elapsed_fp = time.perf_counter() - t0
 
     if isinstance(y_pred, tuple):
         y_pred = sum(y_p.sum() for y_p in y_pred)
@@ -213,34 +218,43 @@ def measure_fp_bp_time(model, x, y):
 
     # zero gradients, synchronize time and measure
     model.zero_grad()
-    t0 = time.time()
+    t0 = time.perf_counter()
     #y_pred.backward(y)
     y_pred.backward()
-    torch.cuda.synchronize()
-    elapsed_bp = time.time() - t0
+    synchronize(x)
+    elapsed_bp = time.perf_counter() - t0
     return elapsed_fp, elapsed_bp
 
 
-def benchmark_fp_bp_time(model, x, y, n_trial=1000):
-    # transfer the model on GPU
-    model.cuda()
+def get_fp_bp_times(model, x, y, n_trial=1000, n_dry_runs=10, verbose=True):
+    '''
+    :return: arrays of the forward and backward times (s) of every trial, on the device of x
+    '''
+    # transfer the model on the device of the input
+    model.to(x.device)
 
     # DRY RUNS
-    for i in range(10):
+    for i in range(n_dry_runs):
         _, _ = measure_fp_bp_time(model, x, y)
 
-    print('DONE WITH DRY RUNS, NOW BENCHMARKING')
-    
+    if verbose:
+        print('DONE WITH DRY RUNS, NOW BENCHMARKING')
+        print('trial: {}'.format(n_trial))
+
     # START BENCHMARKING
     t_forward = []
     t_backward = []
-    
-    print('trial: {}'.format(n_trial))
     for i in range(n_trial):
         t_fp, t_bp = measure_fp_bp_time(model, x, y)
         t_forward.append(t_fp)
         t_backward.append(t_bp)
 
+    return np.array(t_forward), np.array(t_backward)
+
+
+def benchmark_fp_bp_time(model, x, y, n_trial=1000):
+    t_forward, t_backward = get_fp_bp_times(model, x, y, n_trial=n_trial)
+
     # free memory
     del model
 
@@ -0,0 +1,136 @@
+'''
+Int8 quantization of the segmentation networks for CPU inference: dynamic quantization of the layers which support
+it, and post-training static quantization of the convolutions with calibration on real inputs
+'''
+
+import io
+import torch
+import torch.nn as nn
+import torch.nn.intrinsic as nni
+import torch.quantization as quantization
+
+from .fusion import optimize_for_inference, CONV_TYPES
+from .networks.utils import unetConv2, UnetConv3, FCNConv3, UnetGridGatingSignal3
+
+BACKENDS = ['fbgemm', 'qnnpack']
+# layers with dynamically quantized kernels (weights in int8, activations quantized on the fly)
+DYNAMIC_TYPES = (nn.Linear, nn.LSTM, nn.GRU)
+CONV_RELU_TYPES = {nn.Conv1d: nni.ConvReLU1d, nn.Conv2d: nni.ConvReLU2d, nn.Conv3d: nni.ConvReLU3d}
+# conv blocks whose forward only chains their submodules, they run in int8 from their input to their output
+CONV_BLOCK_TYPES = (unetConv2, UnetConv3, FCNConv3, UnetGridGatingSignal3, nn.Sequential)
+# layers with int8 kernels inside a quantized block (folded batch normalisations are identities)
+INT8_TYPES = CONV_TYPES + tuple(CONV_RELU_TYPES.values()) + (nn.ReLU, nn.Identity)
+
+
+def set_backend(backend):
+    if backend not in BACKENDS:
+        raise NotImplementedError(f'{backend} is not implemented, use one of {BACKENDS}')
+    torch.backends.quantized.engine = backend
+
+
+def get_model_size(net):
+    '''
+    :return: size of the serialised state dict (MB)
+    '''
+    buffer = io.BytesIO()
+    torch.save(net.state_dict(), buffer)
+    return buffer.getbuffer().nbytes / 1024 ** 2
+
+
+def quantize_dynamic(net, backend='fbgemm'):
+    '''
+    :return: dynamically quantized copy of net (None if net has no layer with a dynamic kernel), number of quantized
+     layers
+    '''
+    set_backend(backend)
+    n_layers = sum(isinstance(module, DYNAMIC_TYPES) for module in net.modules())
+    if n_layers == 0:
+        return None, 0
+    net.eval()
+    return quantization.quantize_dynamic(net, set(DYNAMIC_TYPES), dtype=torch.qint8, inplace=False), n_layers
+
+
+def fuse_conv_relu(net):
+    '''
+    Fuse every convolution which is followed by a ReLU in an nn.Sequential (batch normalisations folded before)
+    :return: number of fused pairs
+    '''
+    n_fused = 0
+    for module in list(net.modules()):
+        if not isinstance(module, nn.Sequential) or isinstance(module, tuple(CONV_RELU_TYPES.values())):
+            continue
+        names = [name for name, child in module._modules.items() if not isinstance(child, nn.Identity)]
+        for name, next_name in zip(names[:-1], names[1:]):
+            conv, relu = module._modules[name], module._modules[next_name]
+            if type(conv) in CONV_RELU_TYPES and isinstance(relu, nn.ReLU):
+                module._modules[name] = CONV_RELU_TYPES[type(conv)](conv, nn.ReLU())
+                module._modules[next_name] = nn.Identity()
+                n_fused += 1
+    return n_fused
+
+
+def is_int8_block(module):
+    '''
+    :return: True for a convolution, or a conv block made only of (fused) convolutions, ReLUs and identities
+    '''
+    if isinstance(module, CONV_TYPES + tuple(CONV_RELU_TYPES.values())):
+        return True
+    if not isinstance(module, CONV_BLOCK_TYPES):
+        return False
+    layers = [layer for layer in module.modules() if isinstance(layer, INT8_TYPES) or not list(layer.children())]
+    return all(isinstance(layer, INT8_TYPES) for layer in layers) and any(isinstance(layer, CONV_TYPES) for layer in layers)
+
+
+def wrap_blocks(net, qconfig):
+    '''
+    Put every conv block (eg. UnetConv3, after folding and fusion) and every other convolution between a quantize and
+    a dequantize stub. Activations stay in int8 inside a block, the other operations of the networks (attention
+    gates, interpolations, concatenations, additions) stay in float.
+    :return: number of quantized convolutions
+    '''
+    n_convolutions = 0
+    for name, child in net._modules.items():
+        if child is None or isinstance(child, quantization.QuantWrapper):
+            continue
+        if is_int8_block(child):
+            wrapper = quantization.QuantWrapper(child)
+            wrapper.qconfig = qconfig
+            net._modules[name] = wrapper
+            n_convolutions += sum(isinstance(module, CONV_TYPES) for module in child.modules())
+        else:
+            n_convolutions += wrap_blocks(child, qconfig)
+    return n_convolutions
+
+
+def prepare_static(net, backend='fbgemm'):
+    '''
+    Fold the batch normalisations, fuse conv + relu, and insert the observers of post-training static quantization
+    :return: prepared copy of net (to calibrate), number of quantized convolutions
+    '''
+    set_backend(backend)
+    prepared, _ = optimize_for_inference(net)
+    fuse_conv_relu(prepared)
+    n_convolutions = wrap_blocks(prepared, quantization.get_default_qconfig(backend))
+    quantization.prepare(prepared, inplace=True)
+    return prepared, n_convolutions
+
+
+def calibrate(prepared, inputs):
+    '''
+    :param inputs: iterable of network inputs, the observers record their activation ranges
+    '''
+    prepared.eval()
+    with torch.no_grad():
+        for x in inputs:
+            prepared(x)
+
+
+def quantize_static(net, calibration_inputs, backend='fbgemm'):
+    '''
+    Post-training static quantization of the convolutions of net (int8 weights, per channel, and activations)
+    :param calibration_inputs: iterable of network inputs, eg. a few validation subjects
+    :return: quantized copy of net, number of quantized convolutions
+    '''
+    prepared, n_convolutions = prepare_static(net, backend=backend)
+    calibrate(prepared, calibration_inputs)
+    return quantization.convert(prepared, inplace=False), n_convolutions
@@ -8,6 +8,7 @@ import torch.optim as optim
 from torch.nn import CrossEntropyLoss
 from utils.metrics import segmentation_scores, dice_score_list, single_class_dice_score, roc_auc, subject_wise_single_class_dice_score
 from sklearn import metrics
+from utils.distributed import all_reduce_sum
 from .layers.loss import *
 
 def get_optimizer(option, params):
@@ -143,6 +144,8 @@ class EarlyStopper():
         self.patience = json_opts.patience if hasattr(json_opts, 'patience') else 10
         self.min_epochs = json_opts.min_epochs if hasattr(json_opts, 'min_epochs') else 100
         self.monitor = json_opts.monitor if hasattr(json_opts, 'monitor') else 'Seg_Loss'
+        # minimum number of optimizer steps, with gradient accumulation an epoch makes fewer steps
+        self.min_steps = json_opts.min_steps if hasattr(json_opts, 'min_steps') else 0
         self.verbose = verbose
 
         self.index = 0
@@ -165,12 +168,27 @@ class EarlyStopper():
         self.current_loss_total += losses[self.monitor]
         self.current_loss_count += 1
 
+    def synchronise(self):
+        '''
+        Sum the monitored validation losses of all processes of a distributed run, so that every process takes
+        the same early stopping and learning rate decisions. Has to be called by all processes.
+        '''
+        self.current_loss_total, self.current_loss_count = all_reduce_sum([self.current_loss_total,
+                                                                           self.current_loss_count])
+
     def get_current_validation_loss(self):
         if self.current_loss_total is None:
             return None
         return self.current_loss_total / self.current_loss_count
 
-    def interrogate(self, epoch):
+    def interrogate(self, epoch, n_steps=None, step_epochs=None):
+        '''
+        :param epoch: epoch of the evaluated weights, it may lag behind the training epoch when the validation runs
+         asynchronously
+        :param n_steps: total number of optimizer steps made so far, required to use min_steps
+        :param step_epochs: optimizer steps made so far in epochs without gradient accumulation (see
+         BaseModel.get_step_epochs), min_epochs is compared with it instead of epoch if given
+        '''
         current_loss = self.get_current_validation_loss()
 
         if self.best_loss is None:
@@ -192,7 +210,9 @@ class EarlyStopper():
                 print('current loss {} did not improve from {} at epoch {}'.format(current_loss, self.best_loss, self.best_epoch),
                       '-- idx_early_stopping = {} / {}'.format(self.index, self.patience))
 
-        if self.index >= self.patience and epoch >= self.min_epochs:  # start early stopping after epoch 100
+        enough_steps = n_steps is None or n_steps >= self.min_steps
+        enough_epochs = (epoch if step_epochs is None else step_epochs) >= self.min_epochs
+        if self.index >= self.patience and enough_epochs and enough_steps:  # start early stopping after epoch 100
             print('-- early stopping')
             self.should_stop_early = True
 
@@ -200,6 +220,14 @@ class EarlyStopper():
 
         return self.should_stop_early
 
+    def state_dict(self):
+        return {'index': self.index, 'should_stop_early': self.should_stop_early, 'is_improving': self.is_improving,
+                'best_loss': self.best_loss, 'best_epoch': self.best_epoch}
+
+    def load_state_dict(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+
     def reset(self):
         self.current_loss_total = 0
         self.current_loss_count = 0
@@ -0,0 +1,137 @@
+import os
+import json
+import itertools
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from dataio.loaders import get_dataset, get_dataset_path
+from dataio.transformation import get_dataset_transformation
+from models import get_model, get_inference_opts
+from models.export import SegmentationInference, export_network, time_module
+from models.quantization import quantize_dynamic, quantize_static, get_model_size
+from utils.metrics import single_class_dice_score
+from utils.utils import json_file_to_pyobj
+
+
+def get_inputs(json_opts, split, n_subjects, num_workers=4):
+    '''
+    :return: list of (input, target) of the first n_subjects of a split, with the evaluation transforms. The slabs of
+     a 2.5D subject form the batch of its input, so that the dice of a subject is computed over all its slabs
+    '''
+    train_opts = json_opts.training
+    split_opts = json_opts.data_split
+    dataset_transform = get_dataset_transformation(train_opts.arch_type, opts=json_opts.augmentation)
+    dataset_kwargs = {'input_nz': json_opts.model.input_nz} if train_opts.arch_type == 'gsd_pCT_25D' else {}
+    dataset = get_dataset(train_opts.arch_type)(get_dataset_path(train_opts.arch_type, json_opts.data_path),
+                                                split=split, transform=dataset_transform['valid'],
+                                                preload_data=train_opts.preloadData,
+                                                train_size=split_opts.train_size, test_size=split_opts.test_size,
+                                                valid_size=split_opts.validation_size, split_seed=split_opts.seed,
+                                                channels=json_opts.data_opts.channels, **dataset_kwargs)
+    loader = DataLoader(dataset=dataset, num_workers=num_workers, batch_size=1, shuffle=False)
+    subjects = []
+    for input, target, _ in itertools.islice(loader, n_subjects):
+        if train_opts.arch_type == 'gsd_pCT_25D':
+            # resolve the slabs of the subject, as the 2.5D training script does
+            input = input.view(-1, *input.size()[2:])
+            target = target.view(-1, *target.size()[2:])
+        subjects.append((input, target))
+    return subjects
+
+
+def get_dice_scores(net, subjects):
+    '''
+    :return: lesion dice of every subject (over all slabs of 2.5D subjects), with the post-processing of the evaluation
+    '''
+    module = SegmentationInference(net).eval()
+    scores = []
+    with torch.no_grad():
+        for input, target in subjects:
+            _, segmentation = module(input)
+            scores.append(single_class_dice_score(np.squeeze(target.numpy()).astype(np.int16),
+                                                  np.squeeze(segmentation.numpy()).astype(np.int16)))
+    return np.array(scores)
+
+
+def quantize(arguments):
+    json_opts = json_file_to_pyobj(arguments.config)
+    model_opts = get_inference_opts(json_opts.model, arguments.model_path)
+    net = get_model(model_opts).net.eval()
+    torch.set_num_threads(arguments.threads)
+
+    calibration_inputs = [input for input, _ in get_inputs(json_opts, 'validation', arguments.calibration_subjects)]
+    subjects = get_inputs(json_opts, arguments.split, arguments.subjects)
+    example_input = subjects[0][0]
+    float_dice = get_dice_scores(net, subjects)
+    report = {'float': {'dice_mean': float(float_dice.mean()), 'size_mb': get_model_size(net),
+                        'latency_ms': time_module(net, example_input, arguments.trials)}}
+
+    for mode in arguments.modes:
+        if mode == 'dynamic':
+            quantized, n_layers = quantize_dynamic(net, backend=arguments.backend)
+        else:
+            quantized, n_layers = quantize_static(net, calibration_inputs, backend=arguments.backend)
+        if quantized is None:
+            print('{0}: {1} has no layers with dynamically quantized kernels (Linear, LSTM, GRU), skipped'.format(
+                mode, model_opts.model_type))
+            report[mode] = {'quantized_layers': 0}
+            continue
+        dice = get_dice_scores(quantized, subjects)
+        report[mode] = {'quantized_layers': n_layers, 'dice_mean': float(dice.mean()),
+                        'dice_delta_mean': float((dice - float_dice).mean()),
+                        'dice_delta_max': float(np.abs(dice - float_dice).max()),
+                        'size_mb': get_model_size(quantized),
+                        'latency_ms': time_module(quantized, example_input, arguments.trials),
+                        'dice_per_subject': [[float(f), float(q)] for f, q in zip(float_dice, dice)]}
+
+        if arguments.output_dir is not None:
+            if not os.path.exists(arguments.output_dir):
+                os.makedirs(arguments.output_dir)
+            path = os.path.join(arguments.output_dir, '{0}_{1}_int8.pt'.format(model_opts.model_type, mode))
+            # quantization folded the batch normalisations already
+            export_network(quantized, example_input, path, metadata={'model_type': model_opts.model_type,
+                                                                     'quantization': mode},
+                           fold_batchnorm=False)
+            report[mode]['exported_file'] = path
+            report[mode]['exported_size_mb'] = os.path.getsize(path) / 1024 ** 2
+
+    float_report = report['float']
+    print('float: dice {0:.3f}, {1:.1f} MB, {2:.1f} ms'.format(float_report['dice_mean'], float_report['size_mb'],
+                                                              float_report['latency_ms']))
+    for mode in arguments.modes:
+        result = report[mode]
+        if result['quantized_layers'] == 0:
+            continue
+        print('{0}: {1} layers, dice {2:.3f} (delta {3:+.4f}, max {4:.4f}), {5:.1f} MB ({6:.1f}x smaller), '
+              '{7:.1f} ms ({8:.2f}x faster)'.format(
+            mode, result['quantized_layers'], result['dice_mean'], result['dice_delta_mean'], result['dice_delta_max'],
+            result['size_mb'], float_report['size_mb'] / result['size_mb'], result['latency_ms'],
+            float_report['latency_ms'] / result['latency_ms']))
+
+    if arguments.report is not None:
+        with open(arguments.report, 'w') as report_file:
+            json.dump({'config': arguments.config, 'model_path': arguments.model_path, 'split': arguments.split,
+                       'backend': arguments.backend, 'calibration_subjects': len(calibration_inputs),
+                       'subjects': len(subjects), **report}, report_file, indent=2)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Int8 quantization of a trained network for CPU inference, with a dice report against the float network')
+
+    parser.add_argument('-c', '--config',               help='training config file', required=True)
+    parser.add_argument('-m', '--model_path',           help='saved network weights (.pth)', required=True)
+    parser.add_argument('--modes',                      help='quantization modes', nargs='+', choices=['dynamic', 'static'], default=['dynamic', 'static'])
+    parser.add_argument('--backend',                    help='quantized kernels (fbgemm for x86, qnnpack for ARM)', choices=['fbgemm', 'qnnpack'], default='fbgemm')
+    parser.add_argument('--calibration_subjects',       help='validation subjects to calibrate static quantization on', type=int, default=8)
+    parser.add_argument('--split',                      help='split to compare the dice scores on', choices=['validation', 'test'], default='test')
+    parser.add_argument('-n', '--subjects',             help='subjects to compare the dice scores on', type=int, default=20)
+    parser.add_argument('-t', '--threads',              help='CPU threads', type=int, default=torch.get_num_threads())
+    parser.add_argument('--trials',                     help='timed inferences per network', type=int, default=5)
+    parser.add_argument('-o', '--output_dir',           help='directory to export the quantized networks to (TorchScript)', default=None)
+    parser.add_argument('--report',                     help='json file to write the report to', default=None)
+    args = parser.parse_args()
+
+    quantize(args)
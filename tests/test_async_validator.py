@@ -0,0 +1,49 @@
+import pytest
+import torch
+
+from utils.async_validator import AsyncValidator
+
+
+def run_stub_worker(config_filename, seed, monitor, best_loss, n_threads, tasks, results):
+    # the validation loss of a snapshot is the sum of its weights, negative weights make the worker fail
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        epoch, state_dict, run_test, test_at_best_only = task
+        loss = float(state_dict['weight'].sum())
+        if loss < 0:
+            raise RuntimeError('negative weights')
+        results.put({'epoch': epoch, 'validation': [{monitor: loss}], 'test': [{monitor: loss}] if run_test else None})
+
+
+def test_results_are_ordered_by_epoch():
+    validator = AsyncValidator('config.json', 42, 'Seg_Loss', max_pending=4, run_worker=run_stub_worker)
+    network = torch.nn.Linear(2, 1, bias=False)
+    try:
+        for epoch in range(3):
+            with torch.no_grad():
+                network.weight.fill_(epoch)
+            validator.submit(epoch, network, run_test=epoch == 2)
+        results = validator.get_results(wait=True)
+    finally:
+        validator.close()
+
+    assert [result['epoch'] for result in results] == [0, 1, 2]
+    assert [result['validation'][0]['Seg_Loss'] for result in results] == [0.0, 2.0, 4.0]
+    assert [result['test'] is not None for result in results] == [False, False, True]
+    # the snapshot of the evaluated weights comes with its result
+    assert torch.equal(results[1]['state_dict']['weight'], torch.ones(1, 2))
+
+
+def test_worker_errors_are_raised():
+    validator = AsyncValidator('config.json', 42, 'Seg_Loss', run_worker=run_stub_worker)
+    network = torch.nn.Linear(2, 1, bias=False)
+    try:
+        with torch.no_grad():
+            network.weight.fill_(-1)
+        validator.submit(0, network)
+        with pytest.raises(Exception, match='(?s)process failed.*negative weights'):
+            validator.get_results(wait=True)
+    finally:
+        validator.close()
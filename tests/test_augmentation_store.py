@@ -0,0 +1,143 @@
+import os
+import json
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import torch
+
+from dataio.loaders.augmentation_store import AugmentationReplayDataset, write_augmentation_store
+from dataio.loaders.cached_dataset import CachedDataset, get_transform_signature
+from dataio.loaders.utils import get_sample_seed
+
+
+class StoreTransform(object):
+    def __init__(self, sigma):
+        self.sigma = sigma
+
+    def __repr__(self):
+        return 'StoreTransform(sigma={})'.format(self.sigma)
+
+
+def get_dataset(ids=('subject_1', 'subject_2'), split_indices=(0, 1)):
+    return SimpleNamespace(ids=list(ids), dataset_path='dataset.npz', split_indices=list(split_indices),
+                           channels=[0, 1], augmentation_seed=42)
+
+
+def write_store(store_dir, dataset, transform, n_epochs=2):
+    inputs = np.arange(n_epochs * len(dataset.ids) * 8, dtype=np.float32).reshape(n_epochs, len(dataset.ids), 2, 2, 2)
+    np.save(os.path.join(store_dir, 'inputs.npy'), inputs)
+    np.save(os.path.join(store_dir, 'targets.npy'), (inputs > 10).astype(np.int64))
+    transform_signature = get_transform_signature(transform)
+    meta = {'n_epochs': n_epochs, 'seed': 42, 'ids': [str(id) for id in dataset.ids],
+            'cache_key': CachedDataset.get_cache_key(dataset, transform_signature), 'transform': transform_signature}
+    with open(os.path.join(store_dir, 'meta.json'), 'w') as outfile:
+        json.dump(meta, outfile)
+    return inputs
+
+
+def test_replays_stored_epochs(tmp_path):
+    dataset = get_dataset()
+    inputs = write_store(str(tmp_path), dataset, StoreTransform(2))
+    replay = AugmentationReplayDataset(str(tmp_path), dataset, store_transform=StoreTransform(2))
+    assert len(replay) == 2
+    replay.set_epoch(3)
+    input, target, index = replay[1]
+    assert index == 1
+    np.testing.assert_array_equal(input.numpy(), inputs[1, 1])
+
+
+def test_rejects_other_ids(tmp_path):
+    write_store(str(tmp_path), get_dataset(), StoreTransform(2))
+    with pytest.raises(Exception, match='another dataset split'):
+        AugmentationReplayDataset(str(tmp_path), get_dataset(ids=('subject_1', 'subject_3')))
+
+
+def test_rejects_other_augmentation_config(tmp_path):
+    dataset = get_dataset()
+    write_store(str(tmp_path), dataset, StoreTransform(2))
+    with pytest.raises(Exception, match='another augmentation config'):
+        AugmentationReplayDataset(str(tmp_path), dataset, store_transform=StoreTransform(3))
+
+
+def test_rejects_other_split_indices(tmp_path):
+    write_store(str(tmp_path), get_dataset(), StoreTransform(2))
+    with pytest.raises(Exception, match='another dataset file, split or channels'):
+        AugmentationReplayDataset(str(tmp_path), get_dataset(split_indices=(4, 5)), store_transform=StoreTransform(2))
+
+
+class NoiseTransform(object):
+    """
+    Seeded augmentation, adds noise to the input
+    """
+
+    def __init__(self, seed):
+        self.random_state = np.random.RandomState(seed)
+
+    def __call__(self, input, target):
+        noise = torch.from_numpy(self.random_state.normal(size=tuple(input.shape)).astype(np.float32))
+        return input + noise, target
+
+
+class FailingTransform(object):
+    def __init__(self, seed):
+        pass
+
+    def __call__(self, input, target):
+        raise RuntimeError('interrupted')
+
+
+class TinyDataset(object):
+    def __init__(self, transform=None, augmentation_seed=42, n_subjects=3):
+        self.ids = ['subject_{}'.format(index) for index in range(n_subjects)]
+        self.dataset_path = 'tiny.npz'
+        self.split_indices = list(range(n_subjects))
+        self.channels = [0]
+        self.transform = transform
+        self.augmentation_seed = augmentation_seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def load_sample(self, index):
+        input = torch.full((4, 4, 2, 1), float(index))
+        target = (input > 1).long()
+        return input, target
+
+    def __getitem__(self, index):
+        input, target = self.load_sample(index)
+        if self.transform:
+            transformer = self.transform(seed=get_sample_seed(self.augmentation_seed, self.epoch, index))
+            input, target = transformer(input, target)
+        return input, target, index
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def test_replayed_epochs_equal_online_epochs(tmp_path):
+    write_augmentation_store(str(tmp_path), TinyDataset(), NoiseTransform, n_epochs=2, seed=42, num_workers=0)
+    assert np.load(os.path.join(str(tmp_path), 'seeds.npy')).shape == (2, 3)
+
+    online = TinyDataset(transform=NoiseTransform, augmentation_seed=42)
+    replay = AugmentationReplayDataset(str(tmp_path), TinyDataset(augmentation_seed=42), store_transform=NoiseTransform)
+    for epoch in range(2):
+        online.set_epoch(epoch)
+        replay.set_epoch(epoch)
+        for index in range(len(online)):
+            online_input, online_target, _ = online[index]
+            replayed_input, replayed_target, _ = replay[index]
+            assert torch.equal(replayed_input, online_input)
+            assert torch.equal(replayed_target, online_target)
+    # stored epochs repeat after the last one
+    replay.set_epoch(2)
+    online.set_epoch(0)
+    assert torch.equal(replay[0][0], online[0][0])
+
+
+def test_interrupted_regeneration_is_rejected(tmp_path):
+    write_augmentation_store(str(tmp_path), TinyDataset(), NoiseTransform, n_epochs=1, num_workers=0)
+    with pytest.raises(RuntimeError):
+        write_augmentation_store(str(tmp_path), TinyDataset(), FailingTransform, n_epochs=1, num_workers=0)
+    with pytest.raises(Exception, match='incomplete'):
+        AugmentationReplayDataset(str(tmp_path), TinyDataset(), store_transform=NoiseTransform)
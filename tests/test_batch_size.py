@@ -0,0 +1,41 @@
+import pytest
+
+from benchmarks.batch_size import search_largest, get_n_slabs
+
+
+class Fits(object):
+    def __init__(self, largest):
+        self.largest = largest
+        self.calls = []
+
+    def __call__(self, n):
+        self.calls.append(n)
+        return n <= self.largest
+
+
+@pytest.mark.parametrize('largest', [1, 2, 5, 17, 63, 64])
+def test_finds_the_largest_fitting_value(largest):
+    assert search_largest(Fits(largest), 1, 64) == largest
+
+
+def test_none_if_start_does_not_fit():
+    assert search_largest(Fits(0), 1, 64) is None
+
+
+def test_capped_at_maximum():
+    fits = Fits(1000)
+    assert search_largest(fits, 1, 40) == 40
+    assert max(fits.calls) == 40
+
+
+def test_few_trials():
+    fits = Fits(37)
+    search_largest(fits, 1, 64)
+    # doubling up to 64, then bisecting between 32 and 64
+    assert len(fits.calls) <= 2 * 7
+    assert len(set(fits.calls)) == len(fits.calls)
+
+
+def test_n_slabs():
+    assert get_n_slabs('unet_pct_multi_att_dsv_25D_poolZ', [96, 96, 32], 5) == 28
+    assert get_n_slabs('unet_pct_multi_att_dsv', [96, 96, 32], 5) == 1
@@ -0,0 +1,95 @@
+import os
+import random
+import numpy as np
+import pytest
+import torch
+
+from models.base_model import BaseModel
+from utils.checkpoint import save_atomic, load_checkpoint, set_rng_state, AsyncCheckpointWriter
+
+
+def test_save_atomic_keeps_previous_checkpoint_on_failure(tmp_path):
+    path = str(tmp_path / 'checkpoint.pth')
+    save_atomic({'weight': torch.ones(3)}, path)
+    assert os.listdir(str(tmp_path)) == ['checkpoint.pth']
+    # lambdas can not be pickled, the write fails after the temporary file was opened
+    with pytest.raises(Exception):
+        save_atomic({'weight': torch.zeros(3), 'function': lambda: None}, path)
+    assert torch.equal(load_checkpoint(path)['weight'], torch.ones(3))
+
+
+def test_writer_executes_in_submission_order(tmp_path):
+    path, old_path = str(tmp_path / 'checkpoint.pth'), str(tmp_path / 'old.pth')
+    writer = AsyncCheckpointWriter()
+    weight = torch.zeros(3)
+    writer.save({'weight': weight}, old_path)
+    for value in range(1, 4):
+        weight.fill_(value)
+        writer.save({'weight': weight}, path)
+    writer.delete(old_path)
+    # the state is copied when it is submitted
+    weight.fill_(-1)
+    writer.wait()
+    assert torch.equal(load_checkpoint(path)['weight'], torch.full((3,), 3.0))
+    assert not os.path.exists(old_path)
+
+
+def test_writer_raises_write_errors(tmp_path):
+    writer = AsyncCheckpointWriter()
+    writer.save({'weight': torch.ones(3)}, str(tmp_path / 'missing' / 'checkpoint.pth'))
+    with pytest.raises(Exception, match='Writing a checkpoint failed'):
+        writer.wait()
+    # the error is raised once, later checkpoints are written
+    path = str(tmp_path / 'checkpoint.pth')
+    writer.save({'weight': torch.ones(3)}, path)
+    writer.wait()
+    assert os.path.exists(path)
+
+
+def get_model(save_dir):
+    model = BaseModel()
+    model.save_dir = save_dir
+    model.net = torch.nn.Sequential(torch.nn.Linear(4, 8), torch.nn.Dropout(0.5), torch.nn.Linear(8, 1))
+    model.optimizers = [torch.optim.Adam(model.net.parameters(), lr=0.01)]
+    model.schedulers = [torch.optim.lr_scheduler.StepLR(model.optimizers[0], step_size=1, gamma=0.5)]
+    return model
+
+
+def train_epoch(model, n_steps=3):
+    # every random number generator of the training state is used
+    for _ in range(n_steps):
+        x = torch.randn(2, 4) + torch.from_numpy(np.random.randn(2, 4)).float() + random.random()
+        loss = model.net(x).pow(2).mean()
+        model.optimizers[0].zero_grad()
+        loss.backward()
+        model.optimizers[0].step()
+        model.n_optimizer_steps += 1
+    model.schedulers[0].step()
+
+
+def test_resumed_training_equals_uninterrupted_training(tmp_path):
+    n_epochs = 4
+    random.seed(0)
+    np.random.seed(0)
+    torch.manual_seed(0)
+    model = get_model(str(tmp_path))
+    model.net.train()
+    for epoch in range(n_epochs):
+        train_epoch(model)
+        if epoch == n_epochs // 2 - 1:
+            model.save_training_state(epoch)
+    model.wait_for_checkpoints()
+
+    # a different initialisation and random state, both are replaced by the training state
+    torch.manual_seed(1)
+    resumed = get_model(str(tmp_path))
+    resumed.net.train()
+    training_state = load_checkpoint(resumed.get_training_state_path())
+    resumed.load_training_state(training_state)
+    set_rng_state(training_state['rng'])
+    for epoch in range(resumed.which_epoch, n_epochs):
+        train_epoch(resumed)
+
+    assert resumed.n_optimizer_steps == model.n_optimizer_steps
+    for name, value in model.net.state_dict().items():
+        assert torch.equal(resumed.net.state_dict()[name], value), name
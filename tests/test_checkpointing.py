@@ -0,0 +1,43 @@
+import pytest
+import torch
+
+import models.networks.utils as network_utils
+from models.networks import get_network
+
+
+def train_step(checkpointing):
+    torch.manual_seed(0)
+    net = get_network('unet_pct_multi_att_dsv', n_classes=2, in_channels=2, feature_scale=16,
+                      nonlocal_mode='concatenation', checkpointing=checkpointing)
+    net.train()
+    optimizer = torch.optim.SGD(net.parameters(), lr=0.1)
+    torch.manual_seed(1)
+    # the input of the first block does not require gradients
+    x = torch.randn(2, 2, 32, 32, 32)
+    output = net(x)
+    output.pow(2).mean().backward()
+    gradients = {name: parameter.grad.clone() for name, parameter in net.named_parameters()
+                 if parameter.grad is not None}
+    optimizer.step()
+    return net, output.detach(), gradients
+
+
+@pytest.mark.parametrize('non_reentrant', [
+    pytest.param(True, marks=pytest.mark.skipif(not network_utils._NON_REENTRANT_CHECKPOINT,
+                                                reason='non-reentrant checkpointing requires PyTorch >= 1.11')),
+    False])
+def test_checkpointing_matches_training_without(monkeypatch, non_reentrant):
+    # False runs the reentrant checkpoint with a dummy input requiring gradients
+    monkeypatch.setattr(network_utils, '_NON_REENTRANT_CHECKPOINT', non_reentrant)
+    net, output, gradients = train_step(checkpointing=False)
+    checkpointed_net, checkpointed_output, checkpointed_gradients = train_step(checkpointing=True)
+
+    assert torch.allclose(checkpointed_output, output, atol=1e-6)
+    assert gradients.keys() == checkpointed_gradients.keys()
+    assert any(name.startswith('conv1.') for name in gradients)
+    for name, gradient in gradients.items():
+        assert torch.allclose(checkpointed_gradients[name], gradient, atol=1e-6), name
+    for name, parameter in net.state_dict().items():
+        # running_mean, running_var and num_batches_tracked are updated once per step
+        assert torch.allclose(checkpointed_net.state_dict()[name].float(), parameter.float(), atol=1e-6), name
+    assert int(checkpointed_net.conv1.conv1[1].num_batches_tracked) == 1
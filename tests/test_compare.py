@@ -0,0 +1,77 @@
+import json
+import pytest
+
+from benchmarks.compare import compare
+
+
+def write_results(path, results):
+    path.write_text(json.dumps({'benchmark': 'networks', 'environment': {'platform': 'test'}, 'results': results}))
+    return str(path)
+
+
+def get_result(forward_ms, network='unet_3D'):
+    return {'network': network, 'tensor_dim': '3D', 'size': [96, 96, 96], 'batch_size': 1, 'threads': 4,
+            'forward': {'median_ms': forward_ms}, 'backward': {'median_ms': 20.0}, 'peak_rss_mb': 1000.0}
+
+
+def get_statuses(comparisons, metric='forward.median_ms'):
+    return {comparison['network']: comparison['status'] for comparison in comparisons if comparison['metric'] == metric}
+
+
+def test_pass_within_tolerance(tmp_path):
+    baseline = write_results(tmp_path / 'baseline.json', [get_result(10.0)])
+    new = write_results(tmp_path / 'new.json', [get_result(10.5)])
+    comparisons, passed = compare([baseline], [new])
+    assert passed
+    assert get_statuses(comparisons) == {'unet_3D': 'pass'}
+
+
+def test_regression(tmp_path):
+    baseline = write_results(tmp_path / 'baseline.json', [get_result(10.0)])
+    new = write_results(tmp_path / 'new.json', [get_result(12.0)])
+    comparisons, passed = compare([baseline], [new])
+    assert not passed
+    assert get_statuses(comparisons) == {'unet_3D': 'regression'}
+
+
+def test_improvement(tmp_path):
+    baseline = write_results(tmp_path / 'baseline.json', [get_result(10.0)])
+    new = write_results(tmp_path / 'new.json', [get_result(8.0)])
+    comparisons, passed = compare([baseline], [new])
+    assert passed
+    assert get_statuses(comparisons) == {'unet_3D': 'improvement'}
+
+
+def test_failed_and_missing_configurations(tmp_path):
+    baseline = write_results(tmp_path / 'baseline.json', [get_result(10.0), get_result(10.0, network='unet_pct_3D')])
+    new = write_results(tmp_path / 'new.json', [{**get_result(10.0), 'error': 'CUDA out of memory'}])
+    comparisons, passed = compare([baseline], [new])
+    assert not passed
+    assert get_statuses(comparisons) == {'unet_3D': 'failed', 'unet_pct_3D': 'missing'}
+
+
+def test_tolerance_widened_to_baseline_noise(tmp_path):
+    baselines = [write_results(tmp_path / 'baseline_{}.json'.format(run), [get_result(forward_ms)])
+                 for run, forward_ms in enumerate([9.0, 10.0, 11.0])]
+    new = write_results(tmp_path / 'new.json', [get_result(12.0)])
+    comparisons, passed = compare(baselines, [new])
+    # spread of the baseline runs is 20 %, the tolerance 2 x 20 %
+    assert passed
+    assert get_statuses(comparisons) == {'unet_3D': 'pass'}
+
+
+def test_file_without_benchmark_key_is_rejected(tmp_path):
+    baseline = write_results(tmp_path / 'baseline.json', [get_result(10.0)])
+    memory_report = tmp_path / 'memory.json'
+    memory_report.write_text(json.dumps({'network': 'unet_3D', 'peak_mb': 1000.0}))
+    with pytest.raises(Exception, match='not a result file'):
+        compare([baseline], [str(memory_report)])
+
+
+def test_fails_without_any_comparison(tmp_path):
+    result = {key: value for key, value in get_result(10.0).items() if key not in ['forward', 'backward', 'peak_rss_mb']}
+    baseline = write_results(tmp_path / 'baseline.json', [result])
+    new = write_results(tmp_path / 'new.json', [get_result(10.0)])
+    comparisons, passed = compare([baseline], [new])
+    assert comparisons == []
+    assert not passed
@@ -0,0 +1,23 @@
+from types import SimpleNamespace
+
+from models.utils import EarlyStopper
+
+
+def validate(early_stopper, loss, epoch):
+    early_stopper.update({'Seg_Loss': loss})
+    return early_stopper.interrogate(epoch)
+
+
+def test_state_dict_round_trip():
+    early_stopper = EarlyStopper(SimpleNamespace(patience=2, min_epochs=0))
+    for epoch, loss in enumerate([1.0, 0.5, 0.7]):
+        validate(early_stopper, loss, epoch)
+
+    resumed = EarlyStopper(SimpleNamespace(patience=2, min_epochs=0))
+    resumed.load_state_dict(early_stopper.state_dict())
+    assert resumed.state_dict() == early_stopper.state_dict()
+    assert (resumed.best_loss, resumed.best_epoch, resumed.index) == (0.5, 1, 1)
+
+    # the resumed stopper stops where the original one would have
+    assert validate(resumed, 0.8, 3)
+    assert validate(early_stopper, 0.8, 3)
@@ -0,0 +1,62 @@
+import pytest
+import torch
+import torch.nn as nn
+
+from benchmarks.networks import get_input_shape
+from models.fusion import fuse_conv_bn, optimize_for_inference, verify_optimized_network
+from models.networks import get_network, get_available_networks
+
+
+def randomise_statistics(bn):
+    with torch.no_grad():
+        bn.running_mean.uniform_(-1, 1)
+        bn.running_var.uniform_(0.5, 2)
+        if bn.affine:
+            bn.weight.uniform_(0.5, 2)
+            bn.bias.uniform_(-1, 1)
+    return bn.eval()
+
+
+@pytest.mark.parametrize('conv, bn, shape', [
+    (nn.Conv3d(3, 4, 3, padding=1), nn.BatchNorm3d(4), (2, 3, 6, 6, 6)),
+    (nn.Conv3d(3, 4, 3, padding=1, bias=False), nn.BatchNorm3d(4, affine=False), (2, 3, 6, 6, 6)),
+    (nn.Conv2d(4, 4, 3, groups=2), nn.BatchNorm2d(4), (2, 4, 8, 8)),
+    (nn.ConvTranspose3d(3, 4, 2, stride=2), nn.BatchNorm3d(4), (2, 3, 4, 4, 4)),
+])
+def test_fused_convolution_matches_conv_bn(conv, bn, shape):
+    torch.manual_seed(0)
+    conv.eval()
+    randomise_statistics(bn)
+    x = torch.randn(*shape)
+    with torch.no_grad():
+        expected = bn(conv(x))
+        fused = fuse_conv_bn(conv, bn)(x)
+    assert torch.allclose(fused, expected, atol=1e-5)
+
+
+def test_optimize_for_inference_folds_sequential_pairs():
+    torch.manual_seed(0)
+    net = nn.Sequential(nn.Conv3d(2, 4, 3, padding=1), randomise_statistics(nn.BatchNorm3d(4)), nn.ReLU(),
+                        nn.Conv3d(4, 4, 3, padding=1), randomise_statistics(nn.BatchNorm3d(4)))
+    x = torch.randn(1, 2, 6, 6, 6)
+    folded, n_folded = optimize_for_inference(net)
+    assert n_folded == 2
+    assert not any(isinstance(module, nn.BatchNorm3d) for module in folded.modules())
+    # the original network is left untouched
+    assert sum(isinstance(module, nn.BatchNorm3d) for module in net.modules()) == 2
+    with torch.no_grad():
+        assert torch.allclose(folded(x), net.eval()(x), atol=1e-5)
+
+
+@pytest.mark.parametrize('name, tensor_dim', get_available_networks())
+def test_optimize_for_inference_preserves_networks(name, tensor_dim):
+    torch.manual_seed(0)
+    net = get_network(name, n_classes=2, in_channels=2, input_nz=5, feature_scale=16, tensor_dim=tensor_dim)
+    for module in net.modules():
+        if isinstance(module, nn.modules.batchnorm._BatchNorm):
+            randomise_statistics(module)
+    x = torch.randn(*get_input_shape(name, tensor_dim, (32, 32, 32), 2, in_channels=2, input_nz=5))
+    optimized, n_folded = optimize_for_inference(net)
+    verify_optimized_network(net, optimized, x)
+    if any(isinstance(module, nn.modules.batchnorm._BatchNorm) for module in net.modules()):
+        assert n_folded > 0
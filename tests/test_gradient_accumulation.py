@@ -0,0 +1,74 @@
+import pytest
+import torch
+
+from models.base_model import BaseModel
+from models.feedforward_seg_model import FeedForwardSegmentation
+
+
+class StubOptimizer(object):
+    def __init__(self, events):
+        self.events = events
+        self.iteration = None
+
+    def zero_grad(self):
+        self.events.append(('zero_grad', self.iteration))
+
+    def step(self):
+        self.events.append(('step', self.iteration))
+
+
+def get_accumulating_model(events):
+    model = FeedForwardSegmentation()
+    model.net = torch.nn.Linear(1, 1)
+    model.optimizer_S = StubOptimizer(events)
+    model.scaler = None
+    model.ddp_net = None
+    model.forward = lambda split: None
+    model.backward = lambda loss_weight=1.0: events.append(('backward', model.optimizer_S.iteration, loss_weight))
+    return model
+
+
+def test_accumulation_groups():
+    events = []
+    model = get_accumulating_model(events)
+    for iteration in range(1, 8):
+        model.optimizer_S.iteration = iteration
+        model.optimize_parameters_accumulate_grd(iteration, n_iterations=7, accumulate_iters=3)
+
+    assert [iteration for event, iteration, *_ in events if event == 'zero_grad'] == [1, 4, 7]
+    assert [iteration for event, iteration, *_ in events if event == 'step'] == [3, 6, 7]
+    weights = [weight for event, _, *weight in events if event == 'backward']
+    assert weights == [[pytest.approx(1 / 3)]] * 6 + [[1.0]]
+    assert model.n_optimizer_steps == 3
+
+
+def get_scheduled_model():
+    model = BaseModel()
+    parameter = torch.nn.Parameter(torch.zeros(1))
+    model.optimizers = [torch.optim.SGD([parameter], lr=1.0)]
+    model.schedulers = [torch.optim.lr_scheduler.StepLR(model.optimizers[0], step_size=1, gamma=0.5)]
+    return model
+
+
+@pytest.mark.parametrize('steps_per_epoch, steps_of_epoch, n_scheduler_steps, step_epochs', [
+    (None, 7, 7, None),  # once per epoch without steps_per_epoch
+    (7, 7, 7, 7.0),      # without accumulation
+    (7, 3, 3, 3.0),      # 7 batches accumulated by 3: steps after batches 3, 6 and 7
+])
+def test_scheduler_counts_optimizer_steps(steps_per_epoch, steps_of_epoch, n_scheduler_steps, step_epochs):
+    model = get_scheduled_model()
+    if steps_per_epoch is not None:
+        model.set_steps_per_epoch(steps_per_epoch)
+    for epoch in range(7):
+        model.n_optimizer_steps += steps_of_epoch
+        model.update_learning_rate()
+
+    assert model.schedulers[0].last_epoch == n_scheduler_steps
+    assert model.optimizers[0].param_groups[0]['lr'] == pytest.approx(0.5 ** n_scheduler_steps)
+    assert model.get_step_epochs() == step_epochs
+
+
+def test_scheduler_skips_epochs_without_optimizer_steps():
+    model = get_scheduled_model()
+    model.update_learning_rate()
+    assert model.schedulers[0].last_epoch == 0
@@ -0,0 +1,13 @@
+from utils.utils import is_due
+
+
+def test_every_epoch():
+    assert all(is_due(epoch, 1, 10) for epoch in range(10))
+
+
+def test_period_and_last_epoch():
+    assert [epoch for epoch in range(10) if is_due(epoch, 3, 10)] == [2, 5, 8, 9]
+
+
+def test_disabled():
+    assert not any(is_due(epoch, 0, 10) for epoch in range(10))
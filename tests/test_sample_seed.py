@@ -0,0 +1,17 @@
+from dataio.loaders.utils import get_sample_seed
+
+
+def test_same_inputs_give_same_seed():
+    assert get_sample_seed(42, 3, 7) == get_sample_seed(42, 3, 7)
+
+
+def test_seed_depends_on_run_epoch_and_index():
+    seeds = {get_sample_seed(base_seed, epoch, index) for base_seed in [0, 42] for epoch in range(3)
+             for index in range(10)}
+    assert len(seeds) == 2 * 3 * 10
+
+
+def test_seed_is_a_valid_numpy_seed():
+    seed = get_sample_seed(42, 0, 0)
+    assert isinstance(seed, int)
+    assert 0 <= seed < 2 ** 32
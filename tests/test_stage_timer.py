@@ -0,0 +1,34 @@
+import time
+import pytest
+
+from utils.timer import StageTimer
+
+
+def test_records_stages_of_every_iteration():
+    timer = StageTimer()
+    for batch in timer.iterate([1, 2, 3]):
+        with timer.stage('forward'):
+            time.sleep(0.001)
+        timer.count(2, 2 * 1000)
+    stats = timer.get_stats()
+    assert len(timer.iterations) == 3
+    assert stats['forward_ms_p50'] >= 1
+    assert stats['iteration_ms_p50'] >= stats['forward_ms_p50']
+    assert 'backward_ms_p50' not in stats
+    assert stats['voxels_per_s'] == pytest.approx(1000 * stats['samples_per_s'])
+    assert 'forward' in timer.get_summary(0)
+
+
+def test_stages_outside_iterations_are_ignored():
+    timer = StageTimer()
+    with timer.stage('forward'):
+        pass
+    assert timer.get_stats() == {}
+
+
+def test_reset():
+    timer = StageTimer()
+    for batch in timer.iterate([1]):
+        timer.count(1, 10)
+    timer.reset()
+    assert timer.iterations == [] and timer.n_samples == 0 and timer.elapsed == 0.0
@@ -1,12 +1,22 @@
+import os
+import random
+import numpy as np
+import torch
 from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
 from tqdm import tqdm
-import numpy as np
 
-from dataio.loaders import get_dataset, get_dataset_path
+from dataio.loaders import get_dataset, get_dataset_path, CachedDataset, AugmentationReplayDataset
+from dataio.loaders.utils import worker_init_fn, get_subject_subsample
 from dataio.transformation import get_dataset_transformation
-from utils.utils import json_file_to_pyobj, save_config
+from utils.utils import json_file_to_pyobj, save_config, is_due
 from utils.visualiser import Visualiser
 from utils.error_logger import ErrorLogger
+from utils.checkpoint import load_checkpoint, set_rng_state
+from utils.async_validator import AsyncValidator
+from utils.timer import StageTimer
+from utils.profiling import profile_training
+from utils.distributed import init_distributed, cleanup_distributed, is_main_process, barrier, broadcast_int
 
 from models import get_model
 from models.utils import EarlyStopper
@@ -24,6 +34,30 @@ def train(arguments):
     # Architecture type
     arch_type = train_opts.arch_type
 
+    # Data-parallel training over several processes, only the main process logs and saves
+    distributed = arguments.distributed
+    if distributed:
+        init_distributed(backend='gloo')
+    is_main = is_main_process()
+
+    # Resume the full training state of an interrupted run (see BaseModel.save_training_state)
+    training_state = None
+    if hasattr(train_opts, 'resume') and train_opts.resume:
+        resume_path = train_opts.resume if isinstance(train_opts.resume, str) else \
+            os.path.join(json_opts.model.checkpoints_dir, json_opts.model.experiment_name, 'training_state.pth')
+        training_state = load_checkpoint(resume_path)
+
+    # Seed the run, the augmentation of every sample is derived from (seed, epoch, index)
+    seed = train_opts.seed if hasattr(train_opts, 'seed') else np.random.randint(0, 2 ** 31)
+    if training_state is not None:
+        seed = training_state['seed']
+    # all processes need the same seed, the shards of the distributed sampler are cut from one shared permutation
+    seed = broadcast_int(seed)
+    print('Seed of the run: {0}'.format(seed))
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
     # Setup Dataset and Augmentation
     ds_class = get_dataset(arch_type)
     ds_path = get_dataset_path(arch_type, json_opts.data_path)
@@ -39,6 +73,8 @@ def train(arguments):
 
     # Setup the NN Model
     model = get_model(json_opts.model)
+    if distributed:
+        model.distribute()
     if network_debug:
         print('# of pars: ', model.get_number_parameters())
         print('fp time: {0:.3f} sec\tbp time: {1:.3f} sec per sample'.format(*model.get_fp_bp_time()))
@@ -48,32 +84,116 @@ def train(arguments):
     split_opts = json_opts.data_split
     train_dataset = ds_class(ds_path, split='train',      transform=ds_transform['train'], preload_data=train_opts.preloadData,
                              train_size=split_opts.train_size, test_size=split_opts.test_size,
-                             valid_size=split_opts.validation_size, split_seed=split_opts.seed, channels=channels, input_nz=json_opts.model.input_nz)
+                             valid_size=split_opts.validation_size, split_seed=split_opts.seed, channels=channels,
+                             augmentation_seed=seed, input_nz=json_opts.model.input_nz)
     valid_dataset = ds_class(ds_path, split='validation', transform=ds_transform['valid'], preload_data=train_opts.preloadData,
                              train_size=split_opts.train_size, test_size=split_opts.test_size,
-                             valid_size=split_opts.validation_size, split_seed=split_opts.seed, channels=channels, input_nz=json_opts.model.input_nz)
+                             valid_size=split_opts.validation_size, split_seed=split_opts.seed, channels=channels,
+                             augmentation_seed=seed, input_nz=json_opts.model.input_nz)
     test_dataset  = ds_class(ds_path, split='test',       transform=ds_transform['valid'], preload_data=train_opts.preloadData,
                              train_size=split_opts.train_size, test_size=split_opts.test_size,
-                             valid_size=split_opts.validation_size, split_seed=split_opts.seed, channels=channels, input_nz=json_opts.model.input_nz)
-    train_loader = DataLoader(dataset=train_dataset, num_workers=16, batch_size=train_opts.batchSize, shuffle=True)
-    valid_loader = DataLoader(dataset=valid_dataset, num_workers=16, batch_size=train_opts.batchSize, shuffle=False)
-    test_loader  = DataLoader(dataset=test_dataset,  num_workers=16, batch_size=train_opts.batchSize, shuffle=False)
+                             valid_size=split_opts.validation_size, split_seed=split_opts.seed, channels=channels,
+                             augmentation_seed=seed, input_nz=json_opts.model.input_nz)
+
+    # Replay expensive augmentations from a pre-generated store (see generate_augmentation_store.py)
+    if hasattr(train_opts, 'augmentation_store') and train_opts.augmentation_store:
+        online_augmentation = train_opts.replay_online_augmentation if hasattr(train_opts, 'replay_online_augmentation') else True
+        train_dataset = AugmentationReplayDataset(train_opts.augmentation_store, train_dataset,
+                                                  transform=ds_transform['replay'] if online_augmentation else None,
+                                                  store_transform=ds_transform['store'])
+
+    # Asynchronous validation builds its own (cached) validation and test data in its worker process
+    async_validation = hasattr(train_opts, 'async_validation') and train_opts.async_validation
+
+    # Validation and test transforms are deterministic: materialise their tensors once and stream them afterwards
+    eval_num_workers = 16
+    if hasattr(train_opts, 'cache_eval_data') and train_opts.cache_eval_data and not async_validation:
+        cache_mode = 'ram' if train_opts.cache_eval_data is True else train_opts.cache_eval_data
+        cache_dir = train_opts.cache_dir if hasattr(train_opts, 'cache_dir') else os.path.join(model.save_dir, 'cache')
+        # the main process writes memory-mapped caches before the other processes open them
+        if not is_main: barrier()
+        valid_dataset = CachedDataset(valid_dataset, cache_mode=cache_mode, cache_dir=cache_dir, num_workers=16)
+        test_dataset = CachedDataset(test_dataset, cache_mode=cache_mode, cache_dir=cache_dir, num_workers=16)
+        if is_main: barrier()
+        eval_num_workers = 0
+
+    # Evaluate on a fixed random subsample of the validation subjects
+    if hasattr(train_opts, 'validation_subjects') and train_opts.validation_subjects and not async_validation:
+        valid_dataset = get_subject_subsample(valid_dataset, train_opts.validation_subjects, split_opts.seed)
+        print('Validating on {0} subjects'.format(len(valid_dataset)))
+
+    # every process works on its own shard of each split
+    train_sampler = DistributedSampler(train_dataset, shuffle=True, seed=seed) if distributed else None
+    valid_sampler = DistributedSampler(valid_dataset, shuffle=False) if distributed else None
+    test_sampler  = DistributedSampler(test_dataset,  shuffle=False) if distributed else None
+
+    train_loader = DataLoader(dataset=train_dataset, num_workers=16, batch_size=train_opts.batchSize, shuffle=train_sampler is None,
+                              sampler=train_sampler, worker_init_fn=worker_init_fn)
+    valid_loader, test_loader = None, None
+    if not async_validation:
+        valid_loader = DataLoader(dataset=valid_dataset, num_workers=eval_num_workers, batch_size=train_opts.batchSize, shuffle=False,
+                                  sampler=valid_sampler, worker_init_fn=worker_init_fn)
+        test_loader  = DataLoader(dataset=test_dataset,  num_workers=eval_num_workers, batch_size=train_opts.batchSize, shuffle=False,
+                                  sampler=test_sampler, worker_init_fn=worker_init_fn)
+
+    # Profile a few training steps with torch.profiler and exit
+    if arguments.profile:
+        wait, warmup, active = arguments.profile_steps
+        profile_training(model, train_loader, model.save_dir, wait=wait, warmup=warmup, active=active,
+                         resolve_slabs=True)
+        cleanup_distributed()
+        exit()
 
     # Visualisation Parameters
-    visualizer = Visualiser(json_opts.visualisation, save_dir=model.save_dir)
+    visualizer = Visualiser(json_opts.visualisation, save_dir=model.save_dir) if is_main else None
     error_logger = ErrorLogger()
 
     # Training Function
     model.set_scheduler(train_opts)
+    # Gradient accumulation: one optimizer step every accumulate_grad_iters batches
+    accumulate_grad_iters = train_opts.accumulate_grad_iters if hasattr(train_opts, 'accumulate_grad_iters') else 1
+    if accumulate_grad_iters > 1:
+        print('Accumulating gradients over {0} batches (effective batch size {1})'.format(
+            accumulate_grad_iters, accumulate_grad_iters * train_opts.batchSize))
+    # the learning rate schedule and min_epochs count optimizer steps, an epoch is len(train_loader) steps
+    model.set_steps_per_epoch(len(train_loader))
+    # Evaluation cadence: validation every validate_every epochs, test every test_every epochs
+    # or only after validation epochs which improved on the best model (test_at_best_only)
+    validate_every = train_opts.validate_every if hasattr(train_opts, 'validate_every') else 1
+    test_every = train_opts.test_every if hasattr(train_opts, 'test_every') else 1
+    test_at_best_only = train_opts.test_at_best_only if hasattr(train_opts, 'test_at_best_only') else False
     # Setup Early Stopping
     early_stopper = EarlyStopper(json_opts.training.early_stopping, verbose=json_opts.training.verbose)
+    if training_state is not None:
+        model.load_training_state(training_state)
+        early_stopper.load_state_dict(training_state['early_stopper'])
+        set_rng_state(training_state['rng'])
+    # Time the stages of every training iteration, the GPU is synchronised after every stage
+    stage_timer = None
+    if not hasattr(train_opts, 'stage_timing') or train_opts.stage_timing:
+        stage_timer = StageTimer(synchronize=model.use_cuda)
+        model.set_timer(stage_timer)
+    # Validate in a separate process on snapshots of the weights while training goes on
+    async_validator = None
+    if async_validation:
+        if distributed:
+            raise Exception('Asynchronous validation is not supported with distributed training')
+        async_validator = AsyncValidator(json_filename, seed, monitor=early_stopper.monitor, best_loss=early_stopper.best_loss,
+                                         n_threads=train_opts.async_validation_threads if hasattr(train_opts, 'async_validation_threads') else 4)
+        async_error_logger = ErrorLogger()
     for epoch in range(model.which_epoch, train_opts.n_epochs):
         print('(epoch: %d, total # iters: %d)' % (epoch, len(train_loader)))
-        train_volumes = []
-        validation_volumes = []
+        train_dataset.set_epoch(epoch)
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
 
         # Training Iterations
-        for epoch_iter, (images, labels, indices) in tqdm(enumerate(train_loader, 1), total=len(train_loader)):
+        train_batches = train_loader if stage_timer is None else stage_timer.iterate(train_loader)
+        for epoch_iter, (images, labels, indices) in tqdm(enumerate(train_batches, 1), total=len(train_loader), disable=not is_main):
+
+            # Throughput in subjects (not slabs) and in voxels of all slabs
+            if stage_timer is not None:
+                stage_timer.count(images.shape[0], images[:, :, 0].numel())
 
             # Resolve z_slabs with samples
             indices = np.repeat(indices, images.shape[1])
@@ -82,21 +202,37 @@ def train(arguments):
 
             # Make a training update
             model.set_input(images, labels)
-            model.optimize_parameters()
-            #model.optimize_parameters_accumulate_grd(epoch_iter)
+            model.optimize_parameters_accumulate_grd(epoch_iter, len(train_loader), accumulate_grad_iters)
 
             # Error visualisation
-            errors = model.get_current_errors()
-            error_logger.update(errors, split='train')
+            with model.timed('metrics'):
+                errors = model.get_current_errors()
+                error_logger.update(errors, split='train')
 
-            ids = [str(id) + '_' + str(idx) for idx, id in enumerate(train_dataset.get_ids(indices))]
-            volumes = model.get_current_volumes()
-            visualizer.display_current_volumes(volumes, ids, 'train', epoch)
-            train_volumes.append(volumes)
+            # Keep the volumes of a few subjects for visualisation
+            with model.timed('visualisation'):
+                if is_main and visualizer.wants_volumes():
+                    ids = [str(id) + '_' + str(idx) for idx, id in enumerate(train_dataset.get_ids(indices))]
+                    visualizer.capture_volumes(model.get_current_volumes, ids, 'train')
 
         # Validation and Testing Iterations
+        evaluated_splits = ['train']
+        should_stop = False
+        validation_loss = None
         for loader, split, dataset in zip([valid_loader, test_loader], ['validation', 'test'], [valid_dataset, test_dataset]):
-            for epoch_iter, (images, labels, indices) in tqdm(enumerate(loader, 1), total=len(loader)):
+            if async_validator is not None:
+                break
+            if split == 'validation' and not is_due(epoch, validate_every, train_opts.n_epochs):
+                continue
+            if split == 'test':
+                # the test split is evaluated with the weights of a new best validation epoch only
+                run_test = 'validation' in evaluated_splits and early_stopper.is_improving if test_at_best_only \
+                    else is_due(epoch, test_every, train_opts.n_epochs)
+                if not run_test:
+                    continue
+            evaluated_splits.append(split)
+
+            for epoch_iter, (images, labels, indices) in tqdm(enumerate(loader, 1), total=len(loader), disable=not is_main):
 
                 # Resolve z_slabs with samples
                 n_subjects = images.shape[0]
@@ -117,31 +253,89 @@ def train(arguments):
 
                 if split == 'validation':  # do not look at testing
                     # Visualise predictions
-                    volumes = model.get_current_volumes()
-                    visualizer.display_current_volumes(volumes, ids, split, epoch)
-                    validation_volumes.append(volumes)
+                    if is_main and visualizer.wants_volumes():
+                        visualizer.capture_volumes(model.get_current_volumes, ids, split)
 
                     # Track validation loss values
                     early_stopper.update({**errors, **stats})
 
+            if split == 'validation':
+                # The early stopping monitor is reduced over all processes
+                early_stopper.synchronise()
+                validation_loss = early_stopper.get_current_validation_loss()
+                should_stop = early_stopper.interrogate(epoch, n_steps=model.n_optimizer_steps,
+                                                        step_epochs=model.get_step_epochs())
+
+        # Asynchronous validation: submit the weights of this epoch and apply the results which arrived since
+        if async_validator is not None:
+            if is_due(epoch, validate_every, train_opts.n_epochs):
+                async_validator.submit(epoch, model.net, run_test=not test_at_best_only and is_due(epoch, test_every, train_opts.n_epochs),
+                                       test_at_best_only=test_at_best_only)
+            for result in async_validator.get_results(wait=epoch == train_opts.n_epochs - 1):
+                for split in ['validation', 'test']:
+                    for batch_stats in result[split] or []:
+                        async_error_logger.update(batch_stats, split=split)
+                        if split == 'validation':
+                            early_stopper.update(batch_stats)
+                    if result[split] is not None:
+                        visualizer.plot_current_errors(result['epoch'], async_error_logger.get_errors(split), split_name=split)
+                        visualizer.print_current_errors(result['epoch'], async_error_logger.get_errors(split), split_name=split)
+                async_error_logger.reset()
+
+                # the validated weights are the snapshot of an earlier epoch
+                validation_loss = early_stopper.get_current_validation_loss()
+                should_stop = early_stopper.interrogate(result['epoch'], n_steps=model.n_optimizer_steps,
+                                                        step_epochs=model.get_step_epochs()) or should_stop
+                if early_stopper.is_improving:
+                    model.save(json_opts.model.model_type, result['epoch'], state_dict=result['state_dict'])
+                    save_config(json_opts, json_filename, model, result['epoch'])
+
+        # Metrics are reduced over all processes
+        error_logger.synchronise()
+
         # Update the plots
-        for split in ['train', 'validation', 'test']:
-            visualizer.plot_current_errors(epoch, error_logger.get_errors(split), split_name=split)
-            visualizer.print_current_errors(epoch, error_logger.get_errors(split), split_name=split)
-        visualizer.save_plots(epoch, save_frequency=5)
+        if is_main:
+            for split in evaluated_splits:
+                visualizer.plot_current_errors(epoch, error_logger.get_errors(split), split_name=split)
+                visualizer.print_current_errors(epoch, error_logger.get_errors(split), split_name=split)
+            visualizer.save_plots(epoch, save_frequency=5)
+            visualizer.display_captured_volumes(epoch)
         error_logger.reset()
 
-        # Save the model parameters
-        if not early_stopper.is_improving is False:
+        # Report the time spent in every stage of the training iterations and the throughput
+        if stage_timer is not None:
+            if is_main:
+                visualizer.print_current_message(stage_timer.get_summary(epoch))
+                visualizer.print_current_errors(epoch, stage_timer.get_stats(), split_name='timing')
+            stage_timer.reset()
+
+        # Report the time spent in every transform
+        if ds_transform['profilers'] is not None:
+            for split, profiler in ds_transform['profilers'].items():
+                if is_main:
+                    visualizer.print_current_message(profiler.get_summary(epoch, split=split))
+                profiler.reset()
+
+        # Save the model parameters of a new best validation epoch
+        if is_main and 'validation' in evaluated_splits and early_stopper.is_improving:
             model.save(json_opts.model.model_type, epoch)
             save_config(json_opts, json_filename, model, epoch)
 
         # Update the model learning rate
-        model.update_learning_rate(metric=early_stopper.get_current_validation_loss())
+        model.update_learning_rate(metric=validation_loss)
 
-        if early_stopper.interrogate(epoch):
+        # Save the full training state, a resumed run continues exactly after this epoch
+        if is_main:
+            model.save_training_state(epoch, early_stopper=early_stopper.state_dict(), seed=seed)
+
+        if should_stop:
             break
 
+    if async_validator is not None:
+        async_validator.close()
+    model.wait_for_checkpoints()
+    cleanup_distributed()
+
 
 if __name__ == '__main__':
     import argparse
@@ -150,6 +344,10 @@ if __name__ == '__main__':
 
     parser.add_argument('-c', '--config',  help='training config file', required=True)
     parser.add_argument('-d', '--debug',   help='returns number of parameters and bp/fp runtime', action='store_true')
+    parser.add_argument('--profile',       help='profiles training steps with torch.profiler, writes a chrome trace and an operator summary to <experiment>/profile', action='store_true')
+    parser.add_argument('--profile_steps', help='wait, warmup and active steps of the profiling schedule', nargs=3, type=int, default=[1, 1, 3],
+                        metavar=('WAIT', 'WARMUP', 'ACTIVE'))
+    parser.add_argument('--distributed',   help='data-parallel training over the processes launched by torchrun (gloo)', action='store_true')
     args = parser.parse_args()
 
     train(args)
@@ -0,0 +1,191 @@
+import queue
+import traceback
+import numpy as np
+import torch
+import torch.multiprocessing as multiprocessing
+from collections import OrderedDict
+from torch.utils.data import DataLoader
+
+from dataio.loaders import get_dataset, get_dataset_path, CachedDataset
+from dataio.loaders.utils import get_subject_subsample
+from dataio.transformation import get_dataset_transformation
+from utils.utils import json_file_to_pyobj
+from utils.checkpoint import snapshot
+
+
+def get_evaluation_datasets(json_opts, seed):
+    '''
+    Cached validation and test datasets of an experiment, as used by the training scripts
+    :param json_opts: experiment config
+    :param seed: seed of the run
+    :return: dict split -> dataset
+    '''
+    train_opts = json_opts.training
+    arch_type = train_opts.arch_type
+    ds_class = get_dataset(arch_type)
+    ds_path = get_dataset_path(arch_type, json_opts.data_path)
+    ds_transform = get_dataset_transformation(arch_type, opts=json_opts.augmentation,
+                                              max_output_channels=json_opts.model.output_nc, verbose=False)
+    split_opts = json_opts.data_split
+    dataset_kwargs = {'input_nz': json_opts.model.input_nz} if arch_type == 'gsd_pCT_25D' else {}
+
+    cache_mode = 'ram'
+    cache_dir = None
+    if hasattr(train_opts, 'cache_eval_data') and train_opts.cache_eval_data == 'memmap':
+        cache_mode = 'memmap'
+        cache_dir = train_opts.cache_dir if hasattr(train_opts, 'cache_dir') else \
+            '{0}/{1}/cache'.format(json_opts.model.checkpoints_dir, json_opts.model.experiment_name)
+
+    datasets = {}
+    for split in ['validation', 'test']:
+        dataset = ds_class(ds_path, split=split, transform=ds_transform['valid'], preload_data=train_opts.preloadData,
+                           train_size=split_opts.train_size, test_size=split_opts.test_size,
+                           valid_size=split_opts.validation_size, split_seed=split_opts.seed,
+                           channels=json_opts.data_opts.channels, augmentation_seed=seed, **dataset_kwargs)
+        # daemonic processes can not start data loader workers
+        datasets[split] = CachedDataset(dataset, cache_mode=cache_mode, cache_dir=cache_dir, num_workers=0)
+
+    if hasattr(train_opts, 'validation_subjects') and train_opts.validation_subjects:
+        datasets['validation'] = get_subject_subsample(datasets['validation'], train_opts.validation_subjects,
+                                                       split_opts.seed)
+    return datasets
+
+
+def evaluate(model, dataset, batch_size, resolve_slabs=False):
+    '''
+    :return: list of the errors and segmentation statistics of every batch
+    '''
+    loader = DataLoader(dataset=dataset, num_workers=0, batch_size=batch_size, shuffle=False)
+    batches = []
+    for images, labels, indices in loader:
+        n_subjects = 1
+        if resolve_slabs:
+            # Resolve z_slabs with samples
+            n_subjects = images.shape[0]
+            images = images.view(-1, *(images.size()[2:]))
+            labels = labels.view(-1, *(labels.size()[2:]))
+
+        model.set_input(images, labels)
+        model.validate()
+        batches.append({**model.get_current_errors(), **model.get_segmentation_stats(n_subjects=n_subjects)})
+    return batches
+
+
+def _run_validation_worker(config_filename, seed, monitor, best_loss, n_threads, tasks, results):
+    torch.set_num_threads(n_threads)
+    json_opts = json_file_to_pyobj(config_filename)
+    datasets = get_evaluation_datasets(json_opts, seed)
+    resolve_slabs = json_opts.training.arch_type == 'gsd_pCT_25D'
+
+    # imported here so that the worker builds its own model, with a criterion for the validation loss
+    from models import get_model, ModelOpts
+    model_opts = ModelOpts()
+    model_opts.initialise(json_opts.model)
+    model_opts.isTrain = True
+    model_opts.continue_train = False
+    model = get_model(model_opts)
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        epoch, state_dict, run_test, test_at_best_only = task
+        model.net.load_state_dict(state_dict)
+
+        result = {'epoch': epoch, 'validation': evaluate(model, datasets['validation'], json_opts.training.batchSize,
+                                                         resolve_slabs), 'test': None}
+
+        # the worker tracks the best validation loss itself to decide on testing at the best epoch
+        loss = np.mean([batch[monitor] for batch in result['validation']])
+        improved = best_loss is None or loss <= best_loss
+        if improved:
+            best_loss = loss
+        if run_test or (test_at_best_only and improved):
+            result['test'] = evaluate(model, datasets['test'], json_opts.training.batchSize, resolve_slabs)
+        results.put(result)
+
+
+def _validation_worker(run_worker, config_filename, seed, monitor, best_loss, n_threads, tasks, results):
+    # failures are sent to the training process, which raises them
+    try:
+        run_worker(config_filename, seed, monitor, best_loss, n_threads, tasks, results)
+    except Exception:
+        results.put({'error': traceback.format_exc()})
+
+
+class AsyncValidator(object):
+    """
+    Validates snapshots of the network weights in a persistent worker process with its own cached validation
+    and test data, while the training loop goes on with the next epochs.
+    """
+
+    def __init__(self, config_filename, seed, monitor, best_loss=None, n_threads=4, max_pending=2,
+                 run_worker=_run_validation_worker):
+        '''
+        :param config_filename: experiment config, the worker builds its own datasets and model from it
+        :param seed: seed of the run
+        :param monitor: early stopping monitor, used for testing at the best epoch only
+        :param best_loss: best validation loss so far (of a resumed run)
+        :param n_threads: number of intra-op threads of the worker
+        :param max_pending: maximum number of snapshots waiting for their results, training blocks beyond
+        :param run_worker: module level function running the worker loop, with the arguments of
+         _run_validation_worker
+        '''
+        context = multiprocessing.get_context('spawn')
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.max_pending = max_pending
+        # snapshots are kept until their results arrive, to save the weights of a new best epoch
+        self.snapshots = OrderedDict()
+        self.process = context.Process(target=_validation_worker, name='async_validation', daemon=True,
+                                       args=(run_worker, config_filename, seed, monitor, best_loss, n_threads,
+                                             self.tasks, self.results))
+        self.process.start()
+
+    def submit(self, epoch, network, run_test=False, test_at_best_only=False):
+        '''
+        Hand a copy of the current weights to the worker
+        :param epoch: epoch of the weights
+        :param network: network to snapshot
+        :param run_test: evaluate the test split as well
+        :param test_at_best_only: evaluate the test split if the validation loss improved
+        '''
+        state_dict = snapshot(network.state_dict())
+        self.snapshots[epoch] = state_dict
+        self.tasks.put((epoch, state_dict, run_test, test_at_best_only))
+
+    def _get(self, block):
+        while True:
+            try:
+                result = self.results.get(block=block, timeout=10 if block else None)
+            except queue.Empty:
+                if not block:
+                    return None
+                if not self.process.is_alive():
+                    raise Exception('The asynchronous validation process died')
+                continue
+            if 'error' in result:
+                raise Exception('The asynchronous validation process failed:\n{0}'.format(result['error']))
+            return result
+
+    def get_results(self, wait=False):
+        '''
+        :param wait: wait for all pending results, otherwise only wait until fewer than max_pending are left
+        :return: list of results (dicts with epoch, validation and test batch statistics and the state_dict of the
+         evaluated weights), ordered by epoch
+        '''
+        results = []
+        while self.snapshots:
+            block = wait or len(self.snapshots) >= self.max_pending
+            result = self._get(block)
+            if result is None:
+                break
+            result['state_dict'] = self.snapshots.pop(result['epoch'])
+            results.append(result)
+        return results
+
+    def close(self):
+        self.tasks.put(None)
+        self.process.join(timeout=60)
+        if self.process.is_alive():
+            self.process.terminate()
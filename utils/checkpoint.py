@@ -0,0 +1,109 @@
+import os
+import copy
+import queue
+import random
+import atexit
+import threading
+from collections import OrderedDict
+import numpy as np
+import torch
+
+
+def snapshot(obj):
+    '''
+    Copy a (nested) state so that it can be written while training goes on
+    :param obj: tensor, dict, list, tuple or any deep-copyable object
+    :return: copy with every tensor cloned to the CPU
+    '''
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, OrderedDict):
+        return OrderedDict((key, snapshot(value)) for key, value in obj.items())
+    if isinstance(obj, dict):
+        return {key: snapshot(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [snapshot(value) for value in obj]
+    if isinstance(obj, tuple):
+        return tuple(snapshot(value) for value in obj)
+    return copy.deepcopy(obj)
+
+
+def save_atomic(obj, path):
+    '''
+    Write to a temporary file and rename it, so that an interrupted write never leaves a truncated checkpoint behind
+    '''
+    tmp_path = path + '.tmp'
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class AsyncCheckpointWriter(object):
+    """
+    Writes checkpoints from a background thread. The state is copied when it is submitted, so the training loop only
+    pays for the copy to CPU memory and never for the disk. Writes and deletions are executed in submission order.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='checkpoint_writer', daemon=True)
+        self.thread.start()
+        # flush pending checkpoints before the interpreter exits
+        atexit.register(self.wait)
+
+    def _run(self):
+        while True:
+            action, args = self.queue.get()
+            try:
+                if action == 'save':
+                    save_atomic(*args)
+                elif action == 'delete' and os.path.exists(args[0]):
+                    os.remove(args[0])
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def _check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise Exception('Writing a checkpoint failed') from error
+
+    def save(self, state, path):
+        self._check()
+        self.queue.put(('save', (snapshot(state), path)))
+
+    def delete(self, path):
+        self._check()
+        self.queue.put(('delete', (path,)))
+
+    def wait(self):
+        '''
+        Block until all submitted checkpoints are written
+        '''
+        self.queue.join()
+        self._check()
+
+
+def get_rng_state():
+    state = {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def load_checkpoint(path):
+    '''
+    Load a full training state on the CPU (it contains python and numpy objects besides tensors)
+    '''
+    if 'weights_only' in torch.load.__code__.co_varnames:
+        return torch.load(path, map_location='cpu', weights_only=False)
+    return torch.load(path, map_location='cpu')
@@ -0,0 +1,103 @@
+'''
+Helpers for multi-process data-parallel training (torch.distributed)
+
+Processes are launched with torchrun, eg. on a single node with 2 sockets:
+    torchrun --nproc_per_node=2 train_segmentation.py -c <config> --distributed
+or on several nodes:
+    torchrun --nnodes=<n> --node_rank=<i> --nproc_per_node=2 --master_addr=<host> --master_port=29500 \
+        train_segmentation.py -c <config> --distributed
+'''
+
+import os
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(backend='gloo'):
+    '''
+    Initialise the default process group from the environment set by the launcher
+    (RANK, WORLD_SIZE, LOCAL_RANK, MASTER_ADDR, MASTER_PORT)
+    :param backend: communication backend, gloo works for CPU and GPU tensors
+    '''
+    if not dist.is_available():
+        raise Exception('torch.distributed is not available in this PyTorch build')
+    if 'RANK' not in os.environ or 'WORLD_SIZE' not in os.environ:
+        raise Exception('Distributed training has to be launched with torchrun (RANK and WORLD_SIZE are not set)')
+    if is_distributed():
+        return
+
+    dist.init_process_group(backend=backend, init_method='env://')
+
+    local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    if torch.cuda.is_available():
+        torch.cuda.set_device(local_rank)
+    # share the cores of the node between the processes instead of oversubscribing them
+    local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+    if 'OMP_NUM_THREADS' not in os.environ and local_world_size > 1:
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+
+    print('Initialised process {0}/{1} (local rank {2}, backend {3}, {4} threads)'.format(
+        get_rank(), get_world_size(), local_rank, backend, torch.get_num_threads()))
+
+
+def cleanup_distributed():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def broadcast_int(value, src=0):
+    '''
+    Share an integer of one process with all processes, eg. a seed drawn at random
+    :return: the value of process src (unchanged if not distributed)
+    '''
+    if not is_distributed():
+        return value
+    tensor = torch.tensor([value], dtype=torch.int64)
+    dist.broadcast(tensor, src=src)
+    return int(tensor.item())
+
+
+def all_reduce_sum(values):
+    '''
+    Sum a list of numbers over all processes
+    :param values: list of python numbers
+    :return: list of the summed values (unchanged if not distributed)
+    '''
+    if not is_distributed():
+        return list(values)
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.tolist()
+
+
+def all_gather_objects(obj):
+    '''
+    Gather a picklable object from all processes
+    :return: list of the objects of every process, ordered by rank
+    '''
+    if not is_distributed():
+        return [obj]
+    objects = [None] * get_world_size()
+    dist.all_gather_object(objects, obj)
+    return objects
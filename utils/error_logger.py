@@ -1,5 +1,6 @@
 import numpy as np
 from .utils import csv_write
+from .distributed import is_distributed, all_gather_objects
 
 
 class BaseMeter(object):
@@ -83,6 +84,24 @@ class ErrorLogger(object):
 
             self.variables[split][key].update(value)
 
+    def synchronise(self):
+        '''
+        Gather the batch values of all processes of a distributed run, so that every process reports the
+        statistics of the whole epoch. Has to be called by all processes.
+        '''
+        if not is_distributed():
+            return
+        local_values = {split: {key: meter.vals for key, meter in variables.items() if isinstance(meter, StatMeter)}
+                        for split, variables in self.variables.items()}
+        gathered_values = all_gather_objects(local_values)
+        for split, variables in self.variables.items():
+            keys = set().union(*[process_values[split].keys() for process_values in gathered_values])
+            for key in keys:
+                if key not in variables:
+                    variables[key] = StatMeter(name=key)
+                variables[key].vals = [value for process_values in gathered_values
+                                       for value in process_values[split].get(key, [])]
+                variables[key].img_names = [None] * len(variables[key].vals)
 
     def get_errors(self, split):
         output = dict()
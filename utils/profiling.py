@@ -0,0 +1,68 @@
+import os
+import torch
+
+from utils.utils import mkdir
+
+
+def profile_training(model, loader, save_dir, wait=1, warmup=1, active=3, resolve_slabs=False, row_limit=50):
+    '''
+    Run wait + warmup + active training steps on real batches under torch.profiler and export the active steps
+    as a Chrome trace (open in chrome://tracing or https://ui.perfetto.dev) and per-operator summary tables
+    :param model: model to train, one optimizer step per batch
+    :param loader: training data loader, iterated again if it has fewer batches than steps
+    :param save_dir: experiment directory, results are written to <save_dir>/profile
+    :param wait: steps which are not recorded
+    :param warmup: steps which are recorded but discarded (profiler overhead settles)
+    :param active: recorded steps
+    :param resolve_slabs: reshape 2.5D batches of z-slabs into samples
+    :param row_limit: number of operators in the summary tables
+    :return: paths of the trace and the summary
+    '''
+    if not hasattr(torch, 'profiler') or not hasattr(torch.profiler, 'schedule'):
+        raise Exception('Profiling requires PyTorch >= 1.8.1 (torch.profiler)')
+
+    profile_dir = os.path.join(save_dir, 'profile')
+    mkdir(profile_dir)
+    trace_path = os.path.join(profile_dir, 'trace.json')
+    summary_path = os.path.join(profile_dir, 'operators.txt')
+
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    sort_by = 'self_cpu_time_total'
+    if model.use_cuda:
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+        sort_by = 'self_cuda_time_total'
+
+    def export(profiler):
+        profiler.export_chrome_trace(trace_path)
+        averages = profiler.key_averages()
+        with open(summary_path, 'w') as summary_file:
+            summary_file.write('Operators by self time ({0} active steps)\n'.format(active))
+            summary_file.write(averages.table(sort_by=sort_by, row_limit=row_limit))
+            summary_file.write('\n\nOperators by input shape\n')
+            summary_file.write(profiler.key_averages(group_by_input_shape=True).table(sort_by=sort_by,
+                                                                                      row_limit=row_limit))
+            summary_file.write('\n\nOperators by self memory\n')
+            summary_file.write(averages.table(sort_by='self_cpu_memory_usage', row_limit=row_limit))
+        print(averages.table(sort_by=sort_by, row_limit=20))
+
+    def batches():
+        while True:
+            for batch in loader:
+                yield batch
+
+    n_steps = wait + warmup + active
+    print('Profiling {0} training steps (wait {1}, warmup {2}, active {3})'.format(n_steps, wait, warmup, active))
+    schedule = torch.profiler.schedule(wait=wait, warmup=warmup, active=active, repeat=1)
+    with torch.profiler.profile(activities=activities, schedule=schedule, on_trace_ready=export,
+                                record_shapes=True, profile_memory=True) as profiler:
+        for step, (images, labels, _) in zip(range(n_steps), batches()):
+            if resolve_slabs:
+                images = images.view(-1, *(images.size()[2:]))
+                labels = labels.view(-1, *(labels.size()[2:]))
+            with torch.profiler.record_function('training_step'):
+                model.set_input(images, labels)
+                model.optimize_parameters_accumulate_grd(1, 1, 1)
+            profiler.step()
+
+    print('Chrome trace written to {0}, operator summary to {1}'.format(trace_path, summary_path))
+    return trace_path, summary_path
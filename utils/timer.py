@@ -0,0 +1,105 @@
+import time
+import contextlib
+from collections import OrderedDict
+import numpy as np
+import torch
+
+
+class StageTimer(object):
+    """
+    Wall time of the stages of every training iteration (data wait, input transfer, forward, loss, backward,
+    optimizer step, metrics, visualisation) and the resulting throughput. Statistics are reset after every epoch.
+    """
+    STAGES = ['data', 'set_input', 'forward', 'loss', 'backward', 'optimizer', 'metrics', 'visualisation']
+
+    def __init__(self, synchronize=False):
+        '''
+        :param synchronize: wait for the GPU at the end of every stage, kernels run asynchronously otherwise and their
+         time is attributed to the next stage which synchronises (eg. metrics)
+        '''
+        self.synchronize = synchronize and torch.cuda.is_available()
+        self.reset()
+
+    def reset(self):
+        self.iterations = []
+        self.current = None
+        self.n_samples = 0
+        self.n_voxels = 0
+        self.epoch_start = None
+        self.elapsed = 0.0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.current is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.synchronize:
+                torch.cuda.synchronize()
+            self.current[name] = self.current.get(name, 0.0) + time.perf_counter() - start
+
+    def iterate(self, loader):
+        '''
+        Wrap a data loader, every batch starts a new iteration and the time spent waiting for it is its data stage
+        '''
+        iterator = iter(loader)
+        self.epoch_start = time.perf_counter()
+        while True:
+            self.current = OrderedDict()
+            try:
+                with self.stage('data'):
+                    batch = next(iterator)
+            except StopIteration:
+                self.current = None
+                break
+            yield batch
+            self.iterations.append(self.current)
+        self.elapsed += time.perf_counter() - self.epoch_start
+
+    def count(self, n_samples, n_voxels):
+        '''
+        :param n_samples: number of subjects in the current batch
+        :param n_voxels: number of voxels (of a single channel) in the current batch
+        '''
+        self.n_samples += n_samples
+        self.n_voxels += n_voxels
+
+    def get_stats(self):
+        '''
+        :return: OrderedDict of the median and 95th percentile time per iteration of every stage (ms), and the
+         throughput of the epoch in samples/s and voxels/s
+        '''
+        stats = OrderedDict()
+        if not self.iterations:
+            return stats
+        for name in self.STAGES + ['iteration']:
+            if name == 'iteration':
+                times = [sum(iteration.values()) for iteration in self.iterations]
+            elif any(name in iteration for iteration in self.iterations):
+                times = [iteration.get(name, 0.0) for iteration in self.iterations]
+            else:
+                continue
+            stats['{}_ms_p50'.format(name)] = 1000 * np.percentile(times, 50)
+            stats['{}_ms_p95'.format(name)] = 1000 * np.percentile(times, 95)
+        stats['samples_per_s'] = self.n_samples / max(self.elapsed, 1e-12)
+        stats['voxels_per_s'] = self.n_voxels / max(self.elapsed, 1e-12)
+        return stats
+
+    def get_summary(self, epoch=None):
+        stats = self.get_stats()
+        totals = OrderedDict((name, sum(iteration.get(name, 0.0) for iteration in self.iterations))
+                             for name in self.STAGES)
+        total_time = sum(totals.values())
+        message = '(epoch: {0}) stage timings\n'.format(epoch) if epoch is not None else 'stage timings\n'
+        for name, elapsed in totals.items():
+            if '{}_ms_p50'.format(name) not in stats:
+                continue
+            message += '  {0:<14} {1:9.2f} s {2:5.1f} % {3:9.2f} ms p50 {4:9.2f} ms p95\n'.format(
+                name, elapsed, 100 * elapsed / max(total_time, 1e-12), stats['{}_ms_p50'.format(name)],
+                stats['{}_ms_p95'.format(name)])
+        message += '  {0} iterations in {1:.2f} s, {2:.2f} samples/s, {3:.3e} voxels/s'.format(
+            len(self.iterations), self.elapsed, stats.get('samples_per_s', 0), stats.get('voxels_per_s', 0))
+        return message
@@ -245,6 +245,17 @@ def save_config(json_opts, json_filename, model, epoch):
 
     return model_path
 
+def is_due(epoch, every, n_epochs):
+    '''
+    Whether a periodic task (eg. evaluation) runs after an epoch, the last epoch always runs it
+    :param epoch: current epoch
+    :param every: period in epochs, 0 disables the task
+    :param n_epochs: total number of epochs
+    '''
+    if every <= 0:
+        return False
+    return (epoch + 1) % every == 0 or epoch == n_epochs - 1
+
 def rm_and_mkdir(path):
     if os.path.exists(path):
         print('removing dir ', path)
@@ -4,12 +4,60 @@ from collections import OrderedDict
 import os
 import ntpath
 import time
+import random
 from utils import utils, html
 from utils.plot_logs import plot_logs
 
 # Use the following comment to launch a visdom server
 # python -m visdom.server
 
+
+class VolumeReservoir():
+    """
+    Uniform random sample (reservoir sampling) of at most size subjects out of a stream of batches.
+    Subjects are selected before they are copied, so only the kept volumes ever leave the model.
+    """
+    def __init__(self, size, seed=0):
+        self.size = size
+        # own generator, the global random state drives the training
+        self.rng = random.Random(seed)
+        self.reset()
+
+    def reset(self):
+        self.n_seen = 0
+        self.ids = [None] * self.size
+        self.volumes = [None] * self.size
+
+    def select(self, n_subjects):
+        '''
+        :param n_subjects: number of subjects in the current batch
+        :return: list of (index in the batch, slot in the reservoir) of the subjects to keep
+        '''
+        selection = []
+        for batch_index in range(n_subjects):
+            if self.n_seen < self.size:
+                selection.append((batch_index, self.n_seen))
+            else:
+                slot = self.rng.randint(0, self.n_seen)
+                if slot < self.size:
+                    selection.append((batch_index, slot))
+            self.n_seen += 1
+        return selection
+
+    def put(self, slot, id, volumes):
+        self.ids[slot] = id
+        self.volumes[slot] = volumes
+
+    def get(self):
+        '''
+        :return: volumes stacked along the batch dimension and their ids
+        '''
+        slots = [slot for slot in range(self.size) if self.volumes[slot] is not None]
+        volumes = OrderedDict([(key, np.stack([self.volumes[slot][key] for slot in slots]))
+                               for key in self.volumes[slots[0]].keys()]) if slots else None
+        return volumes, [self.ids[slot] for slot in slots]
+
+
 class Visualiser():
     def __init__(self, opt, save_dir, filename='loss_log.txt'):
         self.display_id = opt.display_id
@@ -22,6 +70,9 @@ class Visualiser():
         self.name = os.path.basename(self.save_dir)
         self.saved = False
         self.display_single_pane_ncols = opt.display_single_pane_ncols
+        # number of subjects per split and epoch whose volumes are displayed or saved
+        self.n_volumes = opt.n_volumes if hasattr(opt, 'n_volumes') else 4
+        self.reservoirs = OrderedDict()
 
         # Error plots
         self.error_plots = dict()
@@ -41,6 +92,8 @@ class Visualiser():
             print('create web directory %s...' % self.web_dir)
             utils.mkdirs([self.web_dir, self.img_dir])
         self.log_name = os.path.join(self.save_dir, filename)
+        # sheets of the log table that already have a header
+        self.table_sheets = set()
         self.log_table = os.path.join(self.save_dir, filename.split('.')[0] + '.xlsx')
         if os.path.exists(self.log_table):
             timestamp = str(time.time()).split('.')[0]
@@ -53,6 +106,37 @@ class Visualiser():
     def reset(self):
         self.saved = False
 
+    def wants_volumes(self):
+        '''
+        :return: whether volumes are used at all (the same condition as in display_current_volumes)
+        '''
+        return self.display_id > 0 and self.save_to_disk
+
+    def capture_volumes(self, get_volumes, ids, split):
+        '''
+        Keep the volumes of a bounded random subsample of the subjects of a split, displayed after the epoch
+        :param get_volumes: function returning the volumes of the given indices of the current batch
+        (eg. model.get_current_volumes)
+        :param ids: ids of the subjects of the current batch
+        :param split: name of the split
+        '''
+        if split not in self.reservoirs:
+            self.reservoirs[split] = VolumeReservoir(self.n_volumes)
+        reservoir = self.reservoirs[split]
+        selection = reservoir.select(len(ids))
+        if not selection:
+            return
+        volumes = get_volumes([batch_index for batch_index, _ in selection])
+        for i, (batch_index, slot) in enumerate(selection):
+            reservoir.put(slot, ids[batch_index], OrderedDict([(key, value[i]) for key, value in volumes.items()]))
+
+    def display_captured_volumes(self, epoch):
+        for split, reservoir in self.reservoirs.items():
+            volumes, ids = reservoir.get()
+            if volumes is not None:
+                self.display_current_volumes(volumes, ids, split, epoch)
+            reservoir.reset()
+
     def display_current_volumes(self, volumes, ids, split, epoch):
         if not self.display_id > 0 or not self.save_to_disk:  # iamges not needed
             return
@@ -212,11 +296,16 @@ class Visualiser():
         with open(self.log_name, "a") as log_file:
             log_file.write('%s\n' % message)
 
+        # splits are not necessarily logged from the first epoch on (evaluation cadence, resumed runs)
         error_df = pd.DataFrame(data=[error_df], columns=error_df_header)
-        if epoch == 0:
-            utils.append_df_to_excel(self.log_table, error_df, sheet_name=split_name, header=True)
-        else:
-            utils.append_df_to_excel(self.log_table, error_df, sheet_name=split_name, header=False)
+        utils.append_df_to_excel(self.log_table, error_df, sheet_name=split_name,
+                                 header=split_name not in self.table_sheets)
+        self.table_sheets.add(split_name)
+
+    def print_current_message(self, message):
+        print(message)
+        with open(self.log_name, "a") as log_file:
+            log_file.write('%s\n' % message)
 
     def save_plots(self, epoch, save_frequency):
         if epoch % save_frequency == 0: